@@ -1,10 +1,28 @@
 # app.py (full, TMP_MAX_TOTAL_GB mặc định 1.5GB, auto xóa >12h)
-import os, io, zipfile, tempfile, time, uuid, re, glob, importlib, inspect, threading, fnmatch, shutil
+import os, io, zipfile, tempfile, time, uuid, re, importlib, inspect, threading, fnmatch, shutil, json, hashlib, fcntl
+import multiprocessing
 import requests
+import zip_inspect
+import zip_stream
+import scheduler
+import worker_pool
+import txt_index
+import result_model
+import bundle_manifest
+import checker_registry
+import gzip_head
+import executor_service
+import job_spool
+import disk_budget
+from disk_budget import human
+# giải nén + chọn data_dir: dùng chung với CLI batch_check
+from bundle_extract import (EXTRACT_HEADROOM_BYTES, extract_needed, is_needed_member,
+                            canonical_data_dir as _canonical_data_dir)
 from datetime import datetime, timedelta
+from contextlib import contextmanager, nullcontext
 from flask import Flask, request, jsonify, make_response, send_file, redirect
 from flask_cors import CORS
-from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from werkzeug.utils import secure_filename
 
 # boto3 (optional, cho S3 nếu dùng)
 try:
@@ -39,19 +57,44 @@ def dir_size_bytes(path: str) -> int:
                 pass
     return total
 
-def human(n):
-    for u in ["B","KB","MB","GB","TB"]:
-        if n < 1024: return f"{n:.1f}{u}"
-        n /= 1024
-    return f"{n:.1f}PB"
+def _janitor_items(base_dir: str):
+    """Liệt kê (path, mtime, size) ở cấp 1 của base_dir; bỏ qua file phụ (.json/.lock) của ZIP cache."""
+    items, total = [], 0
+    for name in os.listdir(base_dir):
+        if name.startswith((ZIP_CACHE_PREFIX, UPLOAD_SESSION_PREFIX)) and name.endswith((".json", ".lock")):
+            continue
+        p = os.path.join(base_dir, name)
+        try:
+            st = os.stat(p)
+            size = dir_size_bytes(p) if os.path.isdir(p) else st.st_size
+            total += size
+            items.append((p, st.st_mtime, size))
+        except Exception:
+            pass
+    return items, total
+
+def _janitor_remove(p: str) -> bool:
+    """Xóa 1 item; ZIP cache đang được dùng / upload đang dở thì bỏ qua (trả False)."""
+    if os.path.basename(p).startswith(UPLOAD_SESSION_PREFIX):
+        return _evict_upload_session(p)
+    if os.path.basename(p).startswith(ZIP_CACHE_PREFIX):
+        if p.endswith(".part"):  # đang tải dở: chỉ xóa khi bị bỏ rơi lâu
+            if time.time() - os.path.getmtime(p) < 3600:
+                return False
+            os.remove(p)
+            return True
+        return _evict_zip_cache_entry(p)
+    if os.path.isdir(p):
+        shutil.rmtree(p, ignore_errors=True)
+    else:
+        try: os.remove(p)
+        except Exception: return False
+    return True
 
-def ensure_free_space(min_free_bytes: int, base_dir: str = "/tmp"):
-    """Raise RuntimeError nếu dung lượng trống < ngưỡng."""
-    usage = shutil.disk_usage(base_dir)
-    if usage.free < min_free_bytes:
-        raise RuntimeError(
-            f"Hệ thống sắp đầy đĩa: còn {human(usage.free)} trống (< {human(min_free_bytes)})."
-        )
+def _janitor_reserved(p: str, reserved: set) -> bool:
+    """p (cấp 1 của UPLOAD_DIR) là / chứa chỗ mà 1 job đang giữ chỗ để ghi."""
+    p = os.path.abspath(p)
+    return any(r == p or r.startswith(p + os.sep) for r in reserved)
 
 def cleanup_uploads(max_age_hours: int = 12,
                     max_total_bytes: int = int(1.5 * 1024**3),   # ~1.5 GB (mặc định mới)
@@ -60,45 +103,44 @@ def cleanup_uploads(max_age_hours: int = 12,
     Xóa thư mục/file tạm quá tuổi hoặc khi tổng dung lượng vượt ngưỡng.
     1) Xóa theo tuổi (> max_age_hours)
     2) Nếu vẫn > ngưỡng: xóa LRU (cũ trước) cho tới khi đủ.
+    ZIP cache (zipcache_*.zip) tính chung vào ngân sách; entry đang dùng không bị xóa.
+    Phần job đang giữ/chờ giữ chỗ (disk_budget) cũng tính vào ngân sách; chỗ job đang ghi không bị xóa.
     """
     try:
         if not os.path.isdir(base_dir): return
         now = time.time()
-        items = []
-        total = 0
-        for name in os.listdir(base_dir):
-            p = os.path.join(base_dir, name)
-            try:
-                st = os.stat(p)
-                size = dir_size_bytes(p) if os.path.isdir(p) else os.path.getsize(p)
-                total += size
-                items.append((p, st.st_mtime, size))
-            except Exception:
-                pass
+        items, _ = _janitor_items(base_dir)
+        reserved = disk_budget.reserved_paths()
+        items = [it for it in items if not _janitor_reserved(it[0], reserved)]
 
         # 1) Xóa theo tuổi
         cutoff = now - max_age_hours * 3600
         for p, mtime, _ in items:
             if mtime < cutoff:
-                shutil.rmtree(p, ignore_errors=True)
+                _janitor_remove(p)
+        for name in os.listdir(base_dir):
+            if name.startswith(ZIP_CACHE_PREFIX) and name.endswith(".lock"):
+                p = os.path.join(base_dir, name)
+                if not os.path.exists(p[:-len(".lock")] + ".zip") and os.path.getmtime(p) < cutoff:
+                    try: os.remove(p)
+                    except Exception: pass
+            elif name.startswith(UPLOAD_SESSION_PREFIX) and name.endswith((".json", ".lock")):
+                p = os.path.join(base_dir, name)
+                if not os.path.exists(p.rsplit(".", 1)[0] + ".part") and os.path.getmtime(p) < cutoff:
+                    _evict_upload_session(p)
 
         # Quét lại
-        items2, total2 = [], 0
-        for name in os.listdir(base_dir):
-            p = os.path.join(base_dir, name)
-            try:
-                st = os.stat(p)
-                size = dir_size_bytes(p) if os.path.isdir(p) else os.path.getsize(p)
-                total2 += size
-                items2.append((p, st.st_mtime, size))
-            except Exception:
-                pass
+        items2, total2 = _janitor_items(base_dir)
+        total2 += disk_budget.pending_bytes(base_dir)
+        reserved = disk_budget.reserved_paths()
+        items2 = [it for it in items2 if not _janitor_reserved(it[0], reserved)]
 
         # 2) Nếu vẫn > ngưỡng -> xóa LRU
         if total2 > max_total_bytes:
             items2.sort(key=lambda x: x[1])  # mtime tăng dần (cũ trước)
             for p, _, sz in items2:
-                shutil.rmtree(p, ignore_errors=True)
+                if not _janitor_remove(p):
+                    continue
                 total2 -= sz
                 if total2 <= max_total_bytes:
                     break
@@ -106,41 +148,259 @@ def cleanup_uploads(max_age_hours: int = 12,
         # Không để lỗi dọn rác phá request
         pass
 
+def _run_janitor():
+    cleanup_uploads(
+        max_age_hours=int(os.environ.get("TMP_MAX_AGE_H", "12")),
+        # cho phép số thực, ví dụ "1.5"
+        max_total_bytes=int(float(os.environ.get("TMP_MAX_TOTAL_GB", "1.5")) * 1024**3),
+    )
+
+# Job đang chờ chỗ trên đĩa (disk_budget) gọi janitor dọn sớm thay vì đợi request tới
+disk_budget.set_janitor(_run_janitor)
+
 @app.before_request
 def _maybe_cleanup_tmp():
     # 1% xác suất dọn rác cho mỗi request (nhẹ, không block)
     if uuid.uuid4().int % 100 == 0:
-        cleanup_uploads(
-            max_age_hours=int(os.environ.get("TMP_MAX_AGE_H", "12")),
-            # cho phép số thực, ví dụ "1.5"
-            max_total_bytes=int(float(os.environ.get("TMP_MAX_TOTAL_GB", "1.5")) * 1024**3),
-        )
+        _run_janitor()
 
 # ================ Job store & ProcessPool ================
-JOBS = {}  # job_id -> {"status": "queued|running|done|error", "result": ..., "error": ..., "updated": datetime}
+JOBS = {}  # job_id -> {"status": "preparing|queued|running|done|error|cancelled", "lane": ..., "result": ..., "error": ..., "updated": datetime}
 
-WORKERS = int(os.environ.get("WORKERS", "2"))
+# Số worker: WORKERS (env) nếu có, không thì tự tính từ số CPU và RAM khả dụng
+# (có EXECUTOR_SOCKET: số worker thật và SCHED dùng là của executor service)
+WORKER_MEM_MB = int(os.environ.get("WORKER_MEM_MB", "512"))  # RAM ước lượng cho 1 worker (cây BeautifulSoup lớn)
+WORKERS = int(os.environ.get("WORKERS") or
+              scheduler.auto_worker_count(WORKER_MEM_MB * 1024 * 1024, min_workers=2))
 JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", "900"))  # 15 phút
-EXEC = ProcessPoolExecutor(max_workers=WORKERS)
+# Quá hạn/bị hủy: báo worker tự dừng, chờ thêm KILL_GRACE_S giây rồi mới kill + tạo worker mới
+KILL_GRACE_S = float(os.environ.get("KILL_GRACE_S", "10"))
+# Client đã poll rồi bỏ đi quá JOB_ABANDON_S giây -> coi như hủy job; 0 = tắt
+JOB_ABANDON_S = int(os.environ.get("JOB_ABANDON_S", "300"))
+# Tái tạo worker sau N job để chặn RAM phình (cây BeautifulSoup); 0 = không recycle
+MAX_TASKS_PER_CHILD = int(os.environ.get("MAX_TASKS_PER_CHILD", "0"))
+
+# Module nạp sẵn trong mỗi worker (tool mới: khai báo trong checker_registry là đủ)
+WARM_MODULES = ("bs4", "lxml", "lxml.etree") + checker_registry.CHECKER_MODULES
+
+# pid -> {"ready_at": ..., "warm_sec": ..., "loaded": [...], "failed": {...}}
+POOL_STATE = {"created": time.time(), "workers": {}}
+
+def _warm_worker(ready_queue):
+    """Initializer của ProcessPool: import sẵn tool + bs4/lxml, chạy warmup() của từng tool, báo sẵn sàng."""
+    t0 = time.time()
+    loaded, failed = [], {}
+    for name in WARM_MODULES:
+        try:
+            mod = importlib.import_module(name)
+            warm = getattr(mod, "warmup", None)
+            if callable(warm):
+                warm()
+            loaded.append(name)
+        except Exception as e:
+            failed[name] = f"{type(e).__name__}: {e}"
+    try:
+        ready_queue.put({"pid": os.getpid(), "ready_at": time.time(),
+                         "warm_sec": round(time.time() - t0, 3), "loaded": loaded, "failed": failed})
+    except Exception:
+        pass
+
+def _drain_ready_queue(q):
+    while True:
+        try:
+            info = q.get()
+        except Exception:
+            return
+        POOL_STATE["workers"][info["pid"]] = info
+
+def _make_executor(start_method: str = None):
+    """
+    Khởi động đủ WORKERS process ngay khi deploy -> job đầu tiên không phải chờ import.
+    start_method: cách tạo worker mặc định của process gọi (WORKER_START_METHOD luôn được ưu tiên).
+    """
+    ctx = multiprocessing.get_context(os.environ.get("WORKER_START_METHOD") or start_method)
+    ready_q = ctx.Queue()
+    threading.Thread(target=_drain_ready_queue, args=(ready_q,), daemon=True).start()
+    return worker_pool.WorkerPool(WORKERS, mp_context=ctx,
+                                  initializer=_warm_worker, initargs=(ready_q,),
+                                  max_tasks_per_child=MAX_TASKS_PER_CHILD, kill_grace=KILL_GRACE_S)
+
+def pool_status() -> dict:
+    if isinstance(EXEC, executor_service.ExecutorClient):
+        return EXEC.status()  # pool ở executor service
+    alive = {}
+    for pid, info in list(POOL_STATE["workers"].items()):
+        try:
+            os.kill(pid, 0)
+            alive[pid] = info
+        except OSError:
+            POOL_STATE["workers"].pop(pid, None)
+    return {"workers": WORKERS, "ready": len(alive),
+            "max_tasks_per_child": MAX_TASKS_PER_CHILD or None,
+            "detail": list(alive.values()),
+            **(EXEC.status() if EXEC is not None else {})}
+
+# Pool được tạo ở cuối file: worker fork ra phải thấy module app đã nạp đầy đủ
+EXEC = None
+
+# SPOOL_DIR: app chỉ là API — job ghi vào spool dùng chung, spool_worker (1 hay nhiều máy) chạy job
+# và ghi kết quả lại (xem job_spool.py); JOBS chỉ còn dùng trong spool_worker
+SPOOL_DIR = os.environ.get("SPOOL_DIR")
+SPOOL = job_spool.Spool(SPOOL_DIR) if SPOOL_DIR else None
 
 def _gc_jobs(hours: int = 6):
     cutoff = datetime.utcnow() - timedelta(hours=hours)
     for k, v in list(JOBS.items()):
         if v.get("updated") and v["updated"] < cutoff:
             del JOBS[k]
+    if SPOOL is not None:
+        SPOOL.gc(hours)
+
+# ================ Scheduler: lane theo tool + nhận job theo chi phí ================
+# MD chạy nhanh -> lane "light"; các tool còn lại -> "heavy". Lane heavy không bao giờ chiếm
+# hết slot: luôn chừa LIGHT_RESERVED_SLOTS cho job MD, để MD không kẹt sau bundle Civitek lớn.
+LIGHT_RESERVED_SLOTS = int(os.environ.get("LIGHT_RESERVED_SLOTS", "1"))
+# Lane + hệ số chi phí trên mỗi byte XML/TXT của từng tool: CHECKER["lane"] / ["cost_weight"] (checker_registry)
+# Nhiều người dùng: mỗi client (client_id gửi từ chatbot.html) chạy tối đa CLIENT_MAX_RUNNING job cùng lúc;
+# job "bulk" chờ quá PRIORITY_AGING_S giây thì được xếp ngang "interactive"
+CLIENT_MAX_RUNNING = int(os.environ.get("CLIENT_MAX_RUNNING") or max(1, WORKERS - 1))
+PRIORITY_AGING_S = int(os.environ.get("PRIORITY_AGING_S", "300"))
+SCHED = scheduler.LaneScheduler(WORKERS, {
+    "light": WORKERS,
+    "heavy": max(1, WORKERS - LIGHT_RESERVED_SLOTS),
+}, client_max_running=CLIENT_MAX_RUNNING, priority_aging_s=PRIORITY_AGING_S)
+
+def scheduler_state() -> dict:
+    """SCHED.metrics() của nơi thật sự xếp hàng (executor service nếu có EXECUTOR_SOCKET)."""
+    if isinstance(EXEC, executor_service.ExecutorClient):
+        return EXEC.scheduler_metrics()
+    return SCHED.metrics()
+
+def queue_position(job_id: str):
+    if isinstance(EXEC, executor_service.ExecutorClient):
+        return EXEC.queue_position(job_id)
+    return SCHED.queue_position(job_id)
+
+def _estimate_cost(module_name: str, data_dir: str, only_files=None) -> int:
+    """
+    Chi phí ước lượng = tổng dung lượng XML + *_content.txt trong data_dir x hệ số của tool
+    (only_files: chỉ tính các cặp file sẽ được kiểm tra lại).
+    """
+    wanted = {result_model.pair_key(n) for n in only_files} if only_files is not None else None
+    total = 0
+    sizes = bundle_manifest.entries(data_dir)  # size lúc giải nén (đủ cho ước lượng)
+    if sizes is None:
+        try:
+            with os.scandir(data_dir) as it:
+                sizes = [(e.name, e.stat().st_size, None) for e in it if e.is_file()]
+        except OSError:
+            sizes = []
+    for name, size, _ in sizes:
+        low = name.lower()
+        if (low.endswith(".xml") or low.endswith("_content.txt")) \
+                and (wanted is None or result_model.pair_key(low) in wanted):
+            total += size
+    decl = checker_registry.get(module_name)
+    return int(total * (decl["cost_weight"] if decl else 1.0))
+
+# ================ Hủy job ================
+# Cờ hủy là file trong UPLOAD_DIR (worker ở process khác vẫn thấy); janitor tự dọn file sót.
+JOB_LAST_POLL = {}  # job_id -> time.time() lần poll gần nhất
+
+def _cancel_flag_path(job_id: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"cancel_{job_id}.flag")
+
+def _request_cancel(job_id: str):
+    try:
+        with open(_cancel_flag_path(job_id), "w") as f:
+            f.write(str(time.time()))
+    except OSError:
+        pass
+    SCHED.cancel(job_id)
+
+def _job_abandoned(job_id: str) -> bool:
+    last = JOB_LAST_POLL.get(job_id)
+    return bool(JOB_ABANDON_S and last and time.time() - last > JOB_ABANDON_S)
+
+def _job_cancelled(job_id: str) -> bool:
+    if os.path.exists(_cancel_flag_path(job_id)):
+        return True
+    if _job_abandoned(job_id):
+        _request_cancel(job_id)  # để worker cũng thấy cờ hủy
+        return True
+    return False
+
+def _run_command_background(job_id: str, command: str, client: str = None, priority: str = "interactive",
+                            recheck: dict = None):
+    """
+    Tải/giải nén ở thread nền (I/O, không giữ slot), rồi chờ slot trong lane của tool
+    và chạy phần kiểm tra ở process khác (CPU-bound không chặn web worker).
+    Hủy/quá hạn: worker tự dừng và trả kết quả dở dang; không dừng kịp thì bị kill.
+    recheck={"base": kết quả job cũ, "files": [...]}: chỉ chạy lại các file đó rồi gộp vào kết quả cũ.
+    """
+    stop = {"reason": None}
+
+    def _on_stop(reason):
+        stop["reason"] = reason
+        if reason == "timeout":
+            _request_cancel(job_id)
+
+    def _stopped_status(partial=None):
+        if stop["reason"] == "timeout":
+            job = {"status": "error", "error": f"Timeout > {JOB_TIMEOUT}s"}
+        else:
+            reason = "client không còn theo dõi" if _job_abandoned(job_id) else "theo yêu cầu"
+            job = {"status": "cancelled", "error": f"Đã hủy ({reason})"}
+        if partial is not None:
+            job["result"], job["partial"] = partial, True
+        job["updated"] = datetime.utcnow()
+        return job
 
-def _run_command_background(job_id: str, command: str):
-    """Chạy command trong tiến trình riêng (CPU-bound không chặn web worker)."""
     try:
-        JOBS[job_id] = {"status": "running", "updated": datetime.utcnow()}
-        fut = EXEC.submit(route_command, command)  # chạy ở process khác
-        res = fut.result(timeout=JOB_TIMEOUT)
-        if res.get("ok"):
+        JOBS[job_id] = {"status": "preparing", "updated": datetime.utcnow()}
+        prep = _prepare_recheck(recheck) if recheck else prepare_command(command)
+        if prep.get("ok") and not prep.get("help"):
+            if _job_cancelled(job_id):
+                stop["reason"] = "cancel"
+                JOBS[job_id] = _stopped_status()
+                return
+            lane, cost = prep["lane"], prep["cost"]
+            prep["cancel_flag"] = _cancel_flag_path(job_id)
+            info = {"lane": lane, "cost": cost, "client": client, "priority": priority}
+            JOBS[job_id] = {"status": "queued", **info, "updated": datetime.utcnow()}
+
+            def _admitted():
+                JOBS[job_id] = {"status": "running", **info, "updated": datetime.utcnow()}
+
+            slot = {"lane": lane, "cost": cost, "job_id": job_id, "client": client, "priority": priority}
+            if isinstance(EXEC, executor_service.ExecutorClient):
+                # chờ slot trong SCHED của service (hàng đợi chung mọi web worker), hủy khi chờ cũng qua đó
+                res = EXEC.run(run_prepared, prep, timeout=JOB_TIMEOUT, slot=slot, on_admit=_admitted,
+                               cancelled=lambda: _job_cancelled(job_id), on_stop=_on_stop)
+            else:
+                with SCHED.slot(**slot, on_admit=_admitted, cancelled=lambda: _job_cancelled(job_id)):
+                    res = EXEC.run(run_prepared, prep, timeout=JOB_TIMEOUT,  # chạy ở process khác
+                                   cancelled=lambda: _job_cancelled(job_id), on_stop=_on_stop)
+        else:
+            res = prep
+        if res.get("ok") and (stop["reason"] or res.get("cancelled")):
+            stop["reason"] = stop["reason"] or "cancel"
+            JOBS[job_id] = _stopped_status({
+                "result": res.get("output"),
+                "report": res.get("report"),
+                "module": res.get("module"),
+                "fn": res.get("fn"),
+                "data_dir": res.get("data_dir"),
+            })
+        elif res.get("ok"):
             if res.get("help"):
                 out = {"result": res.get("message"), "help": True}
             else:
+                if recheck:
+                    res = _merge_recheck(recheck["base"], res)
                 out = {
                     "result": res.get("output"),
+                    "report": res.get("report"),
                     "module": res.get("module"),
                     "fn": res.get("fn"),
                     "data_dir": res.get("data_dir"),
@@ -148,10 +408,21 @@ def _run_command_background(job_id: str, command: str):
             JOBS[job_id] = {"status": "done", "result": out, "updated": datetime.utcnow()}
         else:
             JOBS[job_id] = {"status": "error", "error": res.get("error"), "updated": datetime.utcnow()}
-    except TimeoutError:
-        JOBS[job_id] = {"status": "error", "error": f"Timeout > {JOB_TIMEOUT}s", "updated": datetime.utcnow()}
+    except scheduler.Cancelled:
+        stop["reason"] = "cancel"
+        JOBS[job_id] = _stopped_status()
+    except worker_pool.JobKilled as e:
+        stop["reason"] = str(e)
+        JOBS[job_id] = _stopped_status()
+        JOBS[job_id]["error"] += " — worker không tự dừng kịp nên đã bị kill"
     except Exception as e:
         JOBS[job_id] = {"status": "error", "error": f"{type(e).__name__}: {e}", "updated": datetime.utcnow()}
+    finally:
+        JOB_LAST_POLL.pop(job_id, None)
+        try:
+            os.remove(_cancel_flag_path(job_id))
+        except OSError:
+            pass
 
 # ================== ZIP helpers & download ==================
 def analyze_zip_stream(body_bytes: bytes) -> dict:
@@ -174,111 +445,190 @@ def analyze_zip_file(zip_path: str) -> dict:
     except Exception as e:
         return {"ok": False, "error": f"{type(e).__name__}: {e}"}
 
-def _normalize_gdrive(url: str) -> str:
+def _gdrive_file_id(url: str):
     m = re.search(r"/file/d/([^/]+)", url)
     if m:
-        return f"https://drive.google.com/uc?export=download&id={m.group(1)}"
+        return m.group(1)
     m = re.search(r"[?&]id=([^&]+)", url)
     if m:
-        return f"https://drive.google.com/uc?export=download&id={m.group(1)}"
+        return m.group(1)
+    return None
+
+def _normalize_gdrive(url: str) -> str:
+    file_id = _gdrive_file_id(url)
+    if file_id:
+        return f"https://drive.google.com/uc?export=download&id={file_id}"
     return url
 
-def _download_zip_to_file(url: str, dest_path: str):
-    """
-    - Tải ZIP 1MB/chunk (nhanh hơn).
-    - Bỏ qua HTML confirm của Google Drive nếu có.
-    - Xác thực nội dung cuối cùng là ZIP.
-    - Kiểm tra dung lượng trống trước khi ghi.
-    """
-    ensure_free_space(min_free_bytes=500 * 1024 * 1024, base_dir=os.path.dirname(dest_path))
+def _open_zip_response(s: requests.Session, url: str, headers: dict = None):
+    """Mở response (stream) tới file ZIP; bỏ qua HTML confirm của Google Drive nếu có."""
     is_drive = "drive.google.com" in url
     if is_drive:
         url = _normalize_gdrive(url)
+    r = s.get(url, headers=headers, stream=True, allow_redirects=True, timeout=(30, 300))
+    if is_drive and "text/html" in (r.headers.get("Content-Type", "")).lower():
+        try:
+            text = r.text
+            if "confirm=" in text and "uc?export=download" in text:
+                m = re.search(r'href="(\/uc\?export=download[^"]+confirm=[^"]+)"', text)
+                if m:
+                    confirm_url = "https://drive.google.com" + m.group(1).replace("&amp;", "&")
+                    r = s.get(confirm_url, headers=headers, stream=True, allow_redirects=True, timeout=(30, 300))
+        except Exception:
+            pass
+    r.raise_for_status()
+    return r
+
+def _response_validators(r) -> dict:
+    length = r.headers.get("Content-Length")
+    return {
+        "etag": r.headers.get("ETag") or None,
+        "content_length": int(length) if length and length.isdigit() else None,
+    }
 
-    with requests.Session() as s:
-        r = s.get(url, stream=True, allow_redirects=True, timeout=(30, 300))
-        if is_drive and "text/html" in (r.headers.get("Content-Type", "")).lower():
-            try:
-                text = r.text
-                if "confirm=" in text and "uc?export=download" in text:
-                    m = re.search(r'href="(\/uc\?export=download[^"]+confirm=[^"]+)"', text)
-                    if m:
-                        confirm_url = "https://drive.google.com" + m.group(1).replace("&amp;", "&")
-                        r = s.get(confirm_url, stream=True, allow_redirects=True, timeout=(30, 300))
-            except Exception:
-                pass
-
-        r.raise_for_status()
-        with open(dest_path, "wb") as f:
-            for chunk in r.iter_content(1024 * 1024):  # 1MB/chunk
-                if chunk:
-                    f.write(chunk)
-
+def _save_zip_response(r, dest_path: str):
+    with open(dest_path, "wb") as f:
+        for chunk in r.iter_content(1024 * 1024):  # 1MB/chunk
+            if chunk:
+                f.write(chunk)
     if not zipfile.is_zipfile(dest_path):
         raise ValueError("Nội dung tải về không phải file ZIP.")
 
-# ========= Chỉ extract file cần (XML & *_content.txt) =========
-def extract_needed(zippath: str, outdir: str):
+# ================== ZIP download cache ==================
+# Cache ZIP tải từ URL theo Drive file ID (URL khác: sha1 của URL), nằm ngay trong UPLOAD_DIR
+# để janitor tính chung ngân sách dung lượng:
+#   zipcache_<key>.zip   nội dung
+#   zipcache_<key>.json  ETag / Content-Length / thời điểm tải
+#   zipcache_<key>.lock  flock: "fill" (EX khi tải) trên .lock, "use" (SH khi đang dùng) trên .zip
+ZIP_CACHE_PREFIX = "zipcache_"
+ZIP_CACHE_TTL_S = int(os.environ.get("ZIP_CACHE_TTL_S", "600"))  # khi server không trả ETag/Content-Length
+ZIP_CACHE_FRESH_S = int(os.environ.get("ZIP_CACHE_FRESH_S", "60"))  # vừa tải xong: dùng luôn, không hỏi lại server
+ZIP_UNKNOWN_SIZE_BYTES = 500 * 1024 * 1024  # server không trả Content-Length: giữ chỗ tạm ngần này
+
+def _zip_cache_key(url: str) -> str:
+    file_id = _gdrive_file_id(url) if "drive.google.com" in url else None
+    if file_id:
+        return "gd_" + re.sub(r"[^A-Za-z0-9_-]+", "_", file_id)
+    return "url_" + hashlib.sha1(url.encode("utf-8")).hexdigest()[:24]
+
+def _zip_cache_paths(key: str):
+    base = os.path.join(UPLOAD_DIR, f"{ZIP_CACHE_PREFIX}{key}")
+    return base + ".zip", base + ".json", base + ".lock"
+
+def _zip_cache_meta(zip_path: str, meta_path: str):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return meta if os.path.isfile(zip_path) else None
+    except Exception:
+        return None
+
+def _zip_cache_valid(zip_path: str, meta_path: str, remote: dict) -> bool:
+    meta = _zip_cache_meta(zip_path, meta_path)
+    if meta is None:
+        return False
+    size = os.path.getsize(zip_path)
+    if remote.get("etag") and meta.get("etag"):
+        return remote["etag"] == meta["etag"]
+    if remote.get("content_length") is not None and meta.get("content_length") is not None:
+        return remote["content_length"] == meta["content_length"] == size
+    return time.time() - meta.get("fetched_at", 0) < ZIP_CACHE_TTL_S
+
+def _fill_zip_cache(url: str, zip_path: str, meta_path: str):
+    """Gọi khi đang giữ lock "fill": dùng lại cache nếu ETag/Content-Length khớp, không thì tải mới."""
+    meta = _zip_cache_meta(zip_path, meta_path)
+    if meta and time.time() - meta.get("fetched_at", 0) < ZIP_CACHE_FRESH_S:
+        return False  # request đồng thời: vừa có lượt khác tải xong
+    with requests.Session() as s:
+        r = _open_zip_response(s, url)
+        try:
+            remote = _response_validators(r)
+            if _zip_cache_valid(zip_path, meta_path, remote):
+                return False
+            part = f"{zip_path}.{uuid.uuid4().hex}.part"
+            # giữ chỗ theo Content-Length (không có thì ZIP_UNKNOWN_SIZE_BYTES), chờ nếu đĩa đang bận
+            with disk_budget.reserve(remote["content_length"] or ZIP_UNKNOWN_SIZE_BYTES, UPLOAD_DIR,
+                                     path=part, label="download"):
+                try:
+                    _save_zip_response(r, part)
+                    os.replace(part, zip_path)
+                finally:
+                    if os.path.exists(part):
+                        os.remove(part)
+        finally:
+            r.close()
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"url": url, "fetched_at": time.time(), **remote}, f)
+    return True
+
+@contextmanager
+def _cached_zip(url: str):
     """
-    Chỉ giải nén *.xml và *_content.txt để giảm I/O và tăng tốc.
+    Trả path ZIP đã cache cho URL (dùng trong `with`).
+    - Request đồng thời cùng URL (kể cả khác process) chờ trên lock "fill" -> chỉ 1 lượt tải.
+    - Trong lúc `with`, entry được giữ lock "use" nên janitor không xóa.
     """
-    os.makedirs(outdir, exist_ok=True)
-    with zipfile.ZipFile(zippath, "r") as z:
-        for info in z.infolist():
-            name = info.filename
-            low = name.lower()
-            if low.endswith(".xml") or low.endswith("_content.txt"):
-                z.extract(info, path=outdir)
-
-# ================== Data-dir canonicalization ==================
-XML_PATTERNS = ["*.xml", "*.[xX][mM][lL]"]
-TXT_PATTERNS = ["*_content.txt", "*_CONTENT.TXT", "*_Content.txt"]
-
-def _has_data(dirpath: str) -> bool:
+    zip_path, meta_path, lock_path = _zip_cache_paths(_zip_cache_key(url))
+    lock_fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+    use_fd = None
     try:
-        for pat in XML_PATTERNS + TXT_PATTERNS:
-            if glob.glob(os.path.join(dirpath, pat)):
-                return True
-    except Exception:
-        pass
-    return False
-
-def _single_child_dir(dirpath: str):
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            os.utime(lock_path)
+            _fill_zip_cache(url, zip_path, meta_path)
+            os.utime(zip_path)  # LRU cho janitor
+            use_fd = os.open(zip_path, os.O_RDONLY)
+            fcntl.flock(use_fd, fcntl.LOCK_SH)
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        yield zip_path
+    finally:
+        if use_fd is not None:
+            os.close(use_fd)
+        os.close(lock_fd)
+
+def _evict_zip_cache_entry(zip_path: str) -> bool:
+    """Janitor: xóa 1 entry cache nếu không ai đang tải/dùng (flock non-blocking)."""
+    base = zip_path[:-len(".zip")] if zip_path.endswith(".zip") else zip_path
+    lock_path = base + ".lock"
     try:
-        names = [n for n in os.listdir(dirpath) if os.path.isdir(os.path.join(dirpath, n))]
-        if len(names) == 1:
-            return os.path.join(dirpath, names[0])
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
     except Exception:
-        pass
-    return None
-
-def _first_data_dir_recursive(root_dir: str):
+        return False
     try:
-        for cur, dirs, files in os.walk(root_dir):
-            if _has_data(cur):
-                return cur
-    except Exception:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        use_fd = os.open(zip_path, os.O_RDONLY)
+        try:
+            fcntl.flock(use_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            for p in (zip_path, base + ".json"):
+                try: os.remove(p)
+                except FileNotFoundError: pass
+        finally:
+            os.close(use_fd)
+        return True
+    except (BlockingIOError, FileNotFoundError):
+        return False
+    finally:
+        os.close(lock_fd)
+
+# ========= Phân tích ZIP chỉ qua central directory (Range) =========
+def _analyze_url_ranges(url: str) -> dict:
+    """
+    Đọc EOCD + central directory bằng HTTP Range (vài KB). Server không hỗ trợ Range
+    -> tải qua ZIP cache rồi đọc central directory từ file local (vẫn không nạp cả ZIP vào RAM).
+    """
+    try:
+        with requests.Session() as s:
+            reader = zip_inspect.HttpRangeReader(s, url, opener=_open_zip_response)
+            result = zip_inspect.analyze_zip_ranges(reader)
+            result["source_mode"] = "http-range"
+            return result
+    except zip_inspect.RangeNotSupported:
         pass
-    return None
-
-def _canonical_data_dir(root_dir: str) -> str:
-    root_dir = os.path.abspath(root_dir)
-    if os.path.isdir(root_dir) and _has_data(root_dir):
-        return root_dir
-    test_dir = os.path.join(root_dir, "Test")
-    if os.path.isdir(test_dir) and _has_data(test_dir):
-        return test_dir
-    child = _single_child_dir(root_dir)
-    if child:
-        test2 = os.path.join(child, "Test")
-        if os.path.isdir(test2) and _has_data(test2):
-            return test2
-        if _has_data(child):
-            return child
-    found = _first_data_dir_recursive(root_dir)
-    if found:
-        return found
-    return root_dir
+    with _cached_zip(url) as zip_path:
+        result = zip_inspect.analyze_zip_ranges(zip_inspect.LocalRangeReader(zip_path))
+        result["source_mode"] = "download"
+        return result
 
 # ================== Drive visibility probe ==================
 def _probe_drive_visibility(url: str):
@@ -320,7 +670,18 @@ def _probe_drive_visibility(url: str):
 # ================== Health & OPTIONS ==================
 @app.route("/api/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok", "time": time.time()})
+    out = {"status": "ok", "time": time.time(), "pool": pool_status(), "scheduler": scheduler_state(),
+           "disk": disk_budget.status()}
+    if SPOOL is not None:
+        out["spool"] = SPOOL.metrics()
+    return jsonify(out)
+
+@app.route("/api/scheduler", methods=["GET"])
+def scheduler_metrics():
+    """Số job đang chạy/đang chờ, độ trễ chờ p50/p95 theo từng lane."""
+    m = scheduler_state()
+    m["tool_lanes"] = {d["module"]: d["lane"] for d in checker_registry.declarations()}
+    return jsonify(m)
 
 @app.route("/api/<path:any_path>", methods=["OPTIONS"])
 def api_options(any_path):
@@ -330,6 +691,7 @@ def api_options(any_path):
     return resp
 
 # ================== Upload (form-data) ==================
+# Upload 1 lần cả file (giữ cho tương thích); chatbot.html dùng /api/upload/* (chunk, resume được)
 @app.route("/api/upload-files", methods=["POST", "OPTIONS"])
 def upload_files():
     if request.method == "OPTIONS":
@@ -340,16 +702,439 @@ def upload_files():
         f = request.files["file"]
         if f.filename == "":
             return jsonify({"error": "Tên file rỗng"}), 400
-        ensure_free_space(min_free_bytes=500 * 1024 * 1024, base_dir=UPLOAD_DIR)
         save_path = os.path.join(UPLOAD_DIR, f.filename)
-        f.save(save_path)
+        with disk_budget.reserve(request.content_length or 0, UPLOAD_DIR, path=save_path, label="upload",
+                                 wait=disk_budget.DISK_WAIT_REQUEST_S):
+            f.save(save_path)
         return jsonify({"status": "ok", "filename": f.filename, "saved_to": save_path})
     except OSError as e:
         if getattr(e, "errno", None) == 28:  # ENOSPC
             return jsonify({"ok": False, "error": "Server hết dung lượng tạm, vui lòng thử lại sau."}), 507
         raise
 
+# ================== Upload theo chunk (resume được) ==================
+# init -> PUT từng chunk (offset + sha256) ghi nối thẳng vào file đích -> complete (kiểm tra ZIP,
+# tùy chọn extract + chạy lệnh). Trạng thái nằm trên đĩa (upload_<id>.json) nên rớt mạng,
+# reload trang hay request rơi vào process web khác đều resume được.
+# mode="stream": không lưu byte ZIP, mỗi chunk được giải nén ngay (zip_stream) vào upload_<id>.d;
+# chunk cuối tới là data_dir sẵn sàng. Bộ giải nén nằm trong RAM của process web (như JOBS)
+# -> chỉ resume được khi process còn sống, mất thì client upload lại từ đầu.
+# Chỗ trên đĩa được giữ cho cả phiên (disk_budget.hold, khoá upload:<id>) từ init tới complete / hủy /
+# janitor dọn: mode "file" giữ phần còn phải nhận (sống theo UPLOAD_STALE_S, process nào cũng tiếp được),
+# mode "stream" (không lưu byte ZIP) giữ số byte member đã hứa mà chưa ghi, theo process giữ bộ giải nén.
+UPLOAD_SESSION_PREFIX = "upload_"
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_MB", "8")) * 1024 * 1024
+UPLOAD_MAX_CHUNK = 64 * 1024 * 1024
+UPLOAD_MAX_SIZE = int(os.environ.get("UPLOAD_MAX_MB", "2048")) * 1024 * 1024
+UPLOAD_STALE_S = 3600  # upload dở không có chunk mới quá 1h -> janitor được xóa
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+def _upload_paths(upload_id: str):
+    base = os.path.join(UPLOAD_DIR, f"{UPLOAD_SESSION_PREFIX}{upload_id}")
+    return base + ".part", base + ".json", base + ".lock"
+
+def _upload_stream_dir(upload_id: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"{UPLOAD_SESSION_PREFIX}{upload_id}.d")
+
+def _upload_hold_key(upload_id: str) -> str:
+    return f"upload:{upload_id}"
+
+# upload_id -> {"x": StreamExtractor, "sha": hashlib.sha256(), "touched": time,
+#               "promised": x.bytes_written lúc sẽ ghi xong phần đã giữ chỗ}
+STREAM_SESSIONS = {}
+
+def _stream_drop(upload_id: str):
+    """Hủy phiên stream: bỏ bộ giải nén, xóa thư mục đang giải nén + json (gọi khi đang giữ lock)."""
+    sess = STREAM_SESSIONS.pop(upload_id, None)
+    if sess:
+        sess["x"].abort()
+    disk_budget.release(_upload_hold_key(upload_id))
+    shutil.rmtree(_upload_stream_dir(upload_id), ignore_errors=True)
+    for x in _upload_paths(upload_id)[1:]:
+        try: os.remove(x)
+        except OSError: pass
+
+def _stream_gc():
+    """Bỏ bộ giải nén của phiên stream không có chunk mới quá UPLOAD_STALE_S (thư mục để janitor dọn)."""
+    cutoff = time.time() - UPLOAD_STALE_S
+    for upload_id, sess in list(STREAM_SESSIONS.items()):
+        if sess["touched"] < cutoff:
+            STREAM_SESSIONS.pop(upload_id, None)
+            sess["x"].abort()
+            disk_budget.release(_upload_hold_key(upload_id))
+
+def _upload_load(upload_id: str):
+    try:
+        with open(_upload_paths(upload_id)[1], "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _upload_save(upload_id: str, meta: dict):
+    meta_path = _upload_paths(upload_id)[1]
+    meta["updated"] = time.time()
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+@contextmanager
+def _upload_locked(upload_id: str):
+    """Khóa (flock) theo upload: 2 request cùng ghi 1 upload sẽ đi tuần tự."""
+    with open(_upload_paths(upload_id)[2], "a+") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+def _upload_state(meta: dict) -> dict:
+    return {"ok": True, "upload_id": meta["id"], "filename": meta["filename"], "size": meta["size"],
+            "received": meta["received"], "chunk_size": meta["chunk_size"],
+            "mode": meta.get("mode", "file"), "complete": meta["received"] >= meta["size"]}
+
+def _evict_upload_session(p: str) -> bool:
+    """Janitor: xóa upload dở (part/thư mục stream + json + lock) nếu không còn được ghi gần đây."""
+    m = re.match(rf"^{UPLOAD_SESSION_PREFIX}([0-9a-f]{{32}})\.", os.path.basename(p))
+    if not m:
+        try: os.remove(p)
+        except Exception: return False
+        return True
+    part, meta_path, lock_path = _upload_paths(m.group(1))
+    newest = max((os.path.getmtime(x) for x in (part, meta_path) if os.path.exists(x)), default=0)
+    if time.time() - newest < UPLOAD_STALE_S:
+        return False
+    with open(lock_path, "a+") as lf:
+        try:
+            fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        STREAM_SESSIONS.pop(m.group(1), None)
+        disk_budget.release(_upload_hold_key(m.group(1)))
+        shutil.rmtree(_upload_stream_dir(m.group(1)), ignore_errors=True)
+        for x in (part, meta_path, lock_path):
+            try: os.remove(x)
+            except OSError: pass
+    return True
+
+def _stream_reserve(upload_id: str, n: int):
+    """
+    StreamExtractor sắp ghi n byte (phần hứa trước đó đã ghi xong): phần giữ chỗ của phiên = n.
+    Byte đã ghi đã trừ vào dung lượng trống nên không giữ tiếp.
+    """
+    sess = STREAM_SESSIONS[upload_id]
+    sess["promised"] = sess["x"].bytes_written + n
+    key = _upload_hold_key(upload_id)
+    try:
+        disk_budget.resize(key, n, UPLOAD_DIR, headroom=EXTRACT_HEADROOM_BYTES, wait=disk_budget.DISK_WAIT_REQUEST_S)
+    except KeyError:  # phiên đã mất chỗ giữ: giữ lại
+        disk_budget.hold(key, n, UPLOAD_DIR, path=_upload_stream_dir(upload_id), label="upload-stream",
+                         headroom=EXTRACT_HEADROOM_BYTES, wait=disk_budget.DISK_WAIT_REQUEST_S)
+
+def _stream_init(upload_id: str, filename: str, size: int, sha256):
+    _stream_gc()
+    with _upload_locked(upload_id):
+        meta = _upload_load(upload_id)
+        if meta and meta.get("mode") == "stream" and meta["size"] == size and upload_id in STREAM_SESSIONS:
+            return jsonify({**_upload_state(meta), "resumed": True})
+        _stream_drop(upload_id)  # phiên cũ mất bộ giải nén (process khởi động lại) -> làm lại từ đầu
+        outdir = _upload_stream_dir(upload_id)
+        try:
+            # chưa biết sẽ giải nén bao nhiêu: giữ 0 byte (chờ đủ headroom, janitor không xoá outdir),
+            # mỗi member nâng lên đúng phần sắp ghi (_stream_reserve)
+            disk_budget.hold(_upload_hold_key(upload_id), 0, UPLOAD_DIR, path=outdir, label="upload-stream",
+                             wait=disk_budget.DISK_WAIT_REQUEST_S)
+        except disk_budget.DiskFull as e:
+            return jsonify({"ok": False, "error": e.strerror}), 507
+        os.makedirs(outdir)
+        STREAM_SESSIONS[upload_id] = {
+            "x": zip_stream.StreamExtractor(outdir, want=is_needed_member,
+                                            reserve=lambda n: _stream_reserve(upload_id, n)),
+            "sha": hashlib.sha256(), "touched": time.time(), "promised": 0}
+        meta = {"id": upload_id, "filename": filename, "size": size, "sha256": sha256, "mode": "stream",
+                "received": 0, "chunk_size": UPLOAD_CHUNK_SIZE, "created": time.time()}
+        _upload_save(upload_id, meta)
+        return jsonify({**_upload_state(meta), "resumed": False}), 201
+
+def _stream_lost(meta: dict):
+    return jsonify({**_upload_state(meta), "ok": False, "restart": True,
+                    "error": "Phiên giải nén theo luồng không còn trên server, hãy upload lại từ đầu"}), 409
+
+def _stream_chunk(upload_id: str, meta: dict, offset: int, length: int, expected: str):
+    """Nhận trọn chunk vào RAM, kiểm tra checksum rồi mới đưa vào bộ giải nén (không ghi byte ZIP)."""
+    sess = STREAM_SESSIONS.get(upload_id)
+    if sess is None:
+        return _stream_lost(meta)
+    buf = bytearray()
+    try:
+        while len(buf) < length:
+            piece = request.stream.read(min(1024 * 1024, length - len(buf)))
+            if not piece:
+                break
+            buf += piece
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Mất kết nối khi nhận chunk: {type(e).__name__}"}), 400
+    if len(buf) != length or (expected and hashlib.sha256(buf).hexdigest() != expected):
+        return jsonify({**_upload_state(meta), "ok": False,
+                        "error": "Chunk không đủ byte hoặc sai checksum, hãy gửi lại"}), 400
+    try:
+        sess["x"].feed(bytes(buf))
+    except (ValueError, zip_stream.StreamUnsupported) as e:
+        # ZIP không giải nén theo luồng được (vd. có dữ liệu đứng trước, mã hóa): client chuyển sang mode "file"
+        _stream_drop(upload_id)
+        return jsonify({"ok": False, "fallback": True, "error": f"Không giải nén theo luồng được: {e}"}), 422
+    except OSError as e:  # kể cả disk_budget.DiskFull (errno 28)
+        _stream_drop(upload_id)
+        if getattr(e, "errno", None) == 28:
+            return jsonify({"ok": False, "error": "Server hết dung lượng tạm khi giải nén. Thử xóa bớt hoặc đợi janitor dọn."}), 507
+        raise
+    sess["sha"].update(buf)
+    sess["touched"] = time.time()
+    disk_budget.touch(_upload_hold_key(upload_id), max(0, sess["promised"] - sess["x"].bytes_written))
+    meta["received"] = offset + length
+    _upload_save(upload_id, meta)
+    return jsonify(_upload_state(meta))
+
+def _stream_complete(upload_id: str, meta: dict):
+    """Kiểm tra sha256 + EOCD (số entry khớp), chuyển thư mục đã giải nén thành ul_*; trả (out, lỗi)."""
+    sess = STREAM_SESSIONS.get(upload_id)
+    if sess is None:
+        return None, _stream_lost(meta)
+    if meta.get("sha256") and sess["sha"].hexdigest() != meta["sha256"]:
+        _stream_drop(upload_id)
+        return None, (jsonify({"ok": False, "error": "SHA-256 cả file không khớp"}), 400)
+    try:
+        info = sess["x"].finish()
+    except ValueError as e:
+        _stream_drop(upload_id)
+        return None, (jsonify({"ok": False, "error": f"File không phải ZIP hợp lệ: {e}"}), 400)
+    extract_dir = tempfile.mkdtemp(prefix="ul_", dir=UPLOAD_DIR)
+    os.rmdir(extract_dir)
+    os.replace(_upload_stream_dir(upload_id), extract_dir)
+    _stream_drop(upload_id)
+    bundle_manifest.write(extract_dir, info["members"])
+    out = {"ok": True, "filename": meta["filename"], "size": meta["size"], "streamed": True,
+           "num_entries_in_zip": info["num_entries_in_zip"]}
+    out.update(_extracted_result(extract_dir))
+    return out, None
+
+@app.route("/api/upload/init", methods=["POST"])
+def upload_init():
+    """
+    JSON body: filename, size (byte), tùy chọn sha256 (cả file), fingerprint (vd. tên+size+lastModified)
+    -> cùng client + fingerprint thì trả lại đúng upload cũ để resume.
+    mode: "file" (mặc định) hoặc "stream" (giải nén ngay khi chunk tới, không lưu ZIP).
+    Trả {upload_id, received, chunk_size, ...}: client gửi tiếp từ offset = received.
+    """
+    data = request.get_json(silent=True) or {}
+    mode = "stream" if str(data.get("mode") or "").lower() == "stream" else "file"
+    filename = secure_filename(str(data.get("filename") or "")) or "upload.zip"
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "Thiếu/không hợp lệ 'size'"}), 400
+    if size <= 0 or size > UPLOAD_MAX_SIZE:
+        return jsonify({"ok": False, "error": f"Kích thước phải trong (0, {human(UPLOAD_MAX_SIZE)}]"}), 413
+    sha256 = str(data.get("sha256") or "").lower() or None
+    fingerprint = str(data.get("fingerprint") or "")
+    if fingerprint:
+        key = f"{_client_id(data)}|{fingerprint}|{filename}|{size}" + ("|stream" if mode == "stream" else "")
+        upload_id = hashlib.sha256(key.encode()).hexdigest()[:32]
+    else:
+        upload_id = uuid.uuid4().hex
+
+    if mode == "stream":
+        return _stream_init(upload_id, filename, size, sha256)
+    try:
+        with _upload_locked(upload_id):
+            meta = _upload_load(upload_id)
+            part = _upload_paths(upload_id)[0]
+            hold_key = _upload_hold_key(upload_id)
+            if meta and meta["size"] == size and os.path.exists(part):
+                # resume: file thực tế là nguồn đúng nếu lệch với json
+                meta["received"] = min(meta["received"], os.path.getsize(part))
+                # phiên để quá UPLOAD_STALE_S đã mất chỗ giữ: giữ lại phần còn thiếu
+                disk_budget.hold(hold_key, size - meta["received"], UPLOAD_DIR, path=part, label="upload",
+                                 wait=disk_budget.DISK_WAIT_REQUEST_S, ttl=UPLOAD_STALE_S)
+                _upload_save(upload_id, meta)
+                return jsonify({**_upload_state(meta), "resumed": True})
+            disk_budget.release(hold_key)  # chỗ giữ của lần init trước (khác size) với cùng upload_id
+            disk_budget.hold(hold_key, size, UPLOAD_DIR, path=part, label="upload",
+                             wait=disk_budget.DISK_WAIT_REQUEST_S, ttl=UPLOAD_STALE_S)
+            open(part, "wb").close()
+            meta = {"id": upload_id, "filename": filename, "size": size, "sha256": sha256,
+                    "received": 0, "chunk_size": UPLOAD_CHUNK_SIZE, "created": time.time()}
+            _upload_save(upload_id, meta)
+            return jsonify({**_upload_state(meta), "resumed": False}), 201
+    except OSError as e:
+        if getattr(e, "errno", None) == 28:
+            return jsonify({"ok": False, "error": "Server hết dung lượng tạm, vui lòng thử lại sau."}), 507
+        raise
+
+@app.route("/api/upload/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    if not UPLOAD_ID_RE.match(upload_id):
+        return jsonify({"ok": False, "error": "upload_id không hợp lệ"}), 400
+    meta = _upload_load(upload_id)
+    if not meta:
+        return jsonify({"ok": False, "error": "Upload không tồn tại hoặc đã hết hạn"}), 404
+    return jsonify(_upload_state(meta))
+
+@app.route("/api/upload/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    """
+    Body: bytes của chunk (application/octet-stream). Query: offset (phải = received hiện tại).
+    Header X-Chunk-Sha256 (khuyến nghị): sai checksum -> bỏ chunk, trả 400 để client gửi lại.
+    """
+    if not UPLOAD_ID_RE.match(upload_id):
+        return jsonify({"ok": False, "error": "upload_id không hợp lệ"}), 400
+    offset = request.args.get("offset", type=int)
+    expected = (request.headers.get("X-Chunk-Sha256") or "").strip().lower()
+    length = request.content_length
+    with _upload_locked(upload_id):
+        meta = _upload_load(upload_id)
+        if not meta:
+            return jsonify({"ok": False, "error": "Upload không tồn tại hoặc đã hết hạn"}), 404
+        if offset != meta["received"]:
+            # chunk trùng/lệch (vd. client gửi lại sau khi mất response): báo vị trí đúng
+            return jsonify({**_upload_state(meta), "ok": False,
+                            "error": f"offset phải là {meta['received']}"}), 409
+        if length is None or length <= 0 or length > UPLOAD_MAX_CHUNK:
+            return jsonify({"ok": False, "error": f"Chunk phải có Content-Length trong (0, {human(UPLOAD_MAX_CHUNK)}]"}), 413
+        if offset + length > meta["size"]:
+            return jsonify({"ok": False, "error": "Chunk vượt quá kích thước đã khai báo"}), 400
+        if meta.get("mode") == "stream":
+            return _stream_chunk(upload_id, meta, offset, length, expected)
+
+        part = _upload_paths(upload_id)[0]
+        h = hashlib.sha256()
+        written = 0
+        with open(part, "r+b") as f:
+            f.seek(offset)
+            f.truncate()  # bỏ phần thừa của lần ghi hỏng trước đó
+            try:
+                while True:
+                    buf = request.stream.read(1024 * 1024)
+                    if not buf:
+                        break
+                    f.write(buf)
+                    h.update(buf)
+                    written += len(buf)
+            except Exception as e:
+                f.truncate(offset)
+                return jsonify({"ok": False, "error": f"Mất kết nối khi nhận chunk: {type(e).__name__}"}), 400
+            if written != length or (expected and h.hexdigest() != expected):
+                f.truncate(offset)
+                return jsonify({**_upload_state(meta), "ok": False,
+                                "error": "Chunk không đủ byte hoặc sai checksum, hãy gửi lại"}), 400
+        meta["received"] = offset + written
+        _upload_save(upload_id, meta)
+        disk_budget.touch(_upload_hold_key(upload_id), meta["size"] - meta["received"])
+        return jsonify(_upload_state(meta))
+
+@app.route("/api/upload/<upload_id>/complete", methods=["POST"])
+def upload_complete(upload_id):
+    """
+    Kết thúc upload: kiểm tra đủ byte (+ sha256 cả file nếu đã khai báo) và ZIP hợp lệ
+    (đọc central directory). JSON body tùy chọn:
+      - extract (mặc định true): chỉ extract file cần, trả data_dir (mode "stream": luôn đã extract)
+      - command (vd. "md new"): chạy luôn lệnh với path=data_dir, trả job_id
+      - client_id, priority: như /api/run-tool-async
+    """
+    if not UPLOAD_ID_RE.match(upload_id):
+        return jsonify({"ok": False, "error": "upload_id không hợp lệ"}), 400
+    data = request.get_json(silent=True) or {}
+    command = (data.get("command") or "").strip()
+    part, meta_path, lock_path = _upload_paths(upload_id)
+    with _upload_locked(upload_id):
+        meta = _upload_load(upload_id)
+        if not meta:
+            return jsonify({"ok": False, "error": "Upload không tồn tại hoặc đã hết hạn"}), 404
+        if meta["received"] != meta["size"]:
+            return jsonify({**_upload_state(meta), "ok": False, "error": "Upload chưa đủ dữ liệu"}), 409
+        if meta.get("mode") == "stream":
+            out, err = _stream_complete(upload_id, meta)
+            if err:
+                return err
+            return _upload_start_command(out, command, data)
+        if meta.get("sha256"):
+            h = hashlib.sha256()
+            with open(part, "rb") as f:
+                for buf in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(buf)
+            if h.hexdigest() != meta["sha256"]:
+                return jsonify({"ok": False, "error": "SHA-256 cả file không khớp"}), 400
+        try:
+            cd = zip_inspect.read_central_directory(zip_inspect.LocalRangeReader(part))
+        except Exception as e:
+            return jsonify({"ok": False, "error": f"File không phải ZIP hợp lệ: {e}"}), 400
+        saved_to = os.path.join(UPLOAD_DIR, f"{upload_id}_{meta['filename']}")
+        os.replace(part, saved_to)
+        disk_budget.release(_upload_hold_key(upload_id))  # byte đã nằm trên đĩa; giải nén giữ chỗ riêng
+        for x in (meta_path, lock_path):
+            try: os.remove(x)
+            except OSError: pass
+
+    out = {"ok": True, "saved_to": saved_to, "filename": meta["filename"], "size": meta["size"],
+           "num_entries_in_zip": len(cd["entries"])}
+    if not data.get("extract", True) and not command:
+        return jsonify(out)
+    try:
+        out.update(_extract_uploaded_zip(saved_to))
+    except OSError as e:
+        if getattr(e, "errno", None) == 28:
+            return jsonify({"ok": False, "error": "Server hết dung lượng tạm khi giải nén. Thử xóa bớt hoặc đợi janitor dọn."}), 507
+        raise
+    return _upload_start_command(out, command, data)
+
+def _upload_start_command(out: dict, command: str, data: dict):
+    if command:
+        priority = (data.get("priority") or "interactive").strip().lower()
+        if priority not in scheduler.PRIORITY_RANK:
+            priority = "interactive"
+        out["job_id"] = _enqueue_job(f"{command} path={out['data_dir']}", _client_id(data), priority)
+    return jsonify(out)
+
 # ======= Trích xuất ZIP đã upload -> chỉ extract file cần -> trả data_dir =======
+def _extract_uploaded_zip(saved_to: str) -> dict:
+    """Extract file cần từ ZIP đã upload, xóa ZIP gốc, trả {ok, saved_to, extracted_to, data_dir, summary}."""
+    extract_dir = tempfile.mkdtemp(prefix="ul_", dir=UPLOAD_DIR)
+    extract_needed(saved_to, extract_dir, wait=disk_budget.DISK_WAIT_REQUEST_S)  # trong request HTTP
+
+    # XÓA file ZIP gốc ngay khi đã extract
+    try:
+        os.remove(saved_to)
+    except Exception:
+        pass
+    return {"saved_to": saved_to, **_extracted_result(extract_dir)}
+
+def _extracted_result(extract_dir: str) -> dict:
+    """Tóm tắt thư mục đã extract: {ok, extracted_to, data_dir, summary}."""
+    best_dir = _canonical_data_dir(extract_dir)
+
+    # tóm tắt (từ manifest nếu có, không thì quét cây thư mục)
+    paths = bundle_manifest.walk_files(extract_dir)
+    if paths is None:
+        paths = [(os.path.join(root, n), None) for root, dirs, files in os.walk(extract_dir) for n in files]
+    found_xml, found_txt = [], []
+    for path, _ in paths:
+        nl = os.path.basename(path).lower()
+        if nl.endswith(".xml"):
+            found_xml.append(os.path.relpath(path, extract_dir))
+        if nl.endswith("_content.txt"):
+            found_txt.append(os.path.relpath(path, extract_dir))
+
+    return {
+        "ok": True,
+        "extracted_to": extract_dir,
+        "data_dir": best_dir,
+        "summary": {
+            "xml_count": len(found_xml),
+            "txt_count": len(found_txt),
+            "xml_sample": found_xml[:10],
+            "txt_sample": found_txt[:10],
+        }
+    }
+
 @app.route("/api/extract-uploaded", methods=["POST"])
 def extract_uploaded():
     """
@@ -374,40 +1159,7 @@ def extract_uploaded():
         return jsonify({"ok": False, "error": "File không phải ZIP hợp lệ"}), 400
 
     try:
-        ensure_free_space(min_free_bytes=500 * 1024 * 1024, base_dir="/tmp")
-        extract_dir = tempfile.mkdtemp(prefix="ul_", dir=UPLOAD_DIR)
-        extract_needed(saved_to, extract_dir)
-
-        # XÓA file ZIP gốc ngay khi đã extract
-        try:
-            os.remove(saved_to)
-        except Exception:
-            pass
-
-        best_dir = _canonical_data_dir(extract_dir)
-
-        # tóm tắt
-        found_xml, found_txt = [], []
-        for root, dirs, files in os.walk(extract_dir):
-            for n in files:
-                nl = n.lower()
-                if nl.endswith(".xml"):
-                    found_xml.append(os.path.relpath(os.path.join(root, n), extract_dir))
-                if nl.endswith("_content.txt"):
-                    found_txt.append(os.path.relpath(os.path.join(root, n), extract_dir))
-
-        return jsonify({
-            "ok": True,
-            "saved_to": saved_to,
-            "extracted_to": extract_dir,
-            "data_dir": best_dir,
-            "summary": {
-                "xml_count": len(found_xml),
-                "txt_count": len(found_txt),
-                "xml_sample": found_xml[:10],
-                "txt_sample": found_txt[:10],
-            }
-        })
+        return jsonify(_extract_uploaded_zip(saved_to))
     except OSError as e:
         if getattr(e, "errno", None) == 28:
             return jsonify({"ok": False, "error": "Server hết dung lượng tạm khi giải nén. Thử xóa bớt hoặc đợi janitor dọn."}), 507
@@ -434,15 +1186,7 @@ def analyze_by_url():
                 }), 400
             url = visibility.get("normalized_url", url)
 
-        tmp = os.path.join(UPLOAD_DIR, f"tmp_{uuid.uuid4().hex}.zip")
-        _download_zip_to_file(url, tmp)
-        with open(tmp, "rb") as f:
-            result = analyze_zip_stream(f.read())
-        # Xóa file tạm
-        try:
-            os.remove(tmp)
-        except Exception:
-            pass
+        result = _analyze_url_ranges(url)
 
         return jsonify({
             "ok": True,
@@ -458,90 +1202,66 @@ def analyze_by_url():
         return jsonify({"ok": False, "error": f"{type(e).__name__}: {e}"}), 500
 
 # ================== Dispatcher & tool mapping ==================
-TOOL_KEYWORDS = [
-    (r"\bcivitek\s+new\b", "civitek_new_logic"),
-    (r"\bmd\s+new\b",      "md_new_logic"),
-    (r"\bcivitek\b",       "civitek_logic"),
-    (r"\bflager\b",        "flager_logic"),
-    (r"\bmi\b",            "mi_logic"),
-    (r"\bmd\b",            "md_logic"),
-]
+# Tool nhận dạng theo CHECKER["keyword"] của từng module (checker_registry.route)
+# Lệnh gộp: "md + md new <link>" -> tải/giải nén 1 lần, các tool chạy chung 1 job (xem _call_fused)
+FUSED_HEAD_RE = re.compile(r"^(.*?)(?:https?://|\burl\s*=|\bpath\s*=|$)", re.I | re.S)
 
 HELP_TEXT = (
     "HƯỚNG DẪN NHANH:\n"
-    "• Civitek: gõ \"civitek <dấu cách> (link google drive)\"\n"
-    "• Civitek new: gõ \"civitek new <dấu cách> (link google drive)\"\n"
-    "• Flager: gõ \"flager <dấu cách> (link google drive)\"\n"
-    "• MI: gõ \"mi <dấu cách> (link google drive)\"\n"
-    "• MD: gõ \"md <dấu cách> (link google drive)\"\n"
-    "• MD New: gõ \"md new <dấu cách> (link google drive)\"\n"
+    + "".join(f"• {d['label']}: gõ \"{d['command']} <dấu cách> (link google drive)\"\n"
+              for d in checker_registry.declarations())
+    + "• Nhiều tool 1 lần: nối bằng dấu +, vd. \"md + md new (link)\", \"civitek + civitek new (link)\"\n"
     "Mẹo: dùng gợi ý (autocomplete) cho nhanh."
 )
 
-def _call_tool_module(module_name: str, command: str):
+def _prepare_tool_input(command: str):
+    """Lệnh có URL: tải ZIP, chỉ extract file cần, tự gán path= dir tốt nhất. Trả (command, lỗi|None)."""
+    murl = re.search(r"url\s*=\s*([^\s]+)", command, flags=re.I)
+    if not murl:
+        murl = re.search(r"(https?://\S+)", command, flags=re.I)
+    if not murl:
+        return command, None
+    url_in = murl.group(1)
+    try:
+        with _cached_zip(url_in) as zip_path:
+            extract_dir = tempfile.mkdtemp(prefix="gd_", dir=UPLOAD_DIR)
+            extract_needed(zip_path, extract_dir)  # giữ chỗ, chờ tối đa DISK_WAIT_S nếu đĩa đang bận
+
+        best_dir = _canonical_data_dir(extract_dir)
+        if not re.search(r"\bpath\s*=", command, flags=re.I):
+            command = f"{command} path={best_dir}"
+        return command, None
+    except OSError as e:
+        if getattr(e, "errno", None) == 28:
+            return command, {"ok": False, "error": "Server hết dung lượng tạm khi tải/giải nén URL."}
+        return command, {"ok": False, "error": f"Tải/Giải nén từ URL lỗi: {type(e).__name__}: {e}"}
+    except Exception as e:
+        return command, {"ok": False, "error": f"Tải/Giải nén từ URL lỗi: {type(e).__name__}: {e}"}
+
+def _call_tool_module(module_name: str, command: str, prepared: bool = False, should_cancel=None,
+                      only_files=None, rebuild_csv: bool = False):
     """
-    Gọi module tool theo 3 bước:
-    1) Nếu module có run/main/handle thì gọi thẳng.
-    2) Nếu lệnh có URL: tải ZIP, chỉ extract file cần, tự gán path= dir tốt nhất.
-    3) Nếu module có run_*_check(dir) thì gọi với data_dir đã chuẩn hoá.
+    Gọi tool đã khai báo CHECKER (checker_registry):
+    1) Lệnh có URL: tải ZIP, chỉ extract file cần, tự gán path= dir tốt nhất (job đã prepare thì bỏ qua).
+    2) Gọi CHECKER["entry"](data_dir) với data_dir đã chuẩn hoá
+       (kèm should_cancel / structured=True / only_files / rebuild_csv nếu hàm nhận các tham số này).
+       Kết quả có cấu trúc được tách: output = log text, report = phần còn lại (error_ids, files...).
     """
+    decl = checker_registry.get(module_name)
+    if decl is None:
+        return {"ok": False, "error": f"Module '{module_name}' chưa khai báo CHECKER trong checker_registry."}
+    check_fn_name = decl["entry"]
     try:
-        mod = importlib.import_module(module_name)
+        check_fn = checker_registry.entry(module_name)
     except Exception as e:
         return {"ok": False, "error": f"Không import được module '{module_name}': {e}"}
 
-    # (1) run/main/handle
-    for fn_name in ("run", "main", "handle"):
-        fn = getattr(mod, fn_name, None)
-        if callable(fn):
-            try:
-                sig = inspect.signature(fn)
-                out = fn(command) if len(sig.parameters) >= 1 else fn()
-                return {"ok": True, "module": module_name, "fn": fn_name, "output": out}
-            except Exception as e:
-                return {"ok": False, "module": module_name, "fn": fn_name,
-                        "error": f"Lỗi khi gọi {module_name}.{fn_name}: {type(e).__name__}: {e}"}
-
-    # (2) URL -> tải & chỉ extract file cần -> auto path
-    murl = re.search(r"url\s*=\s*([^\s]+)", command, flags=re.I)
-    if not murl:
-        murl = re.search(r"(https?://\S+)", command, flags=re.I)
-    if murl:
-        url_in = murl.group(1)
-        try:
-            tmp_zip = os.path.join(UPLOAD_DIR, f"link_{uuid.uuid4().hex}.zip")
-            _download_zip_to_file(url_in, tmp_zip)
+    if not prepared:
+        command, err = _prepare_tool_input(command)
+        if err:
+            return err
 
-            extract_dir = tempfile.mkdtemp(prefix="gd_", dir=UPLOAD_DIR)
-            ensure_free_space(min_free_bytes=500 * 1024 * 1024, base_dir="/tmp")
-            extract_needed(tmp_zip, extract_dir)
-
-            # Xóa zip tải về ngay
-            try: os.remove(tmp_zip)
-            except Exception: pass
-
-            best_dir = _canonical_data_dir(extract_dir)
-            if not re.search(r"\bpath\s*=", command, flags=re.I):
-                command = f"{command} path={best_dir}"
-        except OSError as e:
-            if getattr(e, "errno", None) == 28:
-                return {"ok": False, "error": "Server hết dung lượng tạm khi tải/giải nén URL."}
-            return {"ok": False, "error": f"Tải/Giải nén từ URL lỗi: {type(e).__name__}: {e}"}
-        except Exception as e:
-            return {"ok": False, "error": f"Tải/Giải nén từ URL lỗi: {type(e).__name__}: {e}"}
-
-    # (3) run_*_check(dir)
-    name_map = {
-        "civitek_new_logic": "run_civitek_new_check",
-        "civitek_logic":     "run_civitek_check",
-        "flager_logic":      "run_flager_check",
-        "mi_logic":          "run_mi_check",
-        "md_logic":          "run_md_cu_check",
-        "md_new_logic":      "run_md_moi_check",
-    }
-    check_fn_name = name_map.get(module_name)
-    if check_fn_name and hasattr(mod, check_fn_name):
-        check_fn = getattr(mod, check_fn_name)
+    if callable(check_fn):
         try:
             m = re.search(r"path\s*=\s*([^\s]+)", command, flags=re.I)
             raw_dir = m.group(1) if m else UPLOAD_DIR
@@ -554,58 +1274,247 @@ def _call_tool_module(module_name: str, command: str):
                 return {"ok": False, "module": module_name, "fn": check_fn_name,
                         "error": (f"Thư mục dữ liệu không tồn tại: '{raw_dir}'. "
                                   f"Hãy bỏ 'path=' để backend tự chọn, hoặc chỉ định đúng thư mục đã giải nén.")}
-            out = check_fn(data_dir)
-            return {"ok": True, "module": module_name, "fn": check_fn_name,
-                    "output": out, "data_dir": data_dir}
+            params = inspect.signature(check_fn).parameters
+            kwargs = {}
+            if should_cancel is not None and "should_cancel" in params:
+                kwargs["should_cancel"] = should_cancel
+            if "structured" in params:
+                kwargs["structured"] = True
+            if only_files is not None and "only_files" in params:
+                kwargs["only_files"] = only_files
+            if rebuild_csv and "rebuild_csv" in params:
+                kwargs["rebuild_csv"] = True
+            out = check_fn(data_dir, **kwargs)
+            res = {"ok": True, "module": module_name, "fn": check_fn_name, "data_dir": data_dir}
+            if isinstance(out, dict):  # kết quả có cấu trúc: log text + report (error_ids, issues...)
+                report = dict(out)
+                res["output"] = report.pop("log", "")
+                res["report"] = report
+            else:
+                res["output"] = out
+            return res
         except Exception as e:
             return {"ok": False, "module": module_name, "fn": check_fn_name,
                     "error": f"Lỗi khi gọi {module_name}.{check_fn_name}: {type(e).__name__}: {e}"}
 
-    return {"ok": False, "error": f"Module '{module_name}' không có entry phù hợp (run/main/handle hay run_*_check)."}
+    return {"ok": False, "error": f"Module '{module_name}' không có hàm '{check_fn_name}' như CHECKER khai báo."}
 
-def route_command(command: str):
+def _command_modules(cmd_lower: str) -> list:
+    """
+    Module tool của lệnh. Lệnh thường: tool có từ khoá khớp sớm nhất (checker_registry.route).
+    Lệnh gộp (phần trước link/path= có dấu '+'): mỗi đoạn giữa các dấu '+' là 1 tool, bỏ trùng.
+    """
+    head = FUSED_HEAD_RE.match(cmd_lower).group(1)
+    parts = head.split("+") if "+" in head else [cmd_lower]
+    modules = []
+    for part in parts:
+        module_name = checker_registry.route(part)
+        if module_name and module_name not in modules:
+            modules.append(module_name)
+    return modules
+
+def _module_names(module: str) -> list:
+    """'md_logic+md_new_logic' (module của job gộp) -> ['md_logic', 'md_new_logic']."""
+    return module.split("+")
+
+def _lane_of(modules) -> str:
+    lanes = {(checker_registry.get(m) or {}).get("lane", "heavy") for m in modules}
+    return "light" if lanes == {"light"} else "heavy"
+
+def prepare_command(command: str):
+    """
+    Phần I/O của lệnh, chạy ở thread nền (không giữ slot CPU): nhận dạng tool, tải + extract ZIP,
+    ước lượng chi phí từ dung lượng XML/TXT. Trả {ok, module, command (đã có path=), lane, cost}.
+    Lệnh gộp: module = "a+b" (các tool nối bằng '+'), lane/cost tính cho cả nhóm.
+    """
     if not command:
         return {"ok": False, "error": "Empty command"}
     cmd_lower = command.lower()
     if re.search(r"\bhelp\b", cmd_lower):
         return {"ok": True, "help": True, "message": HELP_TEXT}
-    for pattern, module_name in TOOL_KEYWORDS:
-        if re.search(pattern, cmd_lower, flags=re.IGNORECASE):
-            return _call_tool_module(module_name, command)
-    return {"ok": False, "error": "Không nhận dạng được tool từ lệnh. Gõ 'help' để xem hướng dẫn."}
+    modules = _command_modules(cmd_lower)
+    if not modules:
+        return {"ok": False, "error": "Không nhận dạng được tool từ lệnh. Gõ 'help' để xem hướng dẫn."}
+
+    command, err = _prepare_tool_input(command)
+    if err:
+        return err
+    m = re.search(r"path\s*=\s*([^\s]+)", command, flags=re.I)
+    data_dir = _canonical_data_dir(m.group(1) if m else UPLOAD_DIR)
+    return {"ok": True, "module": "+".join(modules), "command": command,
+            "lane": _lane_of(modules),
+            "cost": sum(_estimate_cost(mod, data_dir) for mod in modules)}
+
+def _prepare_recheck(recheck: dict) -> dict:
+    """
+    Re-check: không tải lại gì, chạy lại đúng module cũ trên data_dir cũ, chỉ với các file đã sửa
+    (TXT đã đổi -> CSV tự tạo của các file đó phải tạo lại: rebuild_csv).
+    """
+    base, files = recheck["base"], recheck["files"]
+    modules = _module_names(base["module"])
+    return {"ok": True, "module": base["module"], "command": f"path={base['data_dir']}", "only_files": list(files),
+            "rebuild_csv": True,
+            "lane": _lane_of(modules),
+            "cost": sum(_estimate_cost(mod, base["data_dir"], only_files=files) for mod in modules)}
+
+def _merge_recheck(base: dict, res: dict) -> dict:
+    """Gộp output/report của lần re-check vào kết quả job cũ (file không chạy lại giữ nguyên)."""
+    if not base.get("report") or not res.get("report"):
+        return res
+    if "tools" in base["report"] and "tools" in res["report"]:  # job gộp: gộp riêng từng tool
+        merged = []
+        for module_name, tool in res["report"]["tools"].items():
+            old = base["report"]["tools"].get(module_name) or {}
+            fresh = {"ok": "error" not in tool, "module": module_name, **tool}
+            if "error" not in old and "error" not in tool:
+                fresh = _merge_recheck({"result": old.get("output"), "report": old.get("report")}, fresh)
+            merged.append(fresh)
+        return {**res, **_fuse_results(merged)}
+    merged = result_model.merge_results({**base["report"], "log": base.get("result") or ""},
+                                        {**res["report"], "log": res.get("output") or ""})
+    return {**res, "output": merged.pop("log"), "report": merged}
+
+def _fuse_results(results: list) -> dict:
+    """
+    Kết quả từng tool của job gộp -> 1 kết quả: log nối các phần "===== Tool =====",
+    report = {error_ids: hợp các tool (None nếu có tool không có kết quả có cấu trúc),
+    tools: {module: {output, report} | {error}}} (re-check / xoá dòng lỗi dùng lại từng phần).
+    """
+    parts, tools, ids = [], {}, {}
+    structured = True
+    for r in results:
+        module_name = r.get("module")
+        label = (checker_registry.get(module_name) or {}).get("label", module_name)
+        if r.get("ok"):
+            parts.append(f"===== {label} =====\n{r.get('output') or ''}")
+            tools[module_name] = {"output": r.get("output"), "report": r.get("report")}
+            if r.get("report") and r["report"].get("error_ids") is not None:
+                ids.update(dict.fromkeys(r["report"]["error_ids"]))
+            else:
+                structured = False
+        else:
+            parts.append(f"===== {label} =====\n❌ {r.get('error')}")
+            tools[module_name] = {"error": r.get("error")}
+    data_dir = next((r["data_dir"] for r in results if r.get("data_dir")), None)
+    return {"ok": True, "module": "+".join(r.get("module") for r in results), "fn": "fused", "data_dir": data_dir,
+            "output": "\n\n".join(parts),
+            "report": {"error_ids": list(ids) if structured else None, "tools": tools}}
+
+def _call_fused(modules: list, command: str, should_cancel=None, only_files=None, rebuild_csv: bool = False) -> dict:
+    """
+    Job gộp: các tool chạy lần lượt trong cùng worker trên cùng data_dir (đã tải/giải nén 1 lần),
+    theo checker_registry.run_order: tool cần trang đầy đủ chạy trước và ghi page_store, tool chỉ cần
+    phần đầu trang (needs = inner_head) đọc lại từ kho; phần đầu trang chưa có trong kho được giải nén
+    1 lần cho mọi tool inner_head của nhóm (gzip_head.shared_heads). Kết quả giữ thứ tự trong lệnh.
+    """
+    heads = []
+    for module_name in modules:
+        try:
+            spec = checker_registry.head(module_name)
+        except Exception:
+            continue  # _call_tool_module báo lỗi import cho tool này
+        if spec is not None:
+            heads.append(spec)
+    results = {}
+    with gzip_head.shared_heads(heads) if len(heads) > 1 else nullcontext():
+        for module_name in checker_registry.run_order(modules):
+            if should_cancel is not None and should_cancel() and results:
+                break
+            results[module_name] = _call_tool_module(module_name, command, prepared=True,
+                                                     should_cancel=should_cancel, only_files=only_files,
+                                                     rebuild_csv=rebuild_csv)
+    return _fuse_results([results[m] for m in modules if m in results])
+
+def run_prepared(prep: dict):
+    """Phần CPU của lệnh (chạy trong worker process); prep["cancel_flag"] là file cờ hủy (nếu có)."""
+    token = worker_pool.FileCancelToken(prep["cancel_flag"]) if prep.get("cancel_flag") else None
+    modules = _module_names(prep["module"])
+    if len(modules) > 1:
+        res = _call_fused(modules, prep["command"], should_cancel=token, only_files=prep.get("only_files"),
+                          rebuild_csv=prep.get("rebuild_csv", False))
+    else:
+        res = _call_tool_module(prep["module"], prep["command"], prepared=True, should_cancel=token,
+                                only_files=prep.get("only_files"), rebuild_csv=prep.get("rebuild_csv", False))
+    if token is not None and token.fired:
+        res["cancelled"] = True
+    return res
+
+def route_command(command: str):
+    prep = prepare_command(command)
+    if not prep.get("ok") or prep.get("help"):
+        return prep
+    return run_prepared(prep)
 
 # ================== Run & Poll APIs ==================
-@app.route("/api/run-tool", methods=["POST"])
-def run_tool():
-    data = request.get_json(silent=True) or {}
-    command = data.get("command", "").strip()
-    if not command:
-        return jsonify({"error": "Không có lệnh nào được cung cấp"}), 400
+def _client_id(data: dict) -> str:
+    """client_id từ body / header X-Client-Id (chatbot.html tự sinh & lưu localStorage), không có thì dùng IP."""
+    cid = (data.get("client_id") or request.headers.get("X-Client-Id") or request.remote_addr or "-")
+    return re.sub(r"[^A-Za-z0-9._:\-]", "", str(cid))[:64] or "-"
+
+def _enqueue_job(command: str, client: str, priority: str, recheck: dict = None) -> str:
     job_id = uuid.uuid4().hex
-    JOBS[job_id] = {"status": "queued", "updated": datetime.utcnow()}
+    if SPOOL is not None:
+        SPOOL.submit(job_id, command, client, priority, recheck)
+        _gc_jobs()
+        return job_id
+    JOBS[job_id] = {"status": "queued", "client": client, "priority": priority, "updated": datetime.utcnow()}
     _gc_jobs()
-    threading.Thread(target=_run_command_background, args=(job_id, command), daemon=True).start()
-    return jsonify({"job_id": job_id, "status": "queued"}), 202
+    threading.Thread(target=_run_command_background, args=(job_id, command, client, priority, recheck),
+                     daemon=True).start()
+    return job_id
 
-@app.route("/api/run-tool-async", methods=["POST"])
-def run_tool_async():
+def _start_job():
     data = request.get_json(silent=True) or {}
     command = data.get("command", "").strip()
     if not command:
         return jsonify({"error": "Không có lệnh nào được cung cấp"}), 400
-    job_id = uuid.uuid4().hex
-    JOBS[job_id] = {"status": "queued", "updated": datetime.utcnow()}
-    _gc_jobs()
-    threading.Thread(target=_run_command_background, args=(job_id, command), daemon=True).start()
-    return jsonify({"job_id": job_id, "status": "queued"}), 202
+    priority = (data.get("priority") or "interactive").strip().lower()
+    if priority not in scheduler.PRIORITY_RANK:
+        return jsonify({"error": f"priority phải là một trong: {', '.join(scheduler.PRIORITY_RANK)}"}), 400
+    client = _client_id(data)
+    job_id = _enqueue_job(command, client, priority)
+    return jsonify({"job_id": job_id, "status": "queued", "client": client, "priority": priority}), 202
+
+@app.route("/api/run-tool", methods=["POST"])
+def run_tool():
+    return _start_job()
+
+@app.route("/api/run-tool-async", methods=["POST"])
+def run_tool_async():
+    return _start_job()
 
 @app.route("/api/job/<job_id>", methods=["GET"])
 def get_job(job_id):
     job = JOBS.get(job_id)
+    if not job and SPOOL is not None:
+        job = SPOOL.job(job_id)  # đã có position/queued khi còn chờ
+        return jsonify(job) if job else (jsonify({"error": "Job không tồn tại"}), 404)
     if not job:
         return jsonify({"error": "Job không tồn tại"}), 404
+    if job.get("status") in ("preparing", "queued", "running"):
+        JOB_LAST_POLL[job_id] = time.time()
+    if job.get("status") == "queued":
+        pos = queue_position(job_id)  # {position, queued, eta_sec}
+        if pos:
+            job = {**job, **pos}
     return jsonify(job)
 
+@app.route("/api/job/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    """Hủy job: đang chờ -> rời hàng đợi ngay; đang chạy -> dừng sau lead hiện tại (giữ kết quả dở dang)."""
+    job = JOBS.get(job_id)
+    if not job and SPOOL is not None:
+        job = SPOOL.cancel(job_id)  # worker thấy cờ hủy trong spool
+        if job and job.get("status") in ("preparing", "queued", "running"):
+            return jsonify({"ok": True, "job_id": job_id, "status": job.get("status")}), 202
+    if not job:
+        return jsonify({"error": "Job không tồn tại"}), 404
+    if job.get("status") not in ("preparing", "queued", "running"):
+        return jsonify({"ok": False, "status": job.get("status"), "error": "Job đã kết thúc"}), 409
+    _request_cancel(job_id)
+    JOBS[job_id] = {**job, "cancel_requested": True, "updated": datetime.utcnow()}
+    return jsonify({"ok": True, "job_id": job_id, "status": job.get("status")}), 202
+
 # ================== S3 presign & analyze (optional) ==================
 @app.route("/api/s3/presign", methods=["POST"])
 def s3_presign():
@@ -634,13 +1543,10 @@ def analyze_object():
     key = data.get("key")
     if not key:
         return jsonify({"ok": False, "error": "Missing key"}), 400
-    buf = io.BytesIO()
-    s3.download_fileobj(S3_BUCKET, key, buf)
-    buf.seek(0)
-    result = analyze_zip_stream(buf.read())
+    result = zip_inspect.analyze_zip_ranges(zip_inspect.S3RangeReader(s3, S3_BUCKET, key))
     return jsonify({"ok": True, "key": key, "result": result})
 
-# ============ Smart delete (stream, tiết kiệm RAM) ============
+# ============ Smart delete (chỉ mục UUID -> offset, ghi lại tại chỗ) ============
 ID_PAT = re.compile(r"\bID\s*:\s*([A-Za-z0-9._\-]+)", re.I)
 
 def _extract_error_ids_from_log(log_text: str):
@@ -651,68 +1557,115 @@ def _extract_error_ids_from_log(log_text: str):
             ids.add(m.group(1).strip())
     return sorted(ids)
 
-def _delete_lines_with_ids_in_file_stream(in_path: str, ids: set[str]) -> dict:
-    removed, kept = 0, 0
-    tmp_path = in_path + ".tmp"
-    try:
-        with open(in_path, "r", encoding="utf-8", errors="ignore") as fin, \
-             open(tmp_path, "w", encoding="utf-8") as fout:
-            for ln in fin:
-                ln_low = ln.lower()
-                hit = any(ln.startswith(i + "|") or i.lower() in ln_low for i in ids)
-                if hit: removed += 1
-                else:   kept += 1; fout.write(ln)
-        os.replace(tmp_path, in_path)
-        return {"file": os.path.basename(in_path), "removed": removed, "kept": kept}
-    except Exception as e:
-        try:
-            if os.path.exists(tmp_path): os.remove(tmp_path)
-        except: pass
-        return {"file": os.path.basename(in_path), "error": f"{type(e).__name__}: {e}"}
+def _job_report(job_id) -> dict:
+    """Kết quả (result) của job còn trong JOBS (hoặc spool), kể cả job bị hủy có kết quả dở dang."""
+    job = JOBS.get(str(job_id or ""))
+    if job is None and SPOOL is not None and job_id:
+        job = SPOOL.job(str(job_id))
+    return ((job or {}).get("result") or {}) if isinstance(job, dict) else {}
+
+def _error_ids_for_delete(data: dict, log_text: str):
+    """
+    ID cần xoá, ưu tiên theo thứ tự: 'job_id' (report.error_ids của job còn trong JOBS) ->
+    'ids' (client gửi kèm, dùng khi job đã hết hạn) -> quét log_text bằng regex (client cũ).
+    """
+    report = _job_report(data.get("job_id")).get("report")
+    if report and report.get("error_ids") is not None:
+        return sorted(set(report["error_ids"]))
+    ids = data.get("ids")
+    if isinstance(ids, list):
+        return sorted({str(i).strip() for i in ids if str(i).strip()})
+    return _extract_error_ids_from_log(log_text)
 
 @app.route("/api/delete-error-lines", methods=["POST"])
 def delete_error_lines():
+    """
+    Xoá dòng lỗi theo job: {job_id, dry_run} (data_dir + ID lấy từ kết quả job); vẫn nhận
+    {data_dir, ids} hoặc {data_dir, log_text} như cũ. Dòng được tìm qua chỉ mục UUID -> offset
+    (txt_index), chỉ file có hit mới bị ghi lại (tại chỗ).
+    """
     data = request.get_json(silent=True) or {}
-    data_dir = data.get("data_dir")
+    data_dir = data.get("data_dir") or _job_report(data.get("job_id")).get("data_dir")
     log_text = data.get("log_text") or ""
     dry_run = bool(data.get("dry_run", False))
 
     if not data_dir or not os.path.isdir(data_dir):
         return jsonify({"ok": False, "error": "Thiếu hoặc sai 'data_dir'."}), 400
-    ids = _extract_error_ids_from_log(log_text)
+    ids = _error_ids_for_delete(data, log_text)
     if not ids:
         return jsonify({"ok": False, "error": "Không tìm thấy ID trong log. Vui lòng chạy tool trước rồi dùng chức năng này."}), 400
 
     patterns = ["*_content.txt", "*_CONTENT.TXT", "*_Content.txt"]
-    targets = []
-    for root, dirs, files in os.walk(data_dir):
-        for name in files:
-            if any(fnmatch.fnmatch(name, pat) for pat in patterns):
-                targets.append(os.path.join(root, name))
+    paths = bundle_manifest.walk_files(data_dir)
+    if paths is None:
+        paths = [(os.path.join(root, n), None) for root, dirs, files in os.walk(data_dir) for n in files]
+    targets = [p for p, _ in paths if any(fnmatch.fnmatch(os.path.basename(p), pat) for pat in patterns)]
 
     if not targets:
         return jsonify({"ok": False, "error": "Không tìm thấy file *_content.txt trong thư mục dữ liệu."}), 400
 
     if dry_run:
-        return jsonify({"ok": True, "dry_run": True, "ids": ids, "targets": [os.path.basename(p) for p in targets]})
+        hits = {}
+        for p in targets:
+            try:
+                n = txt_index.count_hits(p, ids)
+            except OSError:
+                n = 0
+            if n:
+                hits[os.path.basename(p)] = n
+        return jsonify({"ok": True, "dry_run": True, "ids": ids, "targets": list(hits),
+                        "lines": sum(hits.values()), "scanned": len(targets)})
 
-    ids_set = set(ids)
     reports, total_removed, modified_files = [], 0, []
     for p in targets:
-        rep = _delete_lines_with_ids_in_file_stream(p, ids_set)
-        if rep.get("removed"):
+        rep = txt_index.delete_ids(p, ids)
+        if rep.pop("touched", False):
             total_removed += rep["removed"]
             modified_files.append(os.path.basename(p))
         reports.append(rep)
 
+    job_result = _job_report(data.get("job_id"))
+    if job_result and modified_files:  # để /api/recheck biết file nào cần kiểm tra lại
+        job_result["modified_files"] = sorted(set(job_result.get("modified_files") or []) | set(modified_files))
+        if SPOOL is not None and data.get("job_id") not in JOBS:
+            SPOOL.save_result(str(data["job_id"]), job_result)
+
     return jsonify({
         "ok": True,
+        "data_dir": data_dir,
         "deleted_total": total_removed,
-        "ids_count": len(ids_set),
+        "ids_count": len(ids),
         "modified_files": modified_files,
         "reports": reports
     })
 
+@app.route("/api/recheck", methods=["POST"])
+def recheck():
+    """
+    Kiểm tra lại sau khi xoá dòng lỗi: {job_id, files?} -> job mới chỉ chạy lại checker của job cũ
+    trên các cặp file đã sửa (mặc định: modified_files mà /api/delete-error-lines ghi lên job),
+    rồi gộp kết quả vào kết quả cũ. Trả job_id mới (poll như /api/run-tool-async).
+    """
+    data = request.get_json(silent=True) or {}
+    base = _job_report(data.get("job_id"))
+    if not base.get("module") or not base.get("data_dir") or not base.get("report"):
+        return jsonify({"ok": False, "error": "Job không tồn tại, đã hết hạn hoặc không có kết quả có cấu trúc để kiểm tra lại."}), 404
+    if not os.path.isdir(base["data_dir"]):
+        return jsonify({"ok": False, "error": "data_dir của job không còn trên server."}), 410
+    files = data.get("files")
+    if not isinstance(files, list):
+        files = base.get("modified_files") or []
+    files = [os.path.basename(str(f)) for f in files if str(f).strip()]
+    if not files:
+        return jsonify({"ok": False, "error": "Chưa có file nào được sửa (hãy xoá dòng lỗi trước) hoặc 'files' rỗng."}), 400
+    priority = (data.get("priority") or "interactive").strip().lower()
+    if priority not in scheduler.PRIORITY_RANK:
+        return jsonify({"error": f"priority phải là một trong: {', '.join(scheduler.PRIORITY_RANK)}"}), 400
+    client = _client_id(data)
+    job_id = _enqueue_job("", client, priority, recheck={"base": base, "files": files})
+    return jsonify({"job_id": job_id, "status": "queued", "base_job_id": data.get("job_id"), "files": files,
+                    "client": client, "priority": priority}), 202
+
 # ================== Download cleaned files ==================
 @app.route("/api/download-cleaned-one", methods=["GET"])
 def download_cleaned_one():
@@ -778,6 +1731,16 @@ def chatbot_page():
 def index():
     return redirect("/chatbot.html")
 
+# Khởi động worker sau khi đã định nghĩa xong mọi hàm (route_command, run_prepared...);
+# process con (spawn) cũng import app.py: chỉ process chính mới tạo pool.
+# EXECUTOR_SOCKET: pool nằm ở executor service dùng chung cho mọi web worker (xem executor_service.py);
+# chính service cũng import app.py (EXECUTOR_ROLE=service) và tự tạo pool.
+# SPOOL_DIR: máy API không chạy job nên không cần pool; spool_worker (EXECUTOR_ROLE=spool_worker) thì cần.
+_ROLE = os.environ.get("EXECUTOR_ROLE")
+if multiprocessing.current_process().name == "MainProcess" and _ROLE != "service" \
+        and (SPOOL is None or _ROLE == "spool_worker"):
+    EXEC = executor_service.connect() if executor_service.EXECUTOR_SOCKET else _make_executor()
+
 # ================== Local dev ==================
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,171 @@
+# batch_check.py — CLI kiểm tra hàng loạt bundle, không qua Flask/HTTP
+#   python -m batch_check "md new" a.zip b.zip /data/bundle_c -j 16 -o out.jsonl
+# Mỗi ZIP được giải nén (bundle_extract, giống app.py) vào thư mục tạm, thư mục thì chọn data_dir
+# như path=; mỗi cặp XML/TXT là 1 task chạy run_*_check(data_dir, only_files=[cặp]) trong pool
+# process (mặc định = số core), không có JOB_TIMEOUT. Mỗi task ghi 1 dòng JSON vào -o; cuối cùng
+# ghi tổng kết (theo tool) vào --summary (mặc định <out>.summary.json) và in ra màn hình.
+# Tool viết như lệnh chat: "md", "civitek new", "md + md new" (mỗi tool 1 task cho mỗi cặp file).
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import importlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import bundle_manifest
+import checker_registry
+from bundle_extract import extract_needed, canonical_data_dir
+
+def resolve_tools(spec: str) -> list:
+    """'md + md new' -> ['md_logic', 'md_new_logic'] (tên module *_logic cũng được)."""
+    modules = []
+    for part in spec.lower().split("+"):
+        part = part.strip()
+        module_name = part if checker_registry.get(part) else checker_registry.route(part)
+        if module_name is None:
+            raise ValueError(f"Không nhận dạng được tool '{part}'")
+        if module_name not in modules:
+            modules.append(module_name)
+    return modules
+
+def xml_pairs(data_dir: str) -> list:
+    """Tên các file XML trong data_dir (mỗi file = 1 cặp XML/TXT = 1 task)."""
+    try:
+        names = bundle_manifest.listdir(data_dir)
+    except OSError:
+        return []
+    return sorted(n for n in names if n.lower().endswith(".xml"))
+
+def prepare_input(src: str, workdir: str) -> str:
+    """ZIP -> giải nén vào workdir (chỉ XML/TXT, có manifest); thư mục -> giữ nguyên. Trả data_dir."""
+    if os.path.isdir(src):
+        return canonical_data_dir(src)
+    outdir = tempfile.mkdtemp(prefix="bundle_", dir=workdir)
+    extract_needed(src, outdir)
+    return canonical_data_dir(outdir)
+
+# ===== Worker =====
+def _warm(modules):
+    """Initializer của pool: import sẵn tool + warmup() (như worker của app.py)."""
+    for module_name in modules:
+        try:
+            warm = getattr(importlib.import_module(module_name), "warmup", None)
+            if callable(warm):
+                warm()
+        except Exception:
+            pass  # lỗi import sẽ được báo ở từng task
+
+def run_task(module_name: str, data_dir: str, xml_name):
+    """1 tool trên 1 cặp file (xml_name=None: cả data_dir). Trả bản ghi JSONL."""
+    t0 = time.time()
+    rec = {"module": module_name, "data_dir": data_dir, "file": xml_name and os.path.splitext(xml_name)[0]}
+    try:
+        check_fn = checker_registry.entry(module_name)
+        if check_fn is None:
+            raise LookupError(f"Module '{module_name}' không có hàm như CHECKER khai báo")
+        out = check_fn(data_dir, structured=True, only_files=[xml_name] if xml_name else None)
+        if isinstance(out, dict):
+            rec.update(ok=True, **{k: v for k, v in out.items() if k not in rec})
+        else:
+            rec.update(ok=True, log=out)
+    except Exception as e:
+        rec.update(ok=False, error=f"{type(e).__name__}: {e}")
+    rec["elapsed_sec"] = round(time.time() - t0, 3)
+    return rec
+
+# ===== Tổng kết =====
+def _new_summary(modules) -> dict:
+    return {"tools": {m: {"tasks": 0, "failed": 0, "issues_total": 0, "error_ids": 0, "counts": {}} for m in modules},
+            "inputs": 0, "inputs_failed": 0}
+
+def _add(summary: dict, rec: dict):
+    tool = summary["tools"][rec["module"]]
+    tool["tasks"] += 1
+    if not rec.get("ok"):
+        tool["failed"] += 1
+        return
+    tool["issues_total"] += rec.get("issues_total") or 0
+    tool["error_ids"] += len(rec.get("error_ids") or [])
+    for code, n in (rec.get("counts") or {}).items():
+        tool["counts"][code] = tool["counts"].get(code, 0) + n
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m batch_check",
+                                 description="Kiểm tra hàng loạt bundle (ZIP hoặc thư mục) không qua HTTP.")
+    ap.add_argument("tool", help='tool như lệnh chat: "md", "civitek new", "md + md new"')
+    ap.add_argument("inputs", nargs="+", help="file ZIP hoặc thư mục bundle")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="số process (mặc định: số core)")
+    ap.add_argument("-o", "--out", default="batch_results.jsonl", help="file JSONL kết quả (mỗi task 1 dòng)")
+    ap.add_argument("--summary", help="file JSON tổng kết (mặc định: <out>.summary.json)")
+    ap.add_argument("--workdir", help="nơi giải nén ZIP (mặc định: thư mục tạm, xoá khi xong)")
+    ap.add_argument("--keep", action="store_true", help="giữ lại thư mục giải nén")
+    args = ap.parse_args(argv)
+
+    try:
+        modules = resolve_tools(args.tool)
+    except ValueError as e:
+        ap.error(str(e))
+    summary_path = args.summary or f"{args.out}.summary.json"
+    workdir = args.workdir or tempfile.mkdtemp(prefix="batch_check_")
+    os.makedirs(workdir, exist_ok=True)
+    summary = _new_summary(modules)
+    t0 = time.time()
+
+    with open(args.out, "w", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=max(1, args.jobs), initializer=_warm, initargs=(modules,)) as pool:
+        def write(rec):
+            out.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+
+        futures = {}
+        try:
+            # giải nén tuần tự ở process chính; pool đã chạy các cặp của bundle trước trong lúc đó
+            for src in args.inputs:
+                summary["inputs"] += 1
+                try:
+                    data_dir = prepare_input(src, workdir)
+                except Exception as e:
+                    summary["inputs_failed"] += 1
+                    write({"input": src, "ok": False, "error": f"Giải nén / đọc bundle lỗi: {type(e).__name__}: {e}"})
+                    continue
+                for xml_name in xml_pairs(data_dir) or [None]:
+                    for module_name in modules:
+                        fut = pool.submit(run_task, module_name, data_dir, xml_name)
+                        futures[fut] = (src, module_name, data_dir, xml_name)
+            for fut in as_completed(futures):
+                src, module_name, data_dir, xml_name = futures[fut]
+                try:
+                    rec = fut.result()
+                except BrokenProcessPool as e:
+                    rec = {"module": module_name, "data_dir": data_dir,
+                           "file": xml_name and os.path.splitext(xml_name)[0],
+                           "ok": False, "error": f"Worker chết giữa chừng: {e}"}
+                rec["input"] = src
+                _add(summary, rec)
+                write(rec)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("⛔ Đã dừng (Ctrl+C): kết quả ghi tới đây vẫn giữ trong", args.out, file=sys.stderr)
+            return 130
+        finally:
+            if not args.keep and not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    summary["elapsed_sec"] = round(time.time() - t0, 3)
+    summary["labels"] = {m: checker_registry.get(m)["label"] for m in modules}
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    for m, tool in summary["tools"].items():
+        print(f"{summary['labels'][m]}: {tool['tasks']} cặp file, {tool['failed']} lỗi chạy, "
+              f"{tool['issues_total']} lỗi dữ liệu, {tool['error_ids']} ID lỗi")
+    print(f"Xong {summary['inputs']} bundle ({summary['inputs_failed']} không đọc được) trong "
+          f"{summary['elapsed_sec']}s -> {args.out}, {summary_path}")
+    failed = summary["inputs_failed"] + sum(t["failed"] for t in summary["tools"].values())
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# bundle_extract.py — giải nén bundle ZIP + chọn data_dir (dùng chung: app.py và CLI batch_check)
+# Chỉ giải nén XML và *_content.txt, ghi bundle_manifest ngay lúc giải nén; data_dir chọn theo
+# manifest, không có manifest (path= tự chỉ định) thì quét cây thư mục như trước.
+import os
+import glob
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bundle_manifest
+import disk_budget
+
+# ===== Chỉ extract file cần (XML & *_content.txt) =====
+# Giải nén song song bằng thread: zlib nhả GIL khi inflate/crc32 nên chạy được nhiều core
+# (extract_needed chạy trong worker của pool / CLI batch_check -> không mở thêm process con được).
+EXTRACT_THREADS = int(os.environ.get("EXTRACT_THREADS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_PARALLEL_MIN_BYTES = 8 * 1024 * 1024   # bundle nhỏ: giải nén tuần tự cho gọn
+EXTRACT_HEADROOM_BYTES = 64 * 1024 * 1024      # chừa lại sau khi giải nén xong
+
+def is_needed_member(name: str) -> bool:
+    low = name.lower()
+    return low.endswith(".xml") or low.endswith("_content.txt")
+
+def _extract_member(z: zipfile.ZipFile, info: zipfile.ZipInfo, outdir: str):
+    try:
+        z.extract(info, path=outdir)
+    except FileExistsError:
+        # 2 thread cùng tạo thư mục cha (os.makedirs race) -> thử lại 1 lần
+        z.extract(info, path=outdir)
+
+def extract_needed(zippath: str, outdir: str, wait: float = None):
+    """
+    Chỉ giải nén *.xml và *_content.txt để giảm I/O và tăng tốc.
+    - Giữ chỗ trước tổng file_size (+ dự phòng) trong disk_budget: job đồng thời khác cũng đang giải nén
+      thì chờ tới khi đủ chỗ (tối đa `wait` giây) thay vì hỏng giữa chừng vì ENOSPC.
+    - Nhiều thread, mỗi thread 1 ZipFile riêng; file lớn giải nén trước (largest-first).
+    - Xong thì ghi bundle_manifest (cặp XML/TXT, size, CRC, data_dir) từ chính danh sách member
+      -> các bước sau không phải glob/os.walk lại cây thư mục. Trả về manifest.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    with zipfile.ZipFile(zippath, "r") as z:
+        members = [info for info in z.infolist() if is_needed_member(info.filename)]
+    total = sum(info.file_size for info in members)
+    with disk_budget.reserve(total, outdir, path=outdir, label="extract",
+                             headroom=EXTRACT_HEADROOM_BYTES, wait=wait):
+        return _extract_members(zippath, outdir, members, total)
+
+def _extract_members(zippath: str, outdir: str, members: list, total: int):
+    listing = [(info.filename, info.file_size, info.CRC) for info in members]
+
+    members.sort(key=lambda info: info.file_size, reverse=True)
+    n_threads = min(EXTRACT_THREADS, len(members))
+    if n_threads <= 1 or total < EXTRACT_PARALLEL_MIN_BYTES:
+        with zipfile.ZipFile(zippath, "r") as z:
+            for info in members:
+                _extract_member(z, info, outdir)
+        return bundle_manifest.write(outdir, listing)
+
+    pending = iter(members)
+    lock = threading.Lock()
+
+    def worker():
+        with zipfile.ZipFile(zippath, "r") as z:
+            while True:
+                with lock:
+                    info = next(pending, None)
+                if info is None:
+                    return
+                _extract_member(z, info, outdir)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        for fut in [pool.submit(worker) for _ in range(n_threads)]:
+            fut.result()
+    return bundle_manifest.write(outdir, listing)
+
+# ===== Chọn data_dir =====
+XML_PATTERNS = ["*.xml", "*.[xX][mM][lL]"]
+TXT_PATTERNS = ["*_content.txt", "*_CONTENT.TXT", "*_Content.txt"]
+
+def _has_data(dirpath: str) -> bool:
+    try:
+        for pat in XML_PATTERNS + TXT_PATTERNS:
+            if glob.glob(os.path.join(dirpath, pat)):
+                return True
+    except Exception:
+        pass
+    return False
+
+def _single_child_dir(dirpath: str):
+    try:
+        names = [n for n in os.listdir(dirpath) if os.path.isdir(os.path.join(dirpath, n))]
+        if len(names) == 1:
+            return os.path.join(dirpath, names[0])
+    except Exception:
+        pass
+    return None
+
+def _first_data_dir_recursive(root_dir: str):
+    try:
+        for cur, dirs, files in os.walk(root_dir):
+            if _has_data(cur):
+                return cur
+    except Exception:
+        pass
+    return None
+
+def canonical_data_dir(root_dir: str) -> str:
+    """Thư mục chứa cặp XML/TXT của 1 bundle đã giải nén (hoặc path= người dùng chỉ định)."""
+    root_dir = os.path.abspath(root_dir)
+    found = bundle_manifest.data_dir(root_dir)  # thư mục đã giải nén: data_dir chọn sẵn lúc extract
+    if found:
+        return found
+    if os.path.isdir(root_dir) and _has_data(root_dir):
+        return root_dir
+    test_dir = os.path.join(root_dir, "Test")
+    if os.path.isdir(test_dir) and _has_data(test_dir):
+        return test_dir
+    child = _single_child_dir(root_dir)
+    if child:
+        test2 = os.path.join(child, "Test")
+        if os.path.isdir(test2) and _has_data(test2):
+            return test2
+        if _has_data(child):
+            return child
+    found = _first_data_dir_recursive(root_dir)
+    if found:
+        return found
+    return root_dir
@@ -0,0 +1,181 @@
+# bundle_manifest.py — manifest của bundle, ghi 1 lần ngay lúc giải nén
+# Lúc giải nén đã biết hết member (tên, size, CRC) nên cây thư mục, cặp XML/TXT và data_dir
+# được tính luôn từ danh sách đó rồi ghi vào <thư mục giải nén>/.bundle_manifest.json.
+# app.py và các checker đọc manifest thay cho glob/listdir/os.walk lặp lại ở mỗi bước;
+# thư mục không có manifest (path= tự chỉ định, dữ liệu cũ) thì vẫn quét đĩa như trước.
+import os
+import json
+
+MANIFEST_NAME = ".bundle_manifest.json"
+MANIFEST_VERSION = 1
+
+def _rel_parts(name: str) -> list:
+    """Giống zipfile.ZipFile.extract: bỏ ổ đĩa, '', '.', '..' (đúng đường dẫn file trên đĩa)."""
+    arcname = os.path.splitdrive(name.replace("/", os.path.sep))[1]
+    return [x for x in arcname.split(os.path.sep) if x not in ("", os.path.curdir, os.path.pardir)]
+
+def _pair_base(name: str):
+    low = name.lower()
+    if low.endswith("_content.txt"):
+        return low[:-len("_content.txt")], "txt"
+    if low.endswith(".xml"):
+        return low[:-len(".xml")], "xml"
+    return None, None
+
+# ===== Tạo manifest từ danh sách member =====
+def build(members) -> dict:
+    """
+    members: [(tên trong ZIP, size, crc)] của các member đã giải nén (trùng tên: bản sau thắng,
+    giống ghi đè trên đĩa). Thư mục key theo đường dẫn tương đối với gốc giải nén ("" = gốc).
+    """
+    dirs = {"": {"files": {}, "subdirs": []}}
+    for name, size, crc in members:
+        parts = _rel_parts(name)
+        if not parts:
+            continue
+        cur = ""
+        for p in parts[:-1]:
+            child = f"{cur}/{p}" if cur else p
+            if child not in dirs:
+                dirs[child] = {"files": {}, "subdirs": []}
+                dirs[cur]["subdirs"].append(p)
+            cur = child
+        dirs[cur]["files"][parts[-1]] = [int(size), int(crc) & 0xFFFFFFFF]
+    for d in dirs.values():
+        d["files"] = [[n, s, c] for n, (s, c) in d["files"].items()]
+        d["subdirs"].sort()
+    data_dir = _pick_data_dir(dirs, "")
+    return {"v": MANIFEST_VERSION, "data_dir": data_dir, "dirs": dirs, "pairs": _pairs(dirs[data_dir]["files"])}
+
+def _pairs(files) -> list:
+    """[[base, xml, txt]] trong 1 thư mục; thiếu 1 bên thì tên bên đó là None."""
+    by_base = {}
+    for name, _, _ in files:
+        base, kind = _pair_base(name)
+        if base is not None:
+            by_base.setdefault(base, {"xml": None, "txt": None})[kind] = name
+    return [[b, p["xml"], p["txt"]] for b, p in by_base.items()]
+
+def _join(a: str, b: str) -> str:
+    return f"{a}/{b}" if a else b
+
+def _pick_data_dir(dirs: dict, start: str) -> str:
+    """
+    Cùng thứ tự ưu tiên với app._canonical_data_dir, nhưng trên cây trong manifest:
+    chính nó -> Test/ -> thư mục con duy nhất (Test/ của nó, rồi chính nó) -> thư mục đầu tiên có dữ liệu.
+    Chỉ file cần mới được giải nén nên thư mục có file = thư mục có dữ liệu.
+    """
+    def has_data(d):
+        return d in dirs and bool(dirs[d]["files"])
+
+    if has_data(start):
+        return start
+    if has_data(_join(start, "Test")):
+        return _join(start, "Test")
+    subs = dirs.get(start, {}).get("subdirs") or []
+    if len(subs) == 1:
+        child = _join(start, subs[0])
+        if has_data(_join(child, "Test")):
+            return _join(child, "Test")
+        if has_data(child):
+            return child
+    stack = [start]
+    while stack:
+        cur = stack.pop()
+        if has_data(cur):
+            return cur
+        stack.extend(_join(cur, s) for s in reversed(dirs.get(cur, {}).get("subdirs") or []))
+    return start
+
+def write(root: str, members) -> dict:
+    """Tạo + ghi manifest vào thư mục giải nén `root` (best-effort: không ghi được thì checker quét đĩa)."""
+    manifest = build(members)
+    path = os.path.join(root, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    return manifest
+
+# ===== Đọc manifest =====
+_CACHE = {}  # đường dẫn manifest -> (mtime_ns, manifest)
+
+def _load(path: str):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    hit = _CACHE.get(path)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("v") != MANIFEST_VERSION:
+        return None
+    _CACHE[path] = (mtime, manifest)
+    return manifest
+
+def find(path: str):
+    """(gốc giải nén, manifest, thư mục tương đối của `path`) — (None, None, None) nếu không có manifest."""
+    cur = os.path.abspath(path)
+    rel = []
+    while True:
+        manifest = _load(os.path.join(cur, MANIFEST_NAME))
+        if manifest is not None:
+            reldir = "/".join(reversed(rel))
+            if reldir not in manifest["dirs"]:
+                return None, None, None
+            return cur, manifest, reldir
+        parent, tail = os.path.split(cur)
+        if parent == cur:
+            return None, None, None
+        rel.append(tail)
+        cur = parent
+
+def _abs(root: str, reldir: str) -> str:
+    return os.path.join(root, *reldir.split("/")) if reldir else root
+
+def data_dir(path: str):
+    """Thư mục dữ liệu cho `path` theo manifest (None = không có manifest -> tự quét)."""
+    root, manifest, reldir = find(path)
+    if manifest is None:
+        return None
+    if reldir == "":
+        return _abs(root, manifest["data_dir"])
+    return _abs(root, _pick_data_dir(manifest["dirs"], reldir))
+
+def entries(path: str):
+    """[(tên, size, crc)] của file trực tiếp trong `path` theo manifest; None nếu không có manifest."""
+    root, manifest, reldir = find(path)
+    if manifest is None:
+        return None
+    return [tuple(e) for e in manifest["dirs"][reldir]["files"]]
+
+def listdir(path: str) -> list:
+    """Tên file dữ liệu trong `path`: từ manifest nếu có, không thì os.listdir (như cũ)."""
+    found = entries(path)
+    if found is None:
+        return os.listdir(path)
+    return [name for name, _, _ in found]
+
+def walk_files(path: str):
+    """[(đường dẫn tuyệt đối, size)] mọi file dưới `path` theo manifest; None nếu không có manifest."""
+    root, manifest, reldir = find(path)
+    if manifest is None:
+        return None
+    dirs, out, stack = manifest["dirs"], [], [reldir]
+    while stack:
+        cur = stack.pop()
+        base = _abs(root, cur)
+        out.extend((os.path.join(base, name), size) for name, size, _ in dirs[cur]["files"])
+        stack.extend(_join(cur, s) for s in reversed(dirs[cur]["subdirs"]))
+    return out
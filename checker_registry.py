@@ -0,0 +1,113 @@
+# checker_registry.py — danh sách checker + khai báo CHECKER của từng module
+# Mỗi checker khai báo ở đầu module 1 dict CHECKER (chỉ literal) gồm tên hiển thị, lệnh gõ, từ khoá
+# nhận dạng, hàm chạy, lane, hệ số chi phí và các "artifact" nó cần đọc từ bundle (needs).
+# app.py định tuyến / xếp lane / ước lượng chi phí / chạy job gộp theo khai báo này thay cho các
+# bảng viết tay. Web process đọc khai báo bằng ast (không import checker -> pandas/bs4 chỉ nạp
+# trong worker); worker mới import module để lấy hàm chạy.
+import re
+import ast
+import importlib
+import importlib.util
+
+# Thêm tool mới: khai báo CHECKER trong module rồi thêm tên module vào đây (thứ tự = thứ tự trong help)
+CHECKER_MODULES = ("civitek_logic", "civitek_new_logic", "flager_logic",
+                   "mi_logic", "md_logic", "md_new_logic")
+
+# Artifact checker có thể cần (khai báo trong CHECKER["needs"])
+ARTIFACTS = {
+    "outer": "envelope XML ngoài của dòng TXT",
+    "uris": "các khối <Uri> của envelope",
+    "inner_head": "phần đầu HTML bên trong, giải nén tới khi đủ field (gzip_head)",
+    "inner_html": "toàn bộ HTML bên trong",
+    "dom": "cây HTML đã parse (BeautifulSoup)",
+    "xml_fields": "field của lead trong file XML theo ID",
+    "compare_table": "bảng compare (MI)",
+}
+# Cần trang đầy đủ: tool giải mã cả trang và ghi page_store -> tool chạy sau đọc lại được
+FULL_PAGE_ARTIFACTS = {"outer", "uris", "inner_html", "dom"}
+
+_REQUIRED = ("label", "command", "keyword", "entry", "needs")
+_DEFAULTS = {"lane": "heavy", "cost_weight": 1.0, "head": None, "head_ascii_only": False}
+
+_decls = None
+_errors = {}
+
+def _read_declaration(module_name: str) -> dict:
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or not spec.origin:
+        raise ImportError(f"không tìm thấy module '{module_name}'")
+    with open(spec.origin, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), spec.origin)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "CHECKER" for t in node.targets):
+            decl = ast.literal_eval(node.value)
+            break
+    else:
+        raise ValueError(f"{module_name}: thiếu khai báo CHECKER")
+    missing = [k for k in _REQUIRED if k not in decl]
+    if missing:
+        raise ValueError(f"{module_name}: CHECKER thiếu {', '.join(missing)}")
+    unknown = [n for n in decl["needs"] if n not in ARTIFACTS]
+    if unknown:
+        raise ValueError(f"{module_name}: needs không hợp lệ: {', '.join(unknown)}")
+    if "inner_head" in decl["needs"] and not decl.get("head"):
+        raise ValueError(f"{module_name}: needs có inner_head nhưng thiếu 'head'")
+    return {**_DEFAULTS, **decl, "module": module_name, "needs": tuple(decl["needs"]),
+            "keyword_re": re.compile(decl["keyword"], re.I)}
+
+def declarations() -> list:
+    """Khai báo của mọi checker đọc được (module lỗi bị bỏ qua, xem errors())."""
+    global _decls
+    if _decls is None:
+        decls = []
+        for name in CHECKER_MODULES:
+            try:
+                decls.append(_read_declaration(name))
+            except Exception as e:
+                _errors[name] = f"{type(e).__name__}: {e}"
+        _decls = decls
+    return _decls
+
+def errors() -> dict:
+    declarations()
+    return dict(_errors)
+
+def get(module_name: str):
+    return next((d for d in declarations() if d["module"] == module_name), None)
+
+def route(text: str):
+    """
+    Module có từ khoá khớp sớm nhất trong `text` (cùng vị trí: khớp dài hơn thắng,
+    vd. "civitek new" thắng "civitek"); None nếu không khớp tool nào.
+    """
+    best, best_key = None, None
+    for d in declarations():
+        m = d["keyword_re"].search(text)
+        if m and (best_key is None or (m.start(), -len(m.group(0))) < best_key):
+            best, best_key = d["module"], (m.start(), -len(m.group(0)))
+    return best
+
+def needs_full_page(module_name: str) -> bool:
+    d = get(module_name)
+    return d is None or bool(FULL_PAGE_ARTIFACTS.intersection(d["needs"]))
+
+def run_order(modules) -> list:
+    """
+    Thứ tự chạy rẻ nhất cho job gộp: tool cần trang đầy đủ chạy trước (giải mã + ghi page_store),
+    tool chỉ cần phần đầu trang (inner_head) chạy sau và đọc thẳng từ kho.
+    """
+    return sorted(modules, key=lambda m: not needs_full_page(m))
+
+def entry(module_name: str):
+    """Hàm chạy của checker, None nếu module không có hàm đó (import module; chỉ gọi trong worker)."""
+    d = get(module_name)
+    if d is None:
+        raise LookupError(f"Module '{module_name}' chưa khai báo CHECKER ({_errors.get(module_name, 'không có trong danh sách')})")
+    return getattr(importlib.import_module(module_name), d["entry"], None)
+
+def head(module_name: str):
+    """(hàm tạo bộ kiểm 'đủ field chưa', ascii_only) cho gzip_head nếu checker cần inner_head, không thì None."""
+    d = get(module_name)
+    if d is None or "inner_head" not in d["needs"]:
+        return None
+    return getattr(importlib.import_module(module_name), d["head"]), bool(d["head_ascii_only"])
@@ -1,5 +1,4 @@
 import os
-import glob
 import base64
 import gzip
 import re
@@ -8,6 +7,21 @@ import csv
 from bs4 import BeautifulSoup
 import xml.etree.ElementTree as ET
 from collections import defaultdict
+import bundle_manifest
+import page_store
+import validation_memo
+from result_model import CheckLog, issue, keep_files
+
+# ===== Khai báo checker (checker_registry đọc bằng ast: chỉ dùng literal) =====
+CHECKER = {
+    "label": "Civitek",
+    "command": "civitek",
+    "keyword": r"\bcivitek\b",
+    "entry": "run_civitek_check",
+    "lane": "heavy",
+    "cost_weight": 1.0,
+    "needs": ("xml_fields", "inner_html", "dom"),
+}
 
 # ==== Helper chọn thư mục dữ liệu “đúng” (dùng chung) ====
 def _has_data_here(d):
@@ -21,6 +35,9 @@ def _has_data_here(d):
     return False
 
 def resolve_data_dir(base_dir: str) -> str:
+    found = bundle_manifest.data_dir(base_dir)  # bundle đã giải nén có manifest -> khỏi quét đĩa
+    if found:
+        return found
     base_dir = os.path.abspath(base_dir)
     if os.path.isdir(base_dir) and _has_data_here(base_dir):
         return base_dir
@@ -66,7 +83,7 @@ def _fully_decode_base64_gzip(base64_content: str) -> str:
 def _load_txt_file(txt_path):
     records = []
     try:
-        with open(txt_path, 'r', encoding='utf-8') as f:
+        with open(txt_path, 'r', encoding='utf-8') as f, page_store.open_store(os.path.dirname(txt_path)) as store:
             for line in f:
                 if line.startswith("HEADER ROW"):
                     continue
@@ -75,7 +92,8 @@ def _load_txt_file(txt_path):
                     record_id = parts[0].strip().lower()
                     base64_data = parts[2].strip()
                     try:
-                        raw_content = _fully_decode_base64_gzip(base64_data)
+                        page = store.page(parts[0], base64_data)
+                        raw_content = page["html"] if page else _fully_decode_base64_gzip(base64_data)
                         records.append({'id': record_id, 'raw_content': raw_content, 'base64': base64_data})
                     except Exception:
                         pass
@@ -95,11 +113,21 @@ def _analyze_html(record):
     html_content = record['raw_content']
     errors = []
     if not html_content:
-        errors.append(f"ID: {record['id']} | Collection sai (Trang chưa load được)")
+        errors.append(issue(record['id'], "PAGE_NOT_LOADED", f"ID: {record['id']} | Collection sai (Trang chưa load được)"))
         return errors
     if "No matches found" in html_content:
         return errors
 
+    expand_state, reasons = validation_memo.memoized("civitek.expand", html_content, (),
+                                                     lambda: _expand_verdict(html_content))
+    if reasons:
+        errors.append(issue(record['id'], "PAGE_NOT_EXPANDED",
+                            f"ID: {record['id']} | Expand All = {expand_state} | Lý do lỗi: {'; '.join(reasons)}",
+                            field="Expand All", html=expand_state))
+    return errors
+
+def _expand_verdict(html_content):
+    """(trạng thái Expand All, các lý do lỗi) — chỉ phụ thuộc HTML nên được nhớ theo nội dung trang."""
     soup = BeautifulSoup(html_content, 'lxml')
     reasons = []
     expand_button = soup.find(id=re.compile(r'form:expand', re.IGNORECASE))
@@ -126,10 +154,14 @@ def _analyze_html(record):
         reasons.append(f"Danh sách {loading_names[0]} đang loading")
     elif len(loading_names) > 1:
         reasons.append(f"Các danh sách sau đang loading: {', '.join(loading_names)}")
+    return expand_state, tuple(reasons)
 
-    if reasons:
-        errors.append(f"ID: {record['id']} | Expand All = {expand_state} | Lý do lỗi: {'; '.join(reasons)}")
-    return errors
+def _html_title_text(html_content):
+    title_tag = BeautifulSoup(html_content, 'lxml').title
+    return title_tag.string.lower() if title_tag and title_tag.string else ""
+
+def _html_values(html_content):
+    return frozenset(v.strip() for v in re.findall(r'value="(.*?)"', html_content, flags=re.S | re.I))
 
 def _extract_case_number_from_html(html_text):
     m = re.search(
@@ -150,10 +182,11 @@ def _check_xml_vs_html(record, lead_node):
 
     # Check County Name
     name_county = (_get_field_value(lead_node, "1") or "").lower()
-    title_tag = BeautifulSoup(html_content, 'lxml').title
-    title_text = title_tag.string.lower() if title_tag and title_tag.string else ""
+    title_text = validation_memo.memoized("civitek.title", html_content, (), lambda: _html_title_text(html_content))
     if name_county and name_county not in title_text:
-        errors.append(f"ID: {record['id']} | Lỗi NAME county trong HTML không khớp với NAME county = '{name_county}' trong XML")
+        errors.append(issue(record['id'], "COUNTY_MISMATCH",
+                            f"ID: {record['id']} | Lỗi NAME county trong HTML không khớp với NAME county = '{name_county}' trong XML",
+                            field="County", xml=name_county, html=title_text))
 
     # Check Case Number
     f2 = (_get_field_value(lead_node, "2") or "").upper().strip()
@@ -163,27 +196,34 @@ def _check_xml_vs_html(record, lead_node):
     f6 = (_get_field_value(lead_node, "6") or "").upper().strip()
     expected = f"{f2}{f3}{f4}{f5}{f6}"
 
-    _, case_no_prefix = _extract_case_number_from_html(html_content)
+    _, case_no_prefix = validation_memo.memoized("civitek.case_number", html_content, (),
+                                                 lambda: _extract_case_number_from_html(html_content))
     if not case_no_prefix:
         if "No matches found" not in html_content:
-            errors.append(f"ID: {record['id']} | Không tìm thấy Case Number trong HTML để so sánh")
+            errors.append(issue(record['id'], "CASE_NUMBER_NOT_FOUND",
+                                f"ID: {record['id']} | Không tìm thấy Case Number trong HTML để so sánh",
+                                field="Case Number", xml=expected))
     else:
         case_no_prefix_clean = re.sub(r'[^A-Z0-9]+', '', case_no_prefix).upper()
         if expected != case_no_prefix_clean:
-            errors.append(f"ID: {record['id']} | Lỗi Case Number: Key XML '{expected}' ≠ Key HTML (bỏ mã county) '{case_no_prefix_clean}'")
+            errors.append(issue(record['id'], "CASE_NUMBER_MISMATCH",
+                                f"ID: {record['id']} | Lỗi Case Number: Key XML '{expected}' ≠ Key HTML (bỏ mã county) '{case_no_prefix_clean}'",
+                                field="Case Number", xml=expected, html=case_no_prefix_clean))
 
     # Check FieldIDs in HTML values
-    field_errors = []
-    value_matches = re.findall(r'value="(.*?)"', html_content, flags=re.S | re.I)
-    value_set = {v.strip() for v in value_matches}
+    field_errors, missing_fields = [], []
+    value_set = validation_memo.memoized("civitek.values", html_content, (), lambda: _html_values(html_content))
     if not (expected and any(expected in v for v in value_set)):
         for i in range(2, 7):
             fv = (_get_field_value(lead_node, str(i)) or "").strip()
             if fv and not (fv in value_set or fv in html_content):
                  field_errors.append(f"FieldID {i} = '{fv}'")
+                 missing_fields.append(str(i))
 
     if field_errors:
-        errors.append(f"ID: {record['id']} | Lỗi FieldID: {'; '.join(field_errors)} không tìm thấy trong HTML")
+        errors.append(issue(record['id'], "FIELD_NOT_IN_HTML",
+                            f"ID: {record['id']} | Lỗi FieldID: {'; '.join(field_errors)} không tìm thấy trong HTML",
+                            field=", ".join(missing_fields)))
 
     return errors
 
@@ -195,7 +235,8 @@ def _check_line_count_and_duplicates(file_path):
             lines = f.readlines()
         total_lines = len(lines)
         if total_lines != expected_lines:
-            errors.append(f'Lỗi số dòng (mong đợi {expected_lines}, thực tế {total_lines})')
+            errors.append(issue(None, "LINE_COUNT", f'Lỗi số dòng (mong đợi {expected_lines}, thực tế {total_lines})',
+                                xml=expected_lines, html=total_lines))
         seen_lines = set()
         duplicate_ids = set()
         for line in lines:
@@ -209,29 +250,51 @@ def _check_line_count_and_duplicates(file_path):
                 seen_lines.add(line)
         if duplicate_ids:
             for dup_id in sorted(list(duplicate_ids)):
-                errors.append(f"ID: {dup_id} | Thừa dòng (trùng lặp)")
+                errors.append(issue(dup_id, "DUPLICATE_LINE", f"ID: {dup_id} | Thừa dòng (trùng lặp)"))
     except Exception as e:
-        errors.append(f"Lỗi đọc file: {e}")
+        errors.append(issue(None, "TXT_UNREADABLE", f"Lỗi đọc file: {e}"))
     return errors
 
+def warmup():
+    """Gọi 1 lần khi worker khởi động: nạp sẵn lxml, regex và CSS selector dùng khi kiểm tra."""
+    record = {'id': 'warmup', 'raw_content': (
+        '<html><head><title>warmup</title></head><body><div class="ucn"><span>Case Number</span> 00X<br/></div>'
+        '<span class="ui-column-title">Doc #</span><input value="x"/></body></html>')}
+    lead = ET.fromstring('<Lead ID="warmup"><InputValue FieldID="1">warmup</InputValue></Lead>')
+    _analyze_html(record)
+    _check_xml_vs_html(record, lead)
+
+# Dòng ghi chú khi job bị hủy giữa chừng (kết quả phía trên vẫn giữ nguyên)
+CANCEL_NOTE = "\n⛔ Đã dừng giữa chừng (hủy hoặc quá hạn): kết quả trên chỉ gồm phần đã kiểm tra."
+
 # --- Main logic function for the server ---
-def run_civitek_check(directory_path):
+def run_civitek_check(directory_path, should_cancel=None, structured=False, only_files=None):
     """
     Main function to run all checks for the Civitek (old) tool.
+    should_cancel(): trả True thì dừng sau lead hiện tại, giữ kết quả đã có.
+    structured=True: trả dict kết quả có cấu trúc (result_model) thay cho text log.
+    only_files: chỉ kiểm tra các cặp file này (tên TXT/XML), dùng khi re-check sau khi xoá dòng lỗi.
     """
     data_dir = resolve_data_dir(directory_path)  # <-- CHUẨN HOÁ
-    results_log = []
-    txt_files = glob.glob(os.path.join(data_dir, "*_content.txt"))
+    results_log = CheckLog("civitek")
+    txt_files = keep_files([os.path.join(data_dir, f) for f in bundle_manifest.listdir(data_dir)
+                            if f.endswith("_content.txt") and not f.startswith(".")], only_files)
     if not txt_files:
-        return "Không tìm thấy file *_content.txt nào để xử lý."
+        return results_log.only("Không tìm thấy file *_content.txt nào để xử lý.").output(structured)
     results_log.append(f"Bắt đầu kiểm tra {len(txt_files)} cặp file...\n")
+    cancelled = False
     for txt_path in txt_files:
+        if should_cancel and should_cancel():
+            cancelled = True
+            break
         base_name = os.path.basename(txt_path).replace('_content.txt', '')
-        results_log.append(f"\n--- Đang xử lý: {base_name} ---")
+        results_log.begin_file(base_name, f"\n--- Đang xử lý: {base_name} ---")
         file_errors = []
         line_errors = _check_line_count_and_duplicates(txt_path)
         if line_errors:
-            results_log.append(f"  [Lỗi File]: {'; '.join(line_errors)}")
+            for err in line_errors:
+                results_log.record(err)
+            results_log.append(f"  [Lỗi File]: {'; '.join(err['text'] for err in line_errors)}")
         records = _load_txt_file(txt_path)
         xml_path = txt_path.replace("_content.txt", ".xml")
         xdoc, ns = None, {}
@@ -241,11 +304,14 @@ def run_civitek_check(directory_path):
                 if '}' in xdoc.tag:
                     ns['ns'] = xdoc.tag.split('}')[0][1:]
             except ET.ParseError:
-                results_log.append("  [Lỗi File]: Không thể đọc file XML.")
+                results_log.add(issue(None, "XML_UNREADABLE", "Không thể đọc file XML."), prefix="  [Lỗi File]: ")
         if not records:
-            results_log.append("  [Lỗi File]: Không có dữ liệu trong file TXT.")
+            results_log.add(issue(None, "TXT_EMPTY", "Không có dữ liệu trong file TXT."), prefix="  [Lỗi File]: ")
             continue
         for record in records:
+            if should_cancel and should_cancel():
+                cancelled = True
+                break
             record_errors = []
             record_errors.extend(_analyze_html(record))
             if xdoc is not None:
@@ -263,6 +329,12 @@ def run_civitek_check(directory_path):
             results_log.append("  ✅ Không phát hiện lỗi.")
         else:
             for err in file_errors:
-                results_log.append(f"  ❌ {err}")
+                results_log.add(err)
         results_log.append(f"  📌 Tổng số lỗi của file: {len(file_errors) + len(line_errors)}")
-    return "\n".join(results_log)
+        if cancelled:
+            break
+    results_log.end_file()
+    if cancelled:
+        results_log.cancelled = True
+        results_log.append(CANCEL_NOTE)
+    return results_log.output(structured)
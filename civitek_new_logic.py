@@ -6,6 +6,21 @@ import xml.etree.ElementTree as ET
 from pathlib import Path
 from bs4 import BeautifulSoup
 from datetime import datetime
+import bundle_manifest
+import page_store
+import validation_memo
+from result_model import CheckLog, issue, keep_files, SEVERITY_WARNING
+
+# ===== Khai báo checker (checker_registry đọc bằng ast: chỉ dùng literal) =====
+CHECKER = {
+    "label": "Civitek new",
+    "command": "civitek new",
+    "keyword": r"\bcivitek\s+new\b",
+    "entry": "run_civitek_new_check",
+    "lane": "heavy",
+    "cost_weight": 1.5,
+    "needs": ("xml_fields", "inner_html", "dom"),
+}
 
 # ==== Helper chọn thư mục dữ liệu “đúng” (dùng chung) ====
 def _has_data_here(d):
@@ -19,6 +34,9 @@ def _has_data_here(d):
     return False
 
 def resolve_data_dir(base_dir: str) -> str:
+    found = bundle_manifest.data_dir(base_dir)  # bundle đã giải nén có manifest -> khỏi quét đĩa
+    if found:
+        return found
     base_dir = os.path.abspath(base_dir)
     if os.path.isdir(base_dir) and _has_data_here(base_dir):
         return base_dir
@@ -90,7 +108,8 @@ def validate_county_name(soup, fields):
 
     # Giữ “cứng” như trước: sai => lỗi (không tách cảnh báo ở server)
     if xml_norm not in html_norm:
-        errors.append(f"Sai County Name (XML=\"{xml_county}\"; Title=\"{html_title}\")")
+        errors.append(issue(None, "COUNTY_MISMATCH", f"Sai County Name (XML=\"{xml_county}\"; Title=\"{html_title}\")",
+                            field="County", xml=xml_county, html=html_title))
     return errors
 
 def validate_search_form(soup, fields):
@@ -101,16 +120,19 @@ def validate_search_form(soup, fields):
         xml_val = fields.get(field_id, '')
         element = soup.select_one(selector)
         if not element:
-            errors.append(f"Sai {error_name} (XML=\"{xml_val}\", HTML=Không tìm thấy element)")
+            errors.append(issue(None, "FIELD_NOT_IN_HTML", f"Sai {error_name} (XML=\"{xml_val}\", HTML=Không tìm thấy element)",
+                                field=error_name, xml=xml_val))
             return
         html_val = element.get('value', 'Không tìm thấy')
         if is_date:
             xml_norm = normalize_date_str(xml_val)
             html_norm = normalize_date_str(html_val)
             if html_norm != xml_norm:
-                errors.append(f"Sai {error_name} (XML=\"{xml_val}\", HTML=\"{html_val}\")")
+                errors.append(issue(None, "FIELD_MISMATCH", f"Sai {error_name} (XML=\"{xml_val}\", HTML=\"{html_val}\")",
+                                    field=error_name, xml=xml_val, html=html_val))
         elif html_val != xml_val:
-            errors.append(f"Sai {error_name} (XML=\"{xml_val}\", HTML=\"{html_val}\")")
+            errors.append(issue(None, "FIELD_MISMATCH", f"Sai {error_name} (XML=\"{xml_val}\", HTML=\"{html_val}\")",
+                                field=error_name, xml=xml_val, html=html_val))
 
     check_and_add_error('2', 'Last Name', r'#form\:search_tab\:lastname')
     check_and_add_error('3', 'First Name', r'#form\:search_tab\:fname')
@@ -120,10 +142,13 @@ def validate_search_form(soup, fields):
     xml_val = fields.get('6', '')
     selected_options = soup.find_all('option', selected="selected")
     if len(selected_options) != 1:
-        errors.append(f"Sai Court Type (XML=\"{xml_val}\", HTML=Tìm thấy {len(selected_options)} lựa chọn)")
+        errors.append(issue(None, "COURT_TYPE_MISMATCH",
+                            f"Sai Court Type (XML=\"{xml_val}\", HTML=Tìm thấy {len(selected_options)} lựa chọn)",
+                            field="Court Type", xml=xml_val))
     elif selected_options[0].get('value') != xml_val:
         html_val = selected_options[0].get('value')
-        errors.append(f"Sai Court Type (XML=\"{xml_val}\", HTML=\"{html_val}\")")
+        errors.append(issue(None, "COURT_TYPE_MISMATCH", f"Sai Court Type (XML=\"{xml_val}\", HTML=\"{html_val}\")",
+                            field="Court Type", xml=xml_val, html=html_val))
 
     return errors
 
@@ -132,7 +157,7 @@ def validate_results_page_best_effort(soup, fields):
     errors.extend(validate_county_name(soup, fields))
 
     if "Charge Seq#" not in soup.get_text():
-        errors.append("Loading...(Trang chưa tải xong...)")
+        errors.append(issue(None, "PAGE_NOT_LOADED", "Loading...(Trang chưa tải xong...)"))
         return errors
 
     xml_lastname, xml_firstname = fields.get('2', '').upper(), fields.get('3', '').upper()
@@ -148,7 +173,9 @@ def validate_results_page_best_effort(soup, fields):
                 break
 
     if not target_row:
-        errors.append(f"Thiếu Last/First Name (Không tìm thấy dòng khớp với '{xml_firstname} {xml_lastname}')")
+        errors.append(issue(None, "NAME_NOT_FOUND",
+                            f"Thiếu Last/First Name (Không tìm thấy dòng khớp với '{xml_firstname} {xml_lastname}')",
+                            field="Last/First Name", xml=f"{xml_firstname} {xml_lastname}"))
         return errors
 
     # Checkbox check
@@ -164,19 +191,21 @@ def validate_results_page_best_effort(soup, fields):
                     is_any_unchecked = True
                     break
     if is_any_unchecked:
-        errors.append("Sai checkbox")
+        errors.append(issue(None, "CHECKBOX_UNCHECKED", "Sai checkbox", field="Checkbox"))
 
     # Details row
     details_row = soup.select_one('tr.ui-expanded-row-content')
     if not details_row:
-        errors.append("Cảnh báo: Tìm thấy người dùng nhưng không có mục chi tiết.")
+        errors.append(issue(None, "DETAILS_MISSING", "Cảnh báo: Tìm thấy người dùng nhưng không có mục chi tiết.",
+                            severity=SEVERITY_WARNING))
         return errors
 
     # Date range
     xml_date_from_str, xml_date_to_str = fields.get('4', ''), fields.get('5', '')
     file_date_cells = details_row.find_all('td', string=re.compile(r'^\d{1,2}/\d{1,2}/\d{4}$'))
     if not file_date_cells:
-        errors.append("Sai Date (Không tìm thấy FileDate trong HTML)")
+        errors.append(issue(None, "DATE_NOT_FOUND", "Sai Date (Không tìm thấy FileDate trong HTML)", field="Date",
+                            xml=f"{xml_date_from_str}-{xml_date_to_str}"))
     else:
         try:
             html_file_date_str = file_date_cells[0].get_text(strip=True)
@@ -185,15 +214,17 @@ def validate_results_page_best_effort(soup, fields):
             to_obj   = datetime.strptime(normalize_date_str(xml_date_to_str), date_format)
             file_obj = datetime.strptime(normalize_date_str(html_file_date_str), date_format)
             if not (from_obj <= file_obj <= to_obj):
-                errors.append(f"Sai Date (XML Range=\"{xml_date_from_str}\"-\"{xml_date_to_str}\"; HTML FileDate=\"{html_file_date_str}\")")
+                errors.append(issue(None, "DATE_OUT_OF_RANGE",
+                                    f"Sai Date (XML Range=\"{xml_date_from_str}\"-\"{xml_date_to_str}\"; HTML FileDate=\"{html_file_date_str}\")",
+                                    field="Date", xml=f"{xml_date_from_str}-{xml_date_to_str}", html=html_file_date_str))
         except (ValueError, TypeError) as e:
-            errors.append(f"Sai Date (Lỗi định dạng ngày tháng: {e})")
+            errors.append(issue(None, "DATE_INVALID", f"Sai Date (Lỗi định dạng ngày tháng: {e})", field="Date"))
 
     # Court Type
     xml_code = fields.get('6', '')
     ucn_link = details_row.select_one('a.ui-link')
     if not ucn_link:
-        errors.append("Lỗi: Không tìm thấy UCN link trong mục chi tiết.")
+        errors.append(issue(None, "UCN_NOT_FOUND", "Lỗi: Không tìm thấy UCN link trong mục chi tiết.", field="Court Type"))
     else:
         ucn_raw = ucn_link.get_text(strip=True)
         ucn_normalized = re.sub(r'[^A-Z0-9]+', '', ucn_raw.upper())
@@ -202,46 +233,77 @@ def validate_results_page_best_effort(soup, fields):
         match = re.search(r'^\d{4}([A-Z]{1,3})', ucn_normalized)
         html_code = match.group(1) if match else "Không thể trích xuất"
         if html_code != xml_code:
-            errors.append(f"Sai Court Type (XML=\"{xml_code}\", Trích xuất từ UCN=\"{html_code}\")")
+            errors.append(issue(None, "COURT_TYPE_MISMATCH",
+                                f"Sai Court Type (XML=\"{xml_code}\", Trích xuất từ UCN=\"{html_code}\")",
+                                field="Court Type", xml=xml_code, html=html_code))
 
     return errors
 
+VALIDATED_FIELDS = ("1", "2", "3", "4", "5", "6")  # FieldID mà validate_* đọc (khoá memo)
+
+def validate_page(html_content, fields):
+    """Lỗi của 1 trang (chưa gắn ID): form tìm kiếm hoặc trang kết quả."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    # Phân biệt Search form vs Results page
+    if soup.select_one(r'#form\:search_tab\:lastname'):
+        return tuple(validate_search_form(soup, fields))
+    return tuple(validate_results_page_best_effort(soup, fields))
+
+def warmup():
+    """Gọi 1 lần khi worker khởi động: nạp sẵn html.parser, regex và CSS selector."""
+    soup = BeautifulSoup('<html><head><title>warmup</title></head><body>Charge Seq#</body></html>', 'html.parser')
+    validate_search_form(soup, {})
+    validate_results_page_best_effort(soup, {})
+
+# Dòng ghi chú khi job bị hủy giữa chừng (kết quả phía trên vẫn giữ nguyên)
+CANCEL_NOTE = "\n⛔ Đã dừng giữa chừng (hủy hoặc quá hạn): kết quả trên chỉ gồm phần đã kiểm tra."
+
 # ===== Main logic (đã thêm tổng kết) =====
-def run_civitek_new_check(directory_path):
+def run_civitek_new_check(directory_path, should_cancel=None, structured=False, only_files=None):
+    """
+    should_cancel(): trả True thì dừng sau lead hiện tại, giữ kết quả đã có.
+    structured=True: trả dict kết quả có cấu trúc (result_model) thay cho text log.
+    only_files: chỉ kiểm tra các cặp file này (tên TXT/XML), dùng khi re-check sau khi xoá dòng lỗi.
+    """
     data_dir = Path(resolve_data_dir(directory_path))
-    results_log = []
+    results_log = CheckLog("civitek_new")
 
     # Bộ đếm tổng để in “TỔNG KẾT TOÀN BỘ QUÁ TRÌNH”
     total_detailed_errors_all_files = 0  # Tổng số lỗi chi tiết (không tính cảnh báo)
     error_ids_all_files = set()          # Tập hợp ID có lỗi (không tính cảnh báo)
 
-    content_files = list(data_dir.glob("*_content.txt"))
+    content_files = keep_files([data_dir / f for f in bundle_manifest.listdir(data_dir) if f.endswith("_content.txt")], only_files)
     if not content_files:
-        return "Không tìm thấy file _content.txt nào để xử lý."
+        return results_log.only("Không tìm thấy file _content.txt nào để xử lý.").output(structured)
     results_log.append(f"Bắt đầu kiểm tra {len(content_files)} cặp file...\n")
 
+    cancelled = False
     for content_file_path in content_files:
+        if should_cancel and should_cancel():
+            cancelled = True
+            break
         base_name = content_file_path.stem.replace('_content', '')
         xml_file_path = data_dir / f"{base_name}.xml"
 
-        results_log.append(f"\n--- Đang xử lý: {base_name} ---")
+        results_log.begin_file(base_name, f"\n--- Đang xử lý: {base_name} ---")
         if not xml_file_path.exists():
-            results_log.append(f"  ❌ Lỗi: Không tìm thấy file XML tương ứng: {xml_file_path.name}")
+            results_log.add(issue(None, "XML_MISSING", f"Lỗi: Không tìm thấy file XML tương ứng: {xml_file_path.name}"))
             continue
 
         # Parse TXT → {id: html}
         id_to_html = {}
         try:
-            with open(content_file_path, 'r', encoding='utf-8') as f:
+            with open(content_file_path, 'r', encoding='utf-8') as f, page_store.open_store(str(data_dir)) as store:
                 for line in f:
                     parts = line.strip().split('|')
                     if len(parts) >= 3:
                         uuid, base64_content = parts[0], parts[2]
-                        html_content = fully_decode_base64_gzip(base64_content)
+                        page = store.page(uuid, base64_content)
+                        html_content = page["html"] if page else fully_decode_base64_gzip(base64_content)
                         if uuid and html_content:
                             id_to_html[uuid] = html_content
         except Exception as e:
-            results_log.append(f"  ❌ Lỗi khi giải mã {content_file_path.name}: {e}")
+            results_log.add(issue(None, "TXT_UNREADABLE", f"Lỗi khi giải mã {content_file_path.name}: {e}"))
             continue
 
         # Parse XML → {id: {FieldID: text}}
@@ -256,7 +318,7 @@ def run_civitek_new_check(directory_path):
                         inp.get('FieldID'): (inp.text or '') for inp in (lead.findall("ns:InputValue", ns) if ns else lead.findall("InputValue"))
                     }
         except ET.ParseError as e:
-            results_log.append(f"  ❌ Lỗi khi đọc {xml_file_path.name}: {e}")
+            results_log.add(issue(None, "XML_UNREADABLE", f"Lỗi khi đọc {xml_file_path.name}: {e}"))
             continue
 
         # Kiểm tra từng lead
@@ -265,47 +327,51 @@ def run_civitek_new_check(directory_path):
         error_ids_this_file = set()
 
         for lead_id, fields in leads_data_from_xml.items():
+            if should_cancel and should_cancel():
+                cancelled = True
+                break
             errors_for_lead = []
             html_content = id_to_html.get(lead_id)
 
             if not html_content:
-                errors_for_lead.append("Lỗi: Không có file HTML nào được giải mã.")
+                errors_for_lead.append(issue(None, "HTML_EMPTY", "Lỗi: Không có file HTML nào được giải mã."))
             else:
-                soup = BeautifulSoup(html_content, 'html.parser')
-                # Phân biệt Search form vs Results page
-                if soup.select_one(r'#form\:search_tab\:lastname'):
-                    errors_for_lead.extend(validate_search_form(soup, fields))
-                else:
-                    errors_for_lead.extend(validate_results_page_best_effort(soup, fields))
+                # trang giống hệt nhau (cùng field XML) chỉ dựng DOM 1 lần; lỗi chưa gắn ID nên dùng lại được
+                errors_for_lead.extend(validation_memo.memoized(
+                    "civitek_new.page", html_content, tuple(fields.get(k, '') for k in VALIDATED_FIELDS),
+                    lambda: validate_page(html_content, fields)))
 
             if errors_for_lead:
                 # Tách lỗi “cứng” (không phải cảnh báo) để đếm
-                hard_errors = [e for e in errors_for_lead if not e.startswith("Cảnh báo:")]
-                warnings    = [e for e in errors_for_lead if e.startswith("Cảnh báo:")]
+                hard_errors = [{**e, "id": lead_id} for e in errors_for_lead if e["severity"] != SEVERITY_WARNING]
+                warnings    = [{**e, "id": lead_id} for e in errors_for_lead if e["severity"] == SEVERITY_WARNING]
 
                 if hard_errors:
                     # Ghi log gồm cả cảnh báo (nếu có), nhưng chỉ đếm lỗi cứng
                     error_ids_this_file.add(lead_id)
                     detailed_errors_this_file += len(hard_errors)
-                    msg = ", ".join(hard_errors + warnings)
-                    file_errors.append(f"ID: {lead_id} | {msg}")
-                else:
-                    # Chỉ có cảnh báo → vẫn log nhưng không tăng bộ đếm
-                    file_errors.append(f"ID: {lead_id} | {', '.join(warnings)}")
+                # Chỉ có cảnh báo → vẫn log nhưng không tăng bộ đếm
+                lead_issues = hard_errors + warnings
+                file_errors.append((lead_issues, f"ID: {lead_id} | {', '.join(e['text'] for e in lead_issues)}"))
 
         # Tổng hợp theo file
         if not file_errors:
             results_log.append("  ✅ Không phát hiện lỗi.")
         else:
-            for err in file_errors:
-                results_log.append(f"  ❌ {err}")
+            for lead_issues, line in file_errors:
+                for e in lead_issues:
+                    results_log.record(e)
+                results_log.append(f"  ❌ {line}")
             results_log.append(f"  📌 Tổng số lỗi của file: {detailed_errors_this_file} (trên {len(error_ids_this_file)} ID)")
 
         # Cộng dồn cho toàn quá trình
         total_detailed_errors_all_files += detailed_errors_this_file
         error_ids_all_files.update(error_ids_this_file)
+        if cancelled:
+            break
 
     # --- TỔNG KẾT TOÀN BỘ QUÁ TRÌNH ---
+    results_log.end_file()
     results_log.append("\n--- TỔNG KẾT TOÀN BỘ QUÁ TRÌNH ---")
     if total_detailed_errors_all_files == 0:
         results_log.append("✅ Tổng số lỗi chi tiết: 0")
@@ -315,5 +381,8 @@ def run_civitek_new_check(directory_path):
         results_log.append("✅ Tổng số ID lỗi: 0")
     else:
         results_log.append(f"❌ Tổng số ID lỗi: {len(error_ids_all_files)}")
+    if cancelled:
+        results_log.cancelled = True
+        results_log.append(CANCEL_NOTE)
 
-    return "\n".join(results_log)
+    return results_log.output(structured)
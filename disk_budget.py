@@ -0,0 +1,246 @@
+# disk_budget.py — sổ giữ chỗ đĩa dùng chung cho mọi process trên máy (web worker, pool,
+# executor service, spool_worker, CLI batch_check)
+# Kiểm tra dung lượng trống 1 lần trước khi tải/giải nén không đủ: nhiều job cùng qua kiểm tra
+# rồi cùng ghi -> đầy /tmp giữa chừng (errno 28 / 507). Giờ mỗi job giữ chỗ trước số byte sẽ ghi
+# (Content-Length khi tải, tổng file_size member khi giải nén) trong sổ DISK_LEDGER (JSON + flock).
+# Job chỉ bắt đầu khi: dung lượng trống - tổng đang giữ - headroom >= số byte cần; không thì xếp
+# hàng (FIFO theo từng ổ đĩa) chờ job khác ghi xong / janitor dọn. Quá thời gian chờ mới báo lỗi
+# (DiskFull = OSError errno 28 -> các chỗ đang bắt errno 28 vẫn trả 507 như cũ).
+# Byte job đã ghi vẫn nằm trong phần giữ chỗ tới khi job trả chỗ: ước lượng dư, chỉ làm chờ lâu hơn.
+# Process chết giữa chừng: dòng của nó bị bỏ khi pid không còn (máy khác: sau DISK_RESERVATION_TTL_S).
+# Upload nhiều request (chunk/stream) giữ chỗ theo phiên: hold(key) ... release(key), gọi được từ bất kỳ
+# process nào; phiên có ttl thì sống tới khi không được touch() quá ttl giây (upload bị bỏ dở).
+# Phần giữ của phiên luôn là số byte còn phải ghi: touch(key, còn_lại) khi đã ghi, resize(key, n) trước khi ghi.
+import os
+import json
+import time
+import errno
+import fcntl
+import socket
+import shutil
+import uuid
+from contextlib import contextmanager
+
+DISK_LEDGER = os.environ.get("DISK_LEDGER", "/tmp/.disk_reservations.json")
+DISK_HEADROOM_BYTES = int(os.environ.get("DISK_HEADROOM_MB", "500")) * 1024 * 1024  # luôn chừa lại
+DISK_WAIT_S = float(os.environ.get("DISK_WAIT_S", "600"))              # job nền chờ tối đa
+DISK_WAIT_REQUEST_S = float(os.environ.get("DISK_WAIT_REQUEST_S", "20"))  # trong request HTTP
+DISK_RESERVATION_TTL_S = float(os.environ.get("DISK_RESERVATION_TTL_S", "7200"))
+POLL_S = 0.5
+JANITOR_EVERY_S = 10
+
+_HOST = socket.gethostname()
+_janitor = None
+
+class DiskFull(OSError):
+    """Chờ quá hạn mà vẫn không đủ chỗ (hoặc cần nhiều hơn cả ổ đĩa)."""
+    def __init__(self, message: str):
+        super().__init__(errno.ENOSPC, message)
+
+def human(n):
+    for u in ["B","KB","MB","GB","TB"]:
+        if n < 1024: return f"{n:.1f}{u}"
+        n /= 1024
+    return f"{n:.1f}PB"
+
+def set_janitor(fn):
+    """fn() được gọi (tối đa 1 lần / JANITOR_EVERY_S giây) khi có job đang chờ chỗ."""
+    global _janitor
+    _janitor = fn
+
+# ===== Sổ giữ chỗ =====
+def _alive(e: dict) -> bool:
+    if e.get("ttl"):
+        return time.time() - e["touched"] < e["ttl"]
+    if e.get("host") != _HOST:
+        return time.time() - e.get("since", 0) < DISK_RESERVATION_TTL_S
+    try:
+        os.kill(e["pid"], 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # pid của user khác: coi như còn sống
+
+@contextmanager
+def _ledger():
+    """Đọc-sửa-ghi sổ dưới flock EX; dòng của process đã chết bị bỏ."""
+    fd = os.open(DISK_LEDGER, os.O_CREAT | os.O_RDWR, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        with os.fdopen(os.dup(fd), "r+", encoding="utf-8") as f:
+            try:
+                entries = json.load(f)
+            except ValueError:
+                entries = {}
+            entries = {rid: e for rid, e in entries.items() if _alive(e)}
+            yield entries
+            f.seek(0)
+            f.truncate()
+            json.dump(entries, f)
+    finally:
+        os.close(fd)  # đóng fd cũng nhả flock
+
+def _fits(entries: dict, rid: str, usage) -> bool:
+    me = entries[rid]
+    same = [e for r, e in entries.items() if r != rid and e["dev"] == me["dev"]]
+    if any(e["waiting"] and (e["since"], e["seq"]) < (me["since"], me["seq"]) for e in same):
+        return False  # FIFO: job chờ trước được chỗ trước
+    held = sum(e["bytes"] for e in same if not e["waiting"])
+    return usage.free - held >= me["bytes"] + me["headroom"]
+
+def _entry(nbytes: int, base_dir: str, path: str, label: str, headroom: int, ttl: float = None) -> dict:
+    usage = shutil.disk_usage(base_dir)
+    if nbytes + headroom > usage.total:
+        raise DiskFull(f"Cần {human(nbytes)} (+{human(headroom)} dự phòng) nhưng cả ổ đĩa chỉ có {human(usage.total)}.")
+    now = time.time()
+    return {"bytes": nbytes, "headroom": headroom, "dev": os.stat(base_dir).st_dev,
+            "path": os.path.abspath(path) if path else None, "label": label,
+            "pid": os.getpid(), "host": _HOST, "since": now, "seq": time.monotonic_ns(),
+            "ttl": ttl, "touched": now, "waiting": True}
+
+def _held_by_others(entries: dict, rid: str, dev: int) -> int:
+    return sum(e["bytes"] for r, e in entries.items() if r != rid and e["dev"] == dev and not e["waiting"])
+
+def _wait_until(rid: str, nbytes: int, base_dir: str, wait: float, attempt):
+    """
+    Gọi attempt(entries, usage) dưới flock tới khi trả True (đã giữ được chỗ cho dòng rid);
+    quá `wait` giây -> DiskFull. Trong lúc chờ thì gọi janitor.
+    """
+    deadline = time.monotonic() + wait
+    next_janitor = 0.0
+    dev = os.stat(base_dir).st_dev
+    while True:
+        with _ledger() as entries:
+            usage = shutil.disk_usage(base_dir)
+            if attempt(entries, usage):
+                return
+            held = _held_by_others(entries, rid, dev)
+        now = time.monotonic()
+        if now >= deadline:
+            raise DiskFull(f"Hệ thống sắp đầy đĩa: cần {human(nbytes)}, còn {human(usage.free)} trống, "
+                           f"{human(held)} đang được job khác giữ chỗ (đã chờ {int(wait)}s).")
+        if _janitor is not None and now >= next_janitor:
+            next_janitor = now + JANITOR_EVERY_S
+            try:
+                _janitor()
+            except Exception:
+                pass
+        time.sleep(POLL_S)
+
+def _acquire(rid: str, entry: dict, base_dir: str, wait: float):
+    """Xếp `entry` vào sổ với khoá rid rồi chờ tới khi đủ chỗ; quá `wait` giây -> bỏ dòng, DiskFull."""
+    def attempt(entries, usage):
+        entries.setdefault(rid, entry)
+        if _fits(entries, rid, usage):
+            entries[rid]["waiting"] = False
+            return True
+        return False
+
+    try:
+        _wait_until(rid, entry["bytes"], base_dir, wait, attempt)
+    except BaseException:
+        with _ledger() as entries:
+            entries.pop(rid, None)
+        raise
+
+@contextmanager
+def reserve(nbytes: int, base_dir: str, path: str = None, label: str = "",
+            headroom: int = None, wait: float = None):
+    """
+    with reserve(n, base_dir, path=thư mục/file sẽ ghi): ... — chờ tới khi đủ chỗ cho n byte trên ổ
+    chứa base_dir, giữ chỗ trong khối with (janitor không xoá `path`), ra khỏi with thì trả chỗ.
+    Quá `wait` giây (mặc định DISK_WAIT_S) vẫn không đủ -> DiskFull.
+    """
+    headroom = DISK_HEADROOM_BYTES if headroom is None else headroom
+    rid = uuid.uuid4().hex
+    _acquire(rid, _entry(max(0, int(nbytes or 0)), base_dir, path, label, headroom),
+             base_dir, DISK_WAIT_S if wait is None else wait)
+    try:
+        yield rid
+    finally:
+        with _ledger() as entries:
+            entries.pop(rid, None)
+
+def ensure(nbytes: int, base_dir: str, headroom: int = None, wait: float = None):
+    """Chờ tới khi đủ chỗ cho n byte (tính cả phần job khác đang giữ) nhưng không giữ lại."""
+    with reserve(nbytes, base_dir, headroom=headroom, wait=wait):
+        pass
+
+# ===== Giữ chỗ theo phiên (upload nhiều request) =====
+def hold(key: str, nbytes: int, base_dir: str, path: str = None, label: str = "",
+         headroom: int = None, wait: float = None, ttl: float = None):
+    """
+    Như reserve() nhưng không gắn với khối with: giữ chỗ cho phiên `key` tới khi release(key).
+    Phiên đã có (resume, request tới process khác) thì chỉ touch(). ttl=None: sống theo process
+    gọi hold (như reserve); có ttl: sống tới khi quá ttl giây không touch().
+    """
+    with _ledger() as entries:
+        if key in entries and not entries[key]["waiting"]:
+            entries[key]["touched"] = time.time()
+            return
+    headroom = DISK_HEADROOM_BYTES if headroom is None else headroom
+    _acquire(key, _entry(max(0, int(nbytes or 0)), base_dir, path, label, headroom, ttl),
+             base_dir, DISK_WAIT_S if wait is None else wait)
+
+def resize(key: str, nbytes: int, base_dir: str, headroom: int = None, wait: float = None):
+    """
+    Đặt phần giữ chỗ của phiên = nbytes (số byte sắp ghi mà CHƯA ghi: byte đã ghi đã nằm trong
+    phần dung lượng đã dùng, giữ tiếp là tính 2 lần). Giảm thì làm ngay; tăng thì chờ tới khi đủ chỗ,
+    chính dòng của phiên không tính là "job khác giữ". Phiên không còn -> KeyError.
+    """
+    nbytes = max(0, int(nbytes or 0))
+    headroom = DISK_HEADROOM_BYTES if headroom is None else headroom
+    usage = shutil.disk_usage(base_dir)
+    if nbytes + headroom > usage.total:
+        raise DiskFull(f"Cần {human(nbytes)} (+{human(headroom)} dự phòng) nhưng cả ổ đĩa chỉ có {human(usage.total)}.")
+
+    def attempt(entries, usage):
+        me = entries.get(key)
+        if me is None:
+            raise KeyError(key)
+        me["touched"] = time.time()
+        if nbytes <= me["bytes"]:
+            me["bytes"] = nbytes
+            return True
+        old = me["bytes"], me["headroom"]
+        me["bytes"], me["headroom"] = nbytes, headroom
+        ok = _fits(entries, key, usage)
+        me["headroom"] = old[1]
+        if not ok:
+            me["bytes"] = old[0]
+        return ok
+
+    _wait_until(key, nbytes, base_dir, DISK_WAIT_S if wait is None else wait, attempt)
+
+def touch(key: str, nbytes: int = None):
+    """Phiên còn hoạt động (gia hạn ttl); nbytes: số byte còn phải ghi (chỉ giảm, không chờ; tăng: resize)."""
+    with _ledger() as entries:
+        if key in entries:
+            entries[key]["touched"] = time.time()
+            if nbytes is not None:
+                entries[key]["bytes"] = min(entries[key]["bytes"], max(0, int(nbytes)))
+
+def release(key: str):
+    with _ledger() as entries:
+        entries.pop(key, None)
+
+# ===== Cho janitor / health =====
+def reserved_paths() -> set:
+    """Đường dẫn đang được job giữ chỗ để ghi (janitor không được xoá)."""
+    with _ledger() as entries:
+        return {e["path"] for e in entries.values() if e["path"]}
+
+def pending_bytes(base_dir: str) -> int:
+    """Tổng byte đang giữ + đang chờ trên ổ chứa base_dir (janitor tính vào ngân sách)."""
+    dev = os.stat(base_dir).st_dev
+    with _ledger() as entries:
+        return sum(e["bytes"] for e in entries.values() if e["dev"] == dev)
+
+def status() -> dict:
+    with _ledger() as entries:
+        held = [e for e in entries.values() if not e["waiting"]]
+        waiting = [e for e in entries.values() if e["waiting"]]
+    return {"held": len(held), "held_bytes": sum(e["bytes"] for e in held),
+            "waiting": len(waiting), "waiting_bytes": sum(e["bytes"] for e in waiting),
+            "entries": [{k: e[k] for k in ("label", "bytes", "waiting", "since", "path")} for e in entries.values()]}
@@ -0,0 +1,230 @@
+# executor_service.py — 1 pool worker dùng chung cho mọi web worker (gunicorn -w N)
+# Không có service: mỗi web worker tự tạo WorkerPool(WORKERS) khi import app -> N x WORKERS
+# process checker tranh nhau CPU, không có trần chung. Chạy pool thành 1 process riêng:
+#     EXECUTOR_SOCKET=/tmp/checker_exec.sock python -m executor_service
+#     EXECUTOR_SOCKET=/tmp/checker_exec.sock gunicorn -w 4 app:app
+# -> web worker không tạo pool mà gửi job qua Unix socket; tổng số process checker = WORKERS
+# của service (1 con số cho cả deployment), worker đã warm dùng chung cho mọi web worker.
+# Xếp lane/chi phí/trần client (SCHED) cũng ở service: 1 hàng đợi chung cho mọi web worker, web
+# worker chỉ gửi job rồi chờ; vị trí trong hàng đợi / metrics scheduler hỏi lại service.
+#
+# Giao thức (multiprocessing.connection, pickle — chỉ tin process cùng máy: socket chmod 600,
+# EXECUTOR_AUTHKEY nếu muốn thêm xác thực), mỗi job 1 kết nối:
+#   client  -> ("run", fn, args, kwargs, timeout, slot)   slot = {lane, cost, job_id, client, priority} | None
+#   client  -> ("status",) | ("position", job_id) | ("scheduler",)
+#   client  -> ("stop", "cancel")                    job bị hủy / client bỏ đi (kể cả khi còn chờ slot)
+#   service -> ("admitted", None)                    job được nhận slot: client gọi on_admit()
+#   service -> ("stopping", lý_do)                   quá hạn / bị hủy: client gọi on_stop(lý_do)
+#   service -> ("ok", kết_quả) | ("error", exception) | ("killed", lý_do) | ("crashed", thông_báo)
+#            | ("cancelled", None)                   bị hủy khi còn chờ slot -> scheduler.Cancelled
+# Web worker chết giữa job (mất kết nối) -> service coi như hủy.
+import os
+import sys
+import signal
+import uuid
+import threading
+from contextlib import nullcontext
+from multiprocessing.connection import Listener, Client
+import scheduler
+import worker_pool
+
+EXECUTOR_SOCKET = os.environ.get("EXECUTOR_SOCKET")  # rỗng: app tự tạo pool trong process (như cũ)
+EXECUTOR_AUTHKEY = os.environ.get("EXECUTOR_AUTHKEY", "").encode() or None
+SERVICE_START_METHOD = "forkserver"
+
+class ServiceUnavailable(Exception):
+    """Không kết nối được executor service (chưa chạy, sai EXECUTOR_SOCKET, sai authkey...)."""
+
+# ===== Phía web worker =====
+class ExecutorClient:
+    """Thay cho WorkerPool trong web worker: cùng hàm run() / status() nhưng job chạy ở service."""
+    def __init__(self, path: str, authkey: bytes = None):
+        self.path = path
+        self.authkey = authkey
+
+    def _connect(self):
+        try:
+            return Client(self.path, family="AF_UNIX", authkey=self.authkey)
+        except Exception as e:
+            raise ServiceUnavailable(f"Không kết nối được executor service ({self.path}): "
+                                     f"{type(e).__name__}: {e}") from e
+
+    def run(self, fn, *args, timeout: float = None, cancelled=None, on_stop=None,
+            slot: dict = None, on_admit=None, **kwargs):
+        """
+        Như WorkerPool.run (fn phải pickle được theo tên, vd. app.run_prepared).
+        slot={lane, cost, job_id, client, priority}: chờ slot trong SCHED của service trước (như
+        SCHED.slot(...)); được nhận thì gọi on_admit(), bị hủy khi còn chờ -> scheduler.Cancelled.
+        """
+        conn = self._connect()
+        try:
+            conn.send(("run", fn, args, kwargs, timeout, slot))
+            stop_sent = False
+            while True:
+                if conn.poll(0.25):
+                    kind, value = conn.recv()
+                    if kind == "admitted":
+                        if on_admit:
+                            on_admit()
+                        continue
+                    if kind == "stopping":
+                        if on_stop:
+                            on_stop(value)
+                        continue
+                    if kind == "ok":
+                        return value
+                    if kind == "error":
+                        raise value
+                    if kind == "cancelled":
+                        raise scheduler.Cancelled((slot or {}).get("job_id"))
+                    if kind == "killed":
+                        raise worker_pool.JobKilled(value)
+                    raise worker_pool.WorkerCrashed(value)
+                if not stop_sent and cancelled is not None and cancelled():
+                    conn.send(("stop", "cancel"))
+                    stop_sent = True
+        except (EOFError, OSError) as e:
+            raise worker_pool.WorkerCrashed(f"Mất kết nối executor service ({self.path}): {e}") from e
+        finally:
+            conn.close()
+
+    def _ask(self, *msg):
+        """Gửi 1 câu hỏi, trả (True, giá_trị) hoặc (False, lỗi) khi service không trả lời được."""
+        try:
+            conn = self._connect()
+        except ServiceUnavailable as e:
+            return False, str(e)
+        try:
+            conn.send(msg)
+            return True, conn.recv()[1]
+        except (EOFError, OSError) as e:
+            return False, f"{type(e).__name__}: {e}"
+        finally:
+            conn.close()
+
+    def status(self) -> dict:
+        """pool_status() của service (workers, ready, idle/busy...); service không chạy -> {"error": ...}."""
+        ok, value = self._ask("status")
+        return {"service": self.path, **value} if ok else {"service": self.path, "error": value}
+
+    def queue_position(self, job_id: str):
+        """SCHED.queue_position(job_id) của service; None nếu job không còn chờ / service không trả lời."""
+        ok, value = self._ask("position", job_id)
+        return value if ok else None
+
+    def scheduler_metrics(self) -> dict:
+        """SCHED.metrics() của service (hàng đợi chung của mọi web worker)."""
+        ok, value = self._ask("scheduler")
+        return {"service": self.path, **value} if ok else {"service": self.path, "error": value}
+
+    def shutdown(self):
+        pass  # pool thuộc về service
+
+def connect(path: str = None) -> ExecutorClient:
+    return ExecutorClient(path or EXECUTOR_SOCKET, EXECUTOR_AUTHKEY)
+
+# ===== Phía service =====
+def _send(conn, msg):
+    try:
+        conn.send(msg)
+    except (EOFError, OSError):
+        pass  # client đã đi
+    except Exception as e:  # kết quả / exception không pickle được
+        _send(conn, ("error", RuntimeError(f"{type(e).__name__}: {e}")))
+
+def _handle(conn, pool, sched, status_fn):
+    try:
+        msg = conn.recv()
+    except Exception:
+        conn.close()
+        return
+    if msg[0] in ("status", "position", "scheduler"):
+        if msg[0] == "status":
+            value = status_fn()
+        elif msg[0] == "position":
+            value = sched.queue_position(msg[1])
+        else:
+            value = sched.metrics()
+        _send(conn, ("ok", value))
+        conn.close()
+        return
+    _, fn, args, kwargs, timeout, slot = msg
+    if slot is not None:
+        slot = {**slot, "job_id": slot.get("job_id") or uuid.uuid4().hex}
+    stop = {"reason": None}
+    finished = threading.Event()
+
+    def _watch():
+        """Thread duy nhất đọc conn sau khi nhận job: lệnh dừng tới cả khi job còn chờ slot."""
+        while not finished.is_set() and stop["reason"] is None:
+            try:
+                if conn.poll(0.25):
+                    stop["reason"] = conn.recv()[1]
+            except (EOFError, OSError):
+                stop["reason"] = "cancel"  # web worker chết / đóng kết nối
+        if stop["reason"] is not None and slot is not None:
+            sched.cancel(slot["job_id"])  # còn trong hàng đợi -> rời ngay (Cancelled)
+
+    watcher = threading.Thread(target=_watch, daemon=True)
+    watcher.start()
+    try:
+        admit = sched.slot(**slot, on_admit=lambda: _send(conn, ("admitted", None)),
+                           cancelled=lambda: stop["reason"] is not None) if slot is not None else nullcontext()
+        with admit:
+            reply = ("ok", pool.run(fn, *args, timeout=timeout, cancelled=lambda: stop["reason"] is not None,
+                                    on_stop=lambda reason: _send(conn, ("stopping", reason)), **kwargs))
+    except scheduler.Cancelled:
+        reply = ("cancelled", None)
+    except worker_pool.JobKilled as e:
+        reply = ("killed", str(e))
+    except worker_pool.WorkerCrashed as e:
+        reply = ("crashed", str(e))
+    except BaseException as e:
+        reply = ("error", e)
+    finished.set()
+    watcher.join()
+    _send(conn, reply)
+    conn.close()
+
+def _claim_socket(path: str):
+    """Xoá socket cũ còn sót; đã có service khác đang nghe thì thoát."""
+    if not os.path.exists(path):
+        return
+    try:
+        Client(path, family="AF_UNIX", authkey=EXECUTOR_AUTHKEY).close()
+    except Exception:
+        os.remove(path)
+        return
+    raise SystemExit(f"Đã có executor service đang chạy ở {path}")
+
+def serve(path: str):
+    # app.py thấy EXECUTOR_ROLE=service thì không tự tạo pool / client; pool tạo ở đây,
+    # gán vào app.EXEC để app.pool_status() báo đúng trạng thái.
+    # Service có 1 thread / kết nối, worker được thay (timeout, hủy, max_tasks_per_child) trong lúc các
+    # thread đó đang chạy -> fork lúc này có thể chép cả lock đang bị giữ sang con. Mặc định forkserver:
+    # worker fork từ 1 process sạch không có thread (WORKER_START_METHOD vẫn đổi được).
+    os.environ["EXECUTOR_ROLE"] = "service"
+    import app
+    app.EXEC = pool = app._make_executor(start_method=SERVICE_START_METHOD)
+    _claim_socket(path)
+    listener = Listener(path, family="AF_UNIX", backlog=64, authkey=EXECUTOR_AUTHKEY)
+    os.chmod(path, 0o600)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Executor service: {app.WORKERS} worker, socket {path}", flush=True)
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                continue  # client sai authkey / đóng giữa chừng
+            threading.Thread(target=_handle, args=(conn, pool, app.SCHED, app.pool_status), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        pool.shutdown()
+
+if __name__ == "__main__":
+    if not EXECUTOR_SOCKET:
+        sys.exit("Cần đặt EXECUTOR_SOCKET (đường dẫn Unix socket), vd. /tmp/checker_exec.sock")
+    serve(EXECUTOR_SOCKET)
@@ -9,6 +9,21 @@ import re
 import html
 from bs4 import BeautifulSoup
 from collections import defaultdict
+import bundle_manifest
+import page_store
+import validation_memo
+from result_model import CheckLog, issue, keep_files
+
+# ===== Khai báo checker (checker_registry đọc bằng ast: chỉ dùng literal) =====
+CHECKER = {
+    "label": "Flager",
+    "command": "flager",
+    "keyword": r"\bflager\b",
+    "entry": "run_flager_check",
+    "lane": "heavy",
+    "cost_weight": 1.0,
+    "needs": ("xml_fields", "uris", "inner_html", "dom"),
+}
 
 # ==== Helper chọn thư mục dữ liệu “đúng” (dùng chung) ====
 def _has_data_here(d):
@@ -22,6 +37,9 @@ def _has_data_here(d):
     return False
 
 def resolve_data_dir(base_dir: str) -> str:
+    found = bundle_manifest.data_dir(base_dir)  # bundle đã giải nén có manifest -> khỏi quét đĩa
+    if found:
+        return found
     base_dir = os.path.abspath(base_dir)
     if os.path.isdir(base_dir) and _has_data_here(base_dir):
         return base_dir
@@ -47,28 +65,57 @@ def resolve_data_dir(base_dir: str) -> str:
     return base_dir
 
 # --- Giải mã & đọc dữ liệu (từ bản server trước) ---
-def decode_base64_gzip(data):
+def _gunzip_base64(data):
     try:
         if len(data) % 4: data += '=' * (4 - len(data) % 4)
-        decoded = base64.b64decode(data)
-        return gzip.decompress(decoded).decode('utf-8', errors='replace')
+        return gzip.decompress(base64.b64decode(data))
     except Exception:
         return None
 
-def decode_nested_base64(line):
-    parts = line.strip().split('|')
-    if len(parts) < 3: return None, None
-    uuid, outer_b64 = parts[0], parts[2]
-    xml_str = decode_base64_gzip(outer_b64)
-    if not xml_str: return uuid, None
+def decode_base64_gzip(data):
+    raw = _gunzip_base64(data)
+    return raw.decode('utf-8', errors='replace') if raw is not None else None
+
+# Loại trang, xác định 1 lần lúc giải mã (giai đoạn Collection chỉ cần loại trang, không cần HTML)
+PAGE_CASES_FOUND = "cases_found"  # trang kết quả tìm kiếm ('... cases found')
+PAGE_DETAIL = "detail"            # trang chi tiết vụ án
+PAGE_EMPTY = "empty"              # envelope không có nội dung / HTML rỗng
+PAGE_ERROR = "error"              # không giải mã được
+_CASES_FOUND_RE = re.compile(rb"cases found", re.I)
+_CASES_FOUND_TEXT_RE = re.compile(r"cases found", re.I | re.A)  # cùng luật, trên HTML đã giải mã (page_store)
+
+def _inner_page(xml_str):
+    """(HTML, loại trang) bên trong envelope XML đã giải mã; HTML = None nếu envelope hỏng / không có nội dung."""
+    if xml_str is None: return None, PAGE_ERROR
+    if not xml_str: return None, PAGE_EMPTY
     try:
         root = ET.fromstring(xml_str)
         inner_elem = root.find("Base64EncodedGZipCompressedContent")
-        if inner_elem is not None and inner_elem.text:
-            return uuid, decode_base64_gzip(inner_elem.text.strip())
+        if inner_elem is None or not inner_elem.text:
+            return None, PAGE_EMPTY
     except ET.ParseError:
-        return uuid, None
-    return uuid, None
+        return None, PAGE_ERROR
+    raw = _gunzip_base64(inner_elem.text.strip())
+    if raw is None:
+        return None, PAGE_ERROR
+    if not raw:
+        return "", PAGE_EMPTY
+    # tìm trên bytes (không phân biệt hoa thường, dừng ở chỗ khớp đầu tiên) thay vì lower() cả trang
+    kind = PAGE_CASES_FOUND if _CASES_FOUND_RE.search(raw) else PAGE_DETAIL
+    return raw.decode('utf-8', errors='replace'), kind
+
+def _stored_page(page):
+    """(HTML, loại trang) của trang lấy từ page_store — như _inner_page trên cùng dòng."""
+    html_content = page["html"]
+    if not html_content:
+        return "", PAGE_EMPTY
+    return html_content, PAGE_CASES_FOUND if _CASES_FOUND_TEXT_RE.search(html_content) else PAGE_DETAIL
+
+def decode_nested_base64(line):
+    parts = line.strip().split('|')
+    if len(parts) < 3: return None, None
+    uuid, outer_b64 = parts[0], parts[2]
+    return uuid, _inner_page(decode_base64_gzip(outer_b64))[0]
 
 def load_xml_case_keys(xml_path):
     case_key_map = {}
@@ -103,6 +150,16 @@ def validate_html(html_content, expected_case_key):
         return False, f"Sai caseNumber. XML: '{expected_case_key}', HTML: '{actual_case_number}'"
     return True, "Khớp"
 
+def _html_error_code(message: str) -> str:
+    """Mã lỗi cho thông báo của validate_html."""
+    if message.startswith("Sai caseNumber"):
+        return "CASE_NUMBER_MISMATCH"
+    if message.startswith("Loading"):
+        return "PAGE_NOT_LOADED"
+    if message == "Collection sai":
+        return "COLLECTION_WRONG"
+    return "HTML_EMPTY"
+
 def check_for_cases_found(html_content):
     return bool(html_content and 'cases found' in html_content.lower())
 
@@ -187,10 +244,30 @@ def _csvv2_du(u):
             return ""
     return ""
 
-def _csvv2_create_for_pair(xml_path, txt_path, output_dir, logger=None):
+def _csvv2_uri_list(blocks):
+    """URL từ nội dung thô các khối <Uri>."""
+    return [html.unescape(u.strip()).replace("&amp;", "&") for u in blocks]
+
+def _csvv2_uris(decoded):
+    """Danh sách URL trong các khối <Uri> của envelope ngoài đã giải mã."""
+    return _csvv2_uri_list(re.findall(r"<Uri>(.*?)</Uri>", decoded or "", re.S))
+
+def _csvv2_read_uris(txt_path):
+    """[(ID, [URL...])] theo thứ tự dòng trong TXT (tự giải mã envelope ngoài)."""
+    out = []
+    with open(txt_path, encoding="utf-8") as f:
+        for line in f:
+            p = line.strip().split("|", 2)
+            if len(p) < 3:
+                continue
+            out.append((p[0], _csvv2_uris(_csvv2_d(p[2]))))
+    return out
+
+def _csvv2_create_for_pair(xml_path, txt_path, output_dir, logger=None, uris=None):
     """
     Tạo <XMLBase>_compare_output.csv nếu chưa tồn tại,
     y hệt luồng trong app desktop: PAGE luôn '0', URL giữ nguyên.
+    uris: [(ID, [URL...])] đã lấy sẵn khi giải mã ở giai đoạn 1 (None = tự đọc lại TXT).
     """
     def log(msg): 
         if logger: logger(msg)
@@ -203,41 +280,34 @@ def _csvv2_create_for_pair(xml_path, txt_path, output_dir, logger=None):
 
     rows = []
     try:
-        with open(txt_path, encoding="utf-8") as f:
-            for line in f:
-                p = line.strip().split("|", 2)
-                if len(p) < 3:
-                    continue
-                gid, enc = p[0], p[2]
-                decoded = _csvv2_d(enc)
-                # XML fields
-                last_xml = (z.get(gid, ["",""])[0] or "").strip().upper()
-                date_xml = _csvv2_nd(z.get(gid, ["",""])[1] or "")
-                # URLs
-                urls = [html.unescape(u.strip()).replace("&amp;", "&")
-                        for u in re.findall(r"<Uri>(.*?)</Uri>", decoded, re.S)]
-                last_txt = ""
-                date_txt = ""
-                if urls:
-                    m = re.search(r"lastName=([^&\s]+)", urls[0])
-                    if m: last_txt = m.group(1).strip().upper()
-                    date_txt = _csvv2_du(urls[0])
-                    for u in urls:
-                        rows.append([
-                            os.path.basename(xml_path), gid, last_xml or last_txt, last_txt,
-                            "True" if last_xml == last_txt else "False",
-                            date_xml, date_txt, 
-                            "True" if date_xml == date_txt else "False",
-                            "0", u
-                        ])
-                else:
+        if uris is None:
+            uris = _csvv2_read_uris(txt_path)
+        for gid, urls in uris:
+            # XML fields
+            last_xml = (z.get(gid, ["",""])[0] or "").strip().upper()
+            date_xml = _csvv2_nd(z.get(gid, ["",""])[1] or "")
+            last_txt = ""
+            date_txt = ""
+            if urls:
+                m = re.search(r"lastName=([^&\s]+)", urls[0])
+                if m: last_txt = m.group(1).strip().upper()
+                date_txt = _csvv2_du(urls[0])
+                for u in urls:
                     rows.append([
-                        os.path.basename(xml_path), gid, last_xml, last_txt,
+                        os.path.basename(xml_path), gid, last_xml or last_txt, last_txt,
                         "True" if last_xml == last_txt else "False",
                         date_xml, date_txt, 
                         "True" if date_xml == date_txt else "False",
-                        "0", ""
+                        "0", u
                     ])
+            else:
+                rows.append([
+                    os.path.basename(xml_path), gid, last_xml, last_txt,
+                    "True" if last_xml == last_txt else "False",
+                    date_xml, date_txt, 
+                    "True" if date_xml == date_txt else "False",
+                    "0", ""
+                ])
     except Exception as e:
         log(f"TXT {e}")
         return None
@@ -258,52 +328,98 @@ def _csvv2_create_for_pair(xml_path, txt_path, output_dir, logger=None):
         return None
 # ================== [END ADD] ==================
 
-def _collect_html_and_basic_checks(xml_file, content_file, results_log):
-    """Giai đoạn 1: đọc HTML từ TXT & kiểm tra caseNumber / 'cases found' / collection cơ bản."""
+def warmup():
+    """Gọi 1 lần khi worker khởi động: nạp sẵn lxml và các bước validate."""
+    page = '<html><body><div class="searchFilter">X</div><div class="searchTypeFilter">CaseNumber</div></body></html>'
+    validate_html(page, "X")
+    validate_cases_found_page(page, "X")
+
+# Dòng ghi chú khi job bị hủy giữa chừng (kết quả phía trên vẫn giữ nguyên)
+CANCEL_NOTE = "\n⛔ Đã dừng giữa chừng (hủy hoặc quá hạn): kết quả trên chỉ gồm phần đã kiểm tra."
+
+def _collect_html_and_basic_checks(xml_file, content_file, results_log, should_cancel=None):
+    """
+    Giai đoạn 1: đọc TXT từng dòng, giải mã 1 lần & kiểm tra caseNumber / 'cases found' / collection cơ bản.
+    Cùng lượt giải mã đó lấy luôn URL (<Uri> của envelope ngoài) cho CSV ở giai đoạn 2, và chỉ giữ
+    loại trang (PAGE_*) của từng ID thay vì cả trang HTML.
+    Trả (page_kinds {ID: PAGE_*}, hard_error_uuids, uris [(ID, [URL...])] hoặc None nếu đọc TXT lỗi).
+    """
     xml_filename = os.path.basename(xml_file)
     case_key_map = load_xml_case_keys(xml_file)
-    html_in_memory = {}
+    page_kinds = {}
     hard_error_uuids = set()
     errors_for_this_file = []
+    uris = []
 
     try:
-        with open(content_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        for line in lines:
-            uuid, html_content = decode_nested_base64(line)
-            if not uuid:
-                continue
-            html_in_memory[uuid] = html_content
-            case_key = case_key_map.get(uuid, "")
-
-            if check_for_cases_found(html_content):
-                status, payload = validate_cases_found_page(html_content, case_key)
-                if status == 'ERROR_CASEKEY':
-                    xml_key, html_key = payload
-                    errors_for_this_file.append(f"ID:{uuid}| Sai caseNumer ({xml_key}), ({html_key}).")
-                    hard_error_uuids.add(uuid)
-                elif status == 'ERROR_SEARCHTYPE':
-                    errors_for_this_file.append(f"ID:{uuid}| Chọn sai kiểu Search")
-                    hard_error_uuids.add(uuid)
-                elif status != 'VALID':
-                    errors_for_this_file.append(f"ID:{uuid}| Lỗi không xác định trên trang 'cases found': {payload}")
-                    hard_error_uuids.add(uuid)
-            else:
-                is_valid, message = validate_html(html_content, case_key)
-                if not is_valid:
-                    errors_for_this_file.append(f"ID:{uuid}| {message}")
-                    hard_error_uuids.add(uuid)
+        with open(content_file, 'r', encoding='utf-8') as f, page_store.open_store(os.path.dirname(content_file)) as store:
+            for line in f:
+                if should_cancel and should_cancel():
+                    break
+                _check_line(line, case_key_map, page_kinds, hard_error_uuids, errors_for_this_file, uris, store)
 
-        results_log.extend(errors_for_this_file)
+        for err in errors_for_this_file:
+            results_log.add(err, prefix="")
     except Exception as e:
         results_log.append(f"Lỗi nghiêm trọng khi xử lý {xml_filename}: {e}")
+        uris = None  # giai đoạn 2 tự đọc lại TXT như trước
 
-    return html_in_memory, hard_error_uuids
+    return page_kinds, hard_error_uuids, uris
 
-def _ensure_csv_and_check_collection(xml_file, content_file, html_in_memory, hard_error_uuids, results_log):
+def _check_line(line, case_key_map, page_kinds, hard_error_uuids, errors_for_this_file, uris, store=None):
+    """
+    1 dòng TXT: giải mã envelope ngoài 1 lần -> URL cho CSV + HTML bên trong để kiểm tra.
+    store: page_store của data_dir (trang đã giải mã sạch thì lấy thẳng từ kho).
+    """
+    parts = line.strip().split('|')
+    if len(parts) < 3:
+        return
+    uuid, outer_b64 = parts[0], parts[2]
+    page = store.page(uuid, outer_b64) if store is not None else None
+    xml_str = decode_base64_gzip(outer_b64) if page is None else None
+    csv_b64 = line.strip().split("|", 2)[2]  # CSV lấy phần sau '|' thứ 2 (khác parts[2] chỉ khi dòng có >3 trường)
+    if csv_b64 != outer_b64:
+        uris.append((uuid, _csvv2_uris(_csvv2_d(csv_b64))))
+    else:
+        uris.append((uuid, _csvv2_uri_list(page["uris"]) if page is not None else _csvv2_uris(xml_str)))
+    if not uuid:
+        return
+    html_content, kind = _stored_page(page) if page is not None else _inner_page(xml_str)
+    page_kinds[uuid] = kind
+    case_key = case_key_map.get(uuid, "")
+
+    if kind == PAGE_CASES_FOUND:
+        status, payload = validation_memo.memoized("flager.cases_found", html_content, (case_key,),
+                                                   lambda: validate_cases_found_page(html_content, case_key))
+        if status == 'ERROR_CASEKEY':
+            xml_key, html_key = payload
+            errors_for_this_file.append(issue(uuid, "CASE_NUMBER_MISMATCH", f"ID:{uuid}| Sai caseNumer ({xml_key}), ({html_key}).",
+                                              field="caseNumber", xml=xml_key, html=html_key))
+            hard_error_uuids.add(uuid)
+        elif status == 'ERROR_SEARCHTYPE':
+            errors_for_this_file.append(issue(uuid, "SEARCH_TYPE_MISMATCH", f"ID:{uuid}| Chọn sai kiểu Search",
+                                              field="Search Type", xml="CaseNumber"))
+            hard_error_uuids.add(uuid)
+        elif status != 'VALID':
+            errors_for_this_file.append(issue(uuid, "CASES_FOUND_UNKNOWN",
+                                              f"ID:{uuid}| Lỗi không xác định trên trang 'cases found': {payload}"))
+            hard_error_uuids.add(uuid)
+    else:
+        is_valid, message = validation_memo.memoized("flager.detail", html_content, (case_key,),
+                                                     lambda: validate_html(html_content, case_key))
+        if not is_valid:
+            errors_for_this_file.append(issue(uuid, _html_error_code(message), f"ID:{uuid}| {message}",
+                                              xml=case_key or None))
+            hard_error_uuids.add(uuid)
+
+def _ensure_csv_and_check_collection(xml_file, content_file, page_kinds, hard_error_uuids, results_log,
+                                     should_cancel=None, rebuild_csv=False, uris=None):
     """
     Giai đoạn 2: tìm CSV (hoặc tạo nếu chưa có) rồi kiểm tra Collection theo đúng luật
     như app desktop v3.5.
+    rebuild_csv=True: bỏ qua _compare_output.csv đã tự tạo trước đó (TXT đã đổi) và tạo lại;
+    _Compare.csv do người dùng đưa vẫn được ưu tiên.
+    page_kinds {ID: PAGE_*} và uris (URL cho CSV) lấy từ lượt giải mã ở giai đoạn 1.
     """
     xml_filename = os.path.basename(xml_file)
     directory = os.path.dirname(xml_file)
@@ -311,6 +427,8 @@ def _ensure_csv_and_check_collection(xml_file, content_file, html_in_memory, har
 
     # Tên CSV khả dĩ (giữ tương thích với thói quen đặt tên)
     candidates = [f"{xml_base_name}_Compare.csv", f"{xml_base_name}_compare_output.csv"]
+    if rebuild_csv:
+        candidates = candidates[:1]
     found_csv_path = None
     try:
         dir_files = os.listdir(directory)
@@ -320,7 +438,7 @@ def _ensure_csv_and_check_collection(xml_file, content_file, html_in_memory, har
                 break
         # Nếu không có, TẠO THEO CHUẨN xuat_csv_ChatGpt_v2
         if not found_csv_path:
-            created = _csvv2_create_for_pair(xml_file, content_file, directory)
+            created = _csvv2_create_for_pair(xml_file, content_file, directory, uris=uris)
             if created:
                 found_csv_path = created
                 results_log.append(f"📝 Đã tạo CSV: {os.path.basename(created)}")
@@ -363,46 +481,53 @@ def _ensure_csv_and_check_collection(xml_file, content_file, html_in_memory, har
 
         # Kiểm tra Collection cho từng ID (giống app)
         for uuid, urls in id_to_urls.items():
+            if should_cancel and should_cancel():
+                break
             if uuid in hard_error_uuids:
                 continue
 
             count = len(urls)
             # Nếu bất kỳ URL có chứa 'error' → coi như trang chưa load được
             if any(((u or "").lower().find("error") != -1) for u in urls):
-                results_log.append(f"ID:{uuid}| Collection sai (Trang chưa load được)")
+                results_log.add(issue(uuid, "PAGE_NOT_LOADED", f"ID:{uuid}| Collection sai (Trang chưa load được)"), prefix="")
                 hard_error_uuids.add(uuid)
                 continue
 
-            html_content = html_in_memory.get(uuid)
-            has_cases_found = check_for_cases_found(html_content)
-
-            if has_cases_found:
+            if page_kinds.get(uuid) == PAGE_CASES_FOUND:
                 # Trang 'cases found' → CSV phải có 1 dòng
                 if count != 1:
-                    results_log.append(f"ID:{uuid}| Collection sai (có 'cases found' nhưng count={count} dòng)")
+                    results_log.add(issue(uuid, "COLLECTION_COUNT", f"ID:{uuid}| Collection sai (có 'cases found' nhưng count={count} dòng)",
+                                          field="URL", xml=1, html=count), prefix="")
                     hard_error_uuids.add(uuid)
             else:
                 # Trang chi tiết → CSV phải có 2 dòng, và 2 URL phải khác nhau
                 if count != 2:
-                    results_log.append(f"ID:{uuid}| Collection sai (phải có 2 dòng nhưng count={count} dòng)")
+                    results_log.add(issue(uuid, "COLLECTION_COUNT", f"ID:{uuid}| Collection sai (phải có 2 dòng nhưng count={count} dòng)",
+                                          field="URL", xml=2, html=count), prefix="")
                     hard_error_uuids.add(uuid)
                 elif len(set(urls)) != 2:
-                    results_log.append(f"ID:{uuid}| Collection sai (có 2 dòng nhưng URL giống nhau)")
+                    results_log.add(issue(uuid, "COLLECTION_DUPLICATE_URL", f"ID:{uuid}| Collection sai (có 2 dòng nhưng URL giống nhau)",
+                                          field="URL"), prefix="")
                     hard_error_uuids.add(uuid)
     except Exception as e:
         results_log.append(f"Lỗi khi kiểm tra CSV cho {xml_filename}: {e}")
 
-def run_flager_check(directory_path):
+def run_flager_check(directory_path, should_cancel=None, structured=False, only_files=None, rebuild_csv=False):
     """
     Hàm chính để chạy toàn bộ logic kiểm tra cho tool Flager từ server:
       - Giai đoạn 1: kiểm tra HTML (caseNumber / 'cases found')
       - Giai đoạn 2: đảm bảo có CSV (tự tạo nếu thiếu) rồi kiểm tra Collection theo CSV
+    should_cancel(): trả True thì dừng sau lead hiện tại, giữ kết quả đã có.
+    structured=True: trả dict kết quả có cấu trúc (result_model) thay cho text log.
+    only_files: chỉ kiểm tra các cặp file này (re-check sau khi xoá dòng lỗi, batch_check từng cặp).
+    rebuild_csv=True: CSV _compare_output tự tạo trước đó được tạo lại (re-check: TXT đã đổi);
+      mặc định dùng lại CSV đã có như lần chạy thường.
     """
     data_dir = resolve_data_dir(directory_path)  # <-- CHUẨN HOÁ
-    results_log = []
+    results_log = CheckLog("flager")
     results_log.append("--- Bắt đầu quá trình quét file cho tool Flager ---")
     try:
-        content_files = [f for f in os.listdir(data_dir) if f.lower().endswith("_content.txt")]
+        content_files = keep_files([f for f in bundle_manifest.listdir(data_dir) if f.lower().endswith("_content.txt")], only_files)
         file_pairs = []
         for content_filename in content_files:
             base_name = content_filename[:-12]  # remove '_content.txt'
@@ -413,26 +538,42 @@ def run_flager_check(directory_path):
             else:
                 results_log.append(f"Cảnh báo: Tìm thấy {content_filename} nhưng không có file {xml_filename} tương ứng.")
         if not file_pairs:
-            return "Lỗi: Không tìm thấy cặp file `_content.txt` và `.xml` hợp lệ nào."
+            return results_log.only("Lỗi: Không tìm thấy cặp file `_content.txt` và `.xml` hợp lệ nào.").output(structured)
 
         results_log.append(f"Đã phát hiện {len(file_pairs)} cặp file hợp lệ. Bắt đầu xử lý...")
 
+        cancelled = False
         for (xml_file, content_file) in file_pairs:
+            if should_cancel and should_cancel():
+                cancelled = True
+                break
             xml_filename = os.path.basename(xml_file)
-            results_log.append(f"\n--- Đang xử lý: {xml_filename} ---")
+            results_log.begin_file(xml_filename, f"\n--- Đang xử lý: {xml_filename} ---")
 
             # Giai đoạn 1 — HTML
-            html_in_memory, hard_error_uuids = _collect_html_and_basic_checks(xml_file, content_file, results_log)
+            page_kinds, hard_error_uuids, uris = _collect_html_and_basic_checks(
+                xml_file, content_file, results_log, should_cancel=should_cancel)
+            if should_cancel and should_cancel():
+                cancelled = True
+                break
 
             # Giai đoạn 2 — CSV & Collection
-            _ensure_csv_and_check_collection(xml_file, content_file, html_in_memory, hard_error_uuids, results_log)
+            _ensure_csv_and_check_collection(xml_file, content_file, page_kinds, hard_error_uuids, results_log,
+                                             should_cancel=should_cancel, rebuild_csv=rebuild_csv,
+                                             uris=uris)
+
+        results_log.end_file()
+        if cancelled or (should_cancel and should_cancel()):
+            results_log.cancelled = True
+            results_log.append(CANCEL_NOTE)
+            return results_log.output(structured)
 
         total_errors = len([line for line in results_log if line.strip().startswith('ID:')])
         results_log.append(f"\n--- HOÀN THÀNH ---")
         results_log.append(f"Tổng cộng có {total_errors} lỗi được phát hiện.")
     except FileNotFoundError:
-        return f"Lỗi: Thư mục '{data_dir}' không tồn tại trên server."
+        return results_log.only(f"Lỗi: Thư mục '{data_dir}' không tồn tại trên server.").output(structured)
     except Exception as e:
-        return f"Lỗi không xác định xảy ra trong quá trình xử lý: {str(e)}"
+        return results_log.only(f"Lỗi không xác định xảy ra trong quá trình xử lý: {str(e)}").output(structured)
 
-    return "\n".join(results_log)
+    return results_log.output(structured)
@@ -0,0 +1,104 @@
+# gzip_head.py — giải nén dần HTML lồng bên trong, dừng khi checker đã thấy đủ field cần
+# Checker MD chỉ đọc vài field ở đầu trang (caseId / Case Number, firstName/lastName,
+# filingStart/filingEnd, Filing Date Range) nhưng trước đây gunzip + decode cả trang.
+# inflate_head() đẩy từng đoạn qua zlib.decompressobj, đưa đoạn HTML mới cho bộ kiểm của checker
+# (chỉ quét đoạn mới + phần đuôi giữ lại, không quét lại từ đầu) và bỏ phần còn lại khi đã đủ.
+#
+# Bộ kiểm chỉ trả True khi phần còn lại của trang không đổi được kết quả: checker chọn nhánh theo
+# chữ "data not found" ở bất kỳ đâu trong trang, nên chỉ dừng sớm khi đã thấy chữ đó + đủ field của
+# nhánh đó. Trang không có chữ đó chỉ biết được ở cuối -> giải nén hết, zlib kiểm CRC/độ dài cuối
+# gzip và trả nguyên trang (checker dùng luôn, không giải mã lần 2). Trang dừng sớm không được kiểm
+# CRC (phần đuôi không đọc). MD_EARLY_EXIT=0: tắt, checker giải mã đủ như cũ.
+# Dữ liệu hỏng, thiếu đuôi gzip, gzip nhiều member... -> None, checker giải mã đủ bằng đường cũ
+# (giữ nguyên kết quả + thông báo lỗi).
+#
+# Lệnh gộp (md + md new): shared_heads() cho các checker dùng chung 1 lần giải nén mỗi trang.
+import os
+import zlib
+import codecs
+import base64
+import hashlib
+import contextlib
+
+EARLY_EXIT = os.environ.get("MD_EARLY_EXIT", "1") == "1"
+CHUNK = 32 * 1024   # số byte HTML giải nén thêm mỗi lần trước khi hỏi lại checker
+SHARED_HEAD_BYTES = int(os.environ.get("SHARED_HEAD_MB", "256")) * 1024 * 1024  # trần bộ nhớ của shared_heads
+
+_shared = None  # {"checks": [...], "ascii_only": bool, "heads": {digest: head|None}, "bytes": int}
+
+@contextlib.contextmanager
+def shared_heads(checkers):
+    """
+    checkers = [(new_check, ascii_only)] của các checker trong cùng 1 job. Trong khối with, inflate_head()
+    của các checker này giải nén tới khi đủ field cho TẤT CẢ, nhớ kết quả theo base64 của trang
+    (kể cả None) -> checker sau lấy lại, không giải nén nữa. Quá SHARED_HEAD_BYTES thì thôi nhớ thêm.
+    """
+    global _shared
+    prev = _shared
+    _shared = {"checks": [c for c, _ in checkers], "ascii_only": any(a for _, a in checkers),
+               "heads": {}, "bytes": 0}
+    try:
+        yield
+    finally:
+        _shared = prev
+
+def _all_checks(new_checks):
+    def new_check():
+        checks = [new() for new in new_checks]
+        return lambda piece: all([check(piece) for check in checks])  # mọi bộ kiểm đều phải thấy từng đoạn
+    return new_check
+
+def inflate_head(b64_text: str, new_check, ascii_only: bool = False, chunk: int = CHUNK):
+    """
+    HTML của base64(gzip(HTML)): phần đầu nếu bộ kiểm dừng sớm, cả trang nếu tới cuối gzip; None thì
+    checker tự giải mã (xem đầu file). new_check() tạo bộ kiểm mới cho mỗi trang: check(piece) nhận
+    lần lượt từng đoạn HTML, True = đủ.
+    b64_text thêm '=' cho đủ bội 4 như decode_base64_gzip; HTML decode UTF-8 errors='replace'.
+    ascii_only: gặp byte ngoài ASCII thì trả None (md new đoán bảng mã theo cả trang: UTF-8 rồi latin-1).
+    """
+    if not EARLY_EXIT:
+        return None
+    shared = _shared
+    if shared is None or new_check not in shared["checks"]:
+        return _inflate(b64_text, new_check, ascii_only, chunk)
+    key = hashlib.blake2b(b64_text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    if key in shared["heads"]:
+        return shared["heads"][key]
+    head = _inflate(b64_text, _all_checks(shared["checks"]), shared["ascii_only"], chunk)
+    size = len(head) if head else 0
+    if shared["bytes"] + size <= SHARED_HEAD_BYTES:
+        shared["heads"][key] = head
+        shared["bytes"] += size + 64
+    return head
+
+def _inflate(b64_text: str, new_check, ascii_only: bool, chunk: int):
+    try:
+        if len(b64_text) % 4:
+            b64_text += "=" * (4 - len(b64_text) % 4)
+        data = base64.b64decode(b64_text)
+    except Exception:
+        return None
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)   # gzip header; tới cuối thì tự kiểm CRC + độ dài
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    check = new_check()
+    parts = []
+    try:
+        while not inflater.eof:
+            out = inflater.decompress(data, chunk)
+            data = inflater.unconsumed_tail
+            if not out:
+                if inflater.eof:
+                    break
+                return None   # hết dữ liệu mà chưa tới cuối gzip
+            if ascii_only and not out.isascii():
+                return None
+            piece = decoder.decode(out)
+            parts.append(piece)
+            if check(piece):
+                return "".join(parts)
+    except zlib.error:
+        return None
+    if inflater.unused_data:
+        return None   # gzip nhiều member / rác sau member: để gzip.decompress xử lý như cũ
+    parts.append(decoder.decode(b"", True))
+    return "".join(parts)
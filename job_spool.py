@@ -0,0 +1,283 @@
+# job_spool.py — hàng đợi job trên thư mục dùng chung (NFS/EFS..., test: thư mục tạm trên 1 máy)
+# app.py (SPOOL_DIR) chỉ ghi job vào spool và đọc kết quả; spool_worker.py trên 1 hay nhiều máy
+# nhận job, chạy như app.py vẫn chạy rồi ghi kết quả lại. Thêm máy = thêm spool_worker.
+#   pending/<ưu tiên>_<ns>_<job_id>.json   job chờ (tên sắp xếp được: interactive trước, FIFO)
+#   leases/<job_id>.json                   job đã có worker nhận; ctime = nhịp tim gần nhất
+#   state/<job_id>.json                    trạng thái worker báo (preparing/queued/running, lane, cost)
+#   done/<job_id>.json                     kết quả cuối (như JOBS[job_id] của app.py)
+#   cancel/<job_id>                        cờ hủy, worker thấy thì dừng job
+#   workers/<worker_id>.json               nhịp tim của từng spool_worker
+# Nhận job = os.rename pending -> leases (atomic, chỉ 1 worker thắng) rồi ghi vào lease 1 token riêng
+# của lần nhận đó. Worker chạm lease mỗi SPOOL_HEARTBEAT_S giây; lease không được chạm quá SPOOL_LEASE_S
+# giây (worker/máy chết, treo) thì worker khác trả job về pending; job đã bị nhận SPOOL_MAX_ATTEMPTS lần
+# thì kết thúc lỗi (job làm chết worker). Gia hạn / ghi kết quả đều so token: worker treo tỉnh lại sau khi
+# job đã bị lấy lại không gia hạn hộ, không ghi đè kết quả, không xoá lease của worker đang giữ job.
+import os
+import json
+import time
+import uuid
+import socket
+from datetime import datetime
+
+SPOOL_LEASE_S = float(os.environ.get("SPOOL_LEASE_S", "60"))
+SPOOL_HEARTBEAT_S = float(os.environ.get("SPOOL_HEARTBEAT_S", "10"))
+SPOOL_MAX_ATTEMPTS = int(os.environ.get("SPOOL_MAX_ATTEMPTS", "3"))
+
+_DIRS = ("pending", "leases", "state", "done", "cancel", "workers")
+_PRIORITY_RANK = {"interactive": 0, "bulk": 1}
+
+def _write_json(path: str, data: dict):
+    """Ghi atomic (file tạm cùng thư mục + os.replace): bên đọc không bao giờ thấy file dở."""
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+def _read_json(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _age(path: str):
+    """Số giây từ lần đổi gần nhất (rename/utime đều cập nhật ctime); None nếu file không còn."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return time.time() - max(st.st_mtime, st.st_ctime)
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class Spool:
+    def __init__(self, root: str):
+        self.root = root
+        for d in _DIRS:
+            os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    def _path(self, kind: str, name: str) -> str:
+        return os.path.join(self.root, kind, name)
+
+    def _pending_names(self) -> list:
+        try:
+            return sorted(n for n in os.listdir(self._path("pending", "")) if n.endswith(".json") and n[0] != ".")
+        except OSError:
+            return []
+
+    def _pending_name(self, job_id: str):
+        return next((n for n in self._pending_names() if n.endswith(f"_{job_id}.json")), None)
+
+    # ===== Phía API (app.py) =====
+    def submit(self, job_id: str, command: str, client: str = None, priority: str = "interactive",
+               recheck: dict = None):
+        name = f"{_PRIORITY_RANK.get(priority, 1)}_{time.time_ns():020d}_{job_id}.json"
+        _write_json(self._path("pending", name), {
+            "job_id": job_id, "command": command, "client": client, "priority": priority,
+            "recheck": recheck, "submitted": time.time(), "spool_name": name, "attempts": 0,
+        })
+
+    def job(self, job_id: str):
+        """Trạng thái job như JOBS[job_id] (thêm position/queued khi còn chờ); None nếu không có."""
+        done = _read_json(self._path("done", f"{job_id}.json"))
+        if done is not None:
+            return done
+        lease = _read_json(self._path("leases", f"{job_id}.json"))
+        if lease is not None:
+            state = _read_json(self._path("state", f"{job_id}.json")) or {"status": "preparing"}
+            return {**state, "worker": lease.get("worker")}
+        names = self._pending_names()
+        for i, n in enumerate(names):
+            if n.endswith(f"_{job_id}.json"):
+                return {"status": "queued", "position": i + 1, "queued": len(names)}
+        return _read_json(self._path("done", f"{job_id}.json"))  # vừa xong giữa 2 lần đọc
+
+    def cancel(self, job_id: str):
+        """Đặt cờ hủy; job còn chờ thì lấy khỏi hàng đợi và kết thúc luôn. Trả trạng thái trước khi hủy."""
+        job = self.job(job_id)
+        if job is None or job.get("status") not in ("preparing", "queued", "running"):
+            return job
+        with open(self._path("cancel", job_id), "w") as f:
+            f.write(str(time.time()))
+        name = self._pending_name(job_id)
+        if name is not None:
+            mine = self._path("leases", f".{job_id}.cancelling")
+            try:
+                os.rename(self._path("pending", name), mine)
+            except OSError:
+                return job  # worker vừa nhận: nó sẽ thấy cờ hủy
+            self._complete(job_id, mine, {"status": "cancelled", "error": "Đã hủy (theo yêu cầu)",
+                                          "updated": datetime.utcnow()})
+        return job
+
+    def save_result(self, job_id: str, result: dict):
+        """Ghi lại result của job đã xong (vd. modified_files sau khi xoá dòng lỗi)."""
+        done = _read_json(self._path("done", f"{job_id}.json"))
+        if done is not None:
+            _write_json(self._path("done", f"{job_id}.json"), {**done, "result": result})
+
+    def metrics(self) -> dict:
+        def _count(kind):
+            try:
+                return sum(1 for n in os.listdir(self._path(kind, "")) if n[0] != ".")
+            except OSError:
+                return 0
+        workers = []
+        try:
+            names = os.listdir(self._path("workers", ""))
+        except OSError:
+            names = []
+        for n in names:
+            age = _age(self._path("workers", n))
+            info = _read_json(self._path("workers", n))
+            if info is not None and age is not None and age <= SPOOL_LEASE_S:
+                workers.append(info)
+        return {"dir": self.root, "pending": len(self._pending_names()), "running": _count("leases"),
+                "done": _count("done"), "workers": workers}
+
+    def gc(self, hours: int = 6):
+        """Xoá kết quả/cờ/nhịp tim cũ hơn `hours` giờ (như _gc_jobs của app.py) + lease dở khi ghi kết quả."""
+        cutoff = hours * 3600
+        for kind in ("done", "state", "cancel", "workers", "leases"):
+            try:
+                names = os.listdir(self._path(kind, ""))
+            except OSError:
+                continue
+            for n in names:
+                if kind == "leases" and n[0] != ".":
+                    continue  # lease thật: reclaim_expired lo
+                p = self._path(kind, n)
+                age = _age(p)
+                if age is not None and age > cutoff:
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+
+    # ===== Phía worker (spool_worker.py) =====
+    def claim(self, worker_id: str):
+        """Nhận job chờ lâu nhất (ưu tiên interactive); None nếu hết job."""
+        for name in self._pending_names():
+            job_id = name.rsplit("_", 1)[-1][:-len(".json")]
+            lease = self._path("leases", f"{job_id}.json")
+            try:
+                os.rename(self._path("pending", name), lease)
+            except OSError:
+                continue  # worker khác nhận trước
+            job = _read_json(lease)
+            if job is None:
+                try:
+                    os.remove(lease)
+                except OSError:
+                    pass
+                continue
+            job["attempts"] = job.get("attempts", 0) + 1
+            job["worker"] = worker_id
+            job["lease"] = uuid.uuid4().hex
+            _write_json(lease, job)
+            if job["attempts"] > SPOOL_MAX_ATTEMPTS:
+                self.finish(job_id, job["lease"], {
+                    "status": "error", "updated": datetime.utcnow(),
+                    "error": f"Job làm dừng worker {SPOOL_MAX_ATTEMPTS} lần, không chạy lại nữa"})
+                continue
+            return job
+        return None
+
+    def heartbeat(self, job_id: str, token: str) -> bool:
+        """Gia hạn lease nếu vẫn là lease có `token` (của claim); False nếu đã bị lấy lại -> worker bỏ job."""
+        try:
+            fd = os.open(self._path("leases", f"{job_id}.json"), os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            # đọc và chạm qua cùng 1 fd: lease bị thay (claim mới ghi file mới) thì không chạm nhầm
+            with os.fdopen(os.dup(fd), "r", encoding="utf-8") as f:
+                owner = json.load(f).get("lease")
+            if owner != token:
+                return False
+            os.utime(fd)
+            return True
+        except (OSError, ValueError):
+            return False
+        finally:
+            os.close(fd)
+
+    def cancelled(self, job_id: str) -> bool:
+        return os.path.exists(self._path("cancel", job_id))
+
+    def set_state(self, job_id: str, token: str, state: dict):
+        """Báo trạng thái (chỉ khi lease vẫn của mình: worker cũ không ghi đè trạng thái của worker mới)."""
+        owner = _read_json(self._path("leases", f"{job_id}.json"))
+        if owner is not None and owner.get("lease") == token:
+            _write_json(self._path("state", f"{job_id}.json"), state)
+
+    def finish(self, job_id: str, token: str, job: dict) -> bool:
+        """
+        Ghi kết quả nếu lease còn là của mình (cùng `token`); False nếu lease đã bị lấy lại (kết quả bỏ đi).
+        Lease được đổi tên sang tên riêng trước (atomic) rồi mới so token -> không ai gia hạn/lấy lại
+        được giữa lúc so và lúc ghi; lease hoá ra của worker khác thì trả lại chỗ cũ.
+        """
+        lease = self._path("leases", f"{job_id}.json")
+        owner = _read_json(lease)
+        if owner is None or owner.get("lease") != token:
+            return False
+        mine = self._path("leases", f".{job_id}.finishing.{token}")
+        try:
+            os.rename(lease, mine)
+        except OSError:
+            return False
+        owner = _read_json(mine)
+        if owner is None or owner.get("lease") != token:
+            try:
+                os.rename(mine, lease)
+            except OSError:
+                pass
+            return False
+        self._complete(job_id, mine, job)
+        return True
+
+    def _complete(self, job_id: str, owned: str, job: dict):
+        """Ghi done/ rồi xoá file đang giữ (`owned`) + state/cờ hủy của job."""
+        _write_json(self._path("done", f"{job_id}.json"), job)
+        for p in (owned, self._path("state", f"{job_id}.json"), self._path("cancel", job_id)):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def reclaim_expired(self) -> int:
+        """Trả các job có lease hết hạn về pending (giữ thứ tự cũ). Trả số job đã lấy lại."""
+        n = 0
+        try:
+            names = [x for x in os.listdir(self._path("leases", "")) if x.endswith(".json") and x[0] != "."]
+        except OSError:
+            return 0
+        for name in names:
+            lease = self._path("leases", name)
+            age = _age(lease)
+            if age is None or age <= SPOOL_LEASE_S:
+                continue
+            job = _read_json(lease)
+            if job is None or not job.get("spool_name"):
+                continue
+            try:
+                os.rename(lease, self._path("pending", job["spool_name"]))
+            except OSError:
+                continue  # worker khác lấy lại trước
+            try:
+                os.remove(self._path("state", name))
+            except OSError:
+                pass
+            n += 1
+        return n
+
+    def worker_heartbeat(self, worker_id: str, info: dict):
+        _write_json(self._path("workers", f"{worker_id.replace('/', '_')}.json"),
+                    {"worker": worker_id, **info, "updated": time.time()})
+
+    def worker_gone(self, worker_id: str):
+        try:
+            os.remove(self._path("workers", f"{worker_id.replace('/', '_')}.json"))
+        except OSError:
+            pass
@@ -3,6 +3,24 @@ import re
 import base64
 import gzip
 import xml.etree.ElementTree as ET
+import bundle_manifest
+import gzip_head
+import page_store
+import validation_memo
+from result_model import CheckLog, issue, keep_files
+
+# ===== Khai báo checker (checker_registry đọc bằng ast: chỉ dùng literal) =====
+CHECKER = {
+    "label": "MD",
+    "command": "md",
+    "keyword": r"\bmd\b",
+    "entry": "run_md_cu_check",
+    "lane": "light",
+    "cost_weight": 0.3,
+    "needs": ("xml_fields", "inner_head"),
+    "head": "html_head_check",
+    "head_ascii_only": False,
+}
 
 # ==== Helper chọn thư mục dữ liệu “đúng” (dùng chung) ====
 def _has_data_here(d):
@@ -16,6 +34,9 @@ def _has_data_here(d):
     return False
 
 def resolve_data_dir(base_dir: str) -> str:
+    found = bundle_manifest.data_dir(base_dir)  # bundle đã giải nén có manifest -> khỏi quét đĩa
+    if found:
+        return found
     base_dir = os.path.abspath(base_dir)
     if os.path.isdir(base_dir) and _has_data_here(base_dir):
         return base_dir
@@ -51,17 +72,27 @@ def decode_base64_gzip(encoded_string):
     except Exception as e:
         raise ValueError(f"Lỗi giải mã/giải nén: {e}")
 
-def decode_nested_txt_line(line_content):
+def decode_nested_txt_line(line_content, store=None):
+    """store: page_store của data_dir (trang đã giải mã sạch thì lấy thẳng từ kho)."""
     uuid, html_content, error_msg = None, None, None
     parts = line_content.split('|')
     if len(parts) >= 3:
         uuid = parts[0]
+        page = None
+        if store is not None:
+            # dừng sớm: chỉ đọc kho, không ghi (trang dở không dùng được cho tool khác)
+            page = store.lookup(uuid, parts[2]) if gzip_head.EARLY_EXIT else store.page(uuid, parts[2])
+        if page is not None:
+            return uuid, page["html"], None
         try:
             outer_xml = decode_base64_gzip(parts[2])
             root = ET.fromstring(outer_xml)
             inner_elem = root.find('Base64EncodedGZipCompressedContent')
             if inner_elem is not None and inner_elem.text:
-                html_content = decode_base64_gzip(inner_elem.text.strip())
+                inner = inner_elem.text.strip()
+                html_content = gzip_head.inflate_head(inner, html_head_check, ascii_only=CHECKER["head_ascii_only"])
+                if html_content is None:
+                    html_content = decode_base64_gzip(inner)
             else:
                 error_msg = "Không tìm thấy nội dung lồng nhau (Base64EncodedGZipCompressedContent)."
         except Exception as e:
@@ -70,6 +101,37 @@ def decode_nested_txt_line(line_content):
         error_msg = "Định dạng dòng TXT không hợp lệ (thiếu dấu '|')."
     return uuid, html_content, error_msg
 
+# Regex biên dịch sẵn lúc import (worker nạp module từ đầu -> không tốn ở job đầu tiên)
+CASE_ID_INPUT_RE = re.compile(r"<input[^>]*name=\"caseId\"[^>]*value=\"([^\"]*)\"[^>]*>", re.I)
+CASE_NUMBER_RE = re.compile(r"Case Number:\s*</span>\s*</td>\s*<td>\s*<span[^>]*class=\"Value\"[^>]*>([A-Za-z0-9.-]+?)</span>", re.I | re.DOTALL)
+
+def html_case_value(html_content):
+    """CaseKey trên trang (caseId của trang 'data not found', không thì Case Number); None nếu không thấy."""
+    if "data not found" in html_content.lower():
+        match = CASE_ID_INPUT_RE.search(html_content)
+    else:
+        match = CASE_NUMBER_RE.search(html_content)
+    return match.group(1).strip().upper() if match else None
+
+HEAD_TAIL = 4096  # ký tự đuôi giữ lại giữa 2 đoạn: thẻ input / ô Case Number bị cắt ngang vẫn khớp
+
+def html_head_check():
+    """
+    Bộ kiểm cho gzip_head (nhận lần lượt từng đoạn HTML): True khi phần đã đọc chắc chắn cho cùng
+    html_case_value với cả trang, tức đã thấy 'data not found' và ô caseId. Trang không có chữ đó chỉ
+    biết được ở cuối trang -> không dừng sớm (gzip_head trả nguyên trang).
+    """
+    tail, not_found, case_id = "", False, False
+
+    def check(piece):
+        nonlocal tail, not_found, case_id
+        window = tail + piece
+        not_found = not_found or "data not found" in window.lower()
+        case_id = case_id or CASE_ID_INPUT_RE.search(window) is not None
+        tail = window[-HEAD_TAIL:]
+        return not_found and case_id
+    return check
+
 def parse_xml_for_case_keys(xml_file_path):
     case_key_map = {}
     try:
@@ -84,72 +146,95 @@ def parse_xml_for_case_keys(xml_file_path):
         print(f"Lỗi khi đọc file XML '{xml_file_path}': {e}")
     return case_key_map
 
-def run_md_cu_check(directory_path):
+# Dòng ghi chú khi job bị hủy giữa chừng (kết quả phía trên vẫn giữ nguyên)
+CANCEL_NOTE = "\n⛔ Đã dừng giữa chừng (hủy hoặc quá hạn): kết quả trên chỉ gồm phần đã kiểm tra."
+
+def run_md_cu_check(directory_path, should_cancel=None, structured=False, only_files=None):
     """
     Main function to run the 'MD Cũ' check logic for all files in a directory.
+    should_cancel(): trả True thì dừng sau lead hiện tại, giữ kết quả đã có.
+    structured=True: trả dict kết quả có cấu trúc (result_model) thay cho text log.
+    only_files: chỉ kiểm tra các cặp file này (tên TXT/XML), dùng khi re-check sau khi xoá dòng lỗi.
     """
     data_dir = resolve_data_dir(directory_path)  # <-- CHUẨN HOÁ
-    log_output = []
-    xml_files = [f for f in os.listdir(data_dir) if f.lower().endswith(".xml")]
+    log_output = CheckLog("md")
+    xml_files = keep_files([f for f in bundle_manifest.listdir(data_dir) if f.lower().endswith(".xml")], only_files)
     if not xml_files:
-        return "Không tìm thấy tệp .xml nào trong thư mục được cung cấp."
+        return log_output.only("Không tìm thấy tệp .xml nào trong thư mục được cung cấp.").output(structured)
 
+    cancelled = False
     for xml_file in xml_files:
+        if should_cancel and should_cancel():
+            cancelled = True
+            break
         base_name = os.path.splitext(xml_file)[0]
         txt_path = os.path.join(data_dir, f"{base_name}_content.txt")
         xml_path = os.path.join(data_dir, xml_file)
 
-        log_output.append(f"\n--- Đang xử lý (MD Cũ): {base_name} ---")
+        log_output.begin_file(base_name, f"\n--- Đang xử lý (MD Cũ): {base_name} ---")
 
         if not os.path.exists(txt_path):
-            log_output.append(f"  ❌ Lỗi: Thiếu tệp TXT '{os.path.basename(txt_path)}'.")
+            log_output.add(issue(None, "TXT_MISSING", f"Lỗi: Thiếu tệp TXT '{os.path.basename(txt_path)}'."))
             continue
 
         xml_case_keys = parse_xml_for_case_keys(xml_path)
         if not xml_case_keys:
-            log_output.append(f"  ❌ Lỗi: Không thể đọc CaseKey từ file XML hoặc file XML rỗng.")
+            log_output.add(issue(None, "XML_UNREADABLE", f"Lỗi: Không thể đọc CaseKey từ file XML hoặc file XML rỗng."))
             continue
 
         txt_data = {}
         try:
-            with open(txt_path, 'r', encoding='utf-8') as f:
+            with open(txt_path, 'r', encoding='utf-8') as f, page_store.open_store(data_dir) as store:
                 for line in f:
                     if line.startswith("HEADER ROW") or not line.strip():
                         continue
-                    uuid, html, error = decode_nested_txt_line(line)
+                    uuid, html, error = decode_nested_txt_line(line, store)
                     if uuid:
                         txt_data[uuid] = (html, error)
         except Exception as e:
-            log_output.append(f"  ❌ Lỗi nghiêm trọng khi đọc file TXT: {e}")
+            log_output.add(issue(None, "TXT_UNREADABLE", f"Lỗi nghiêm trọng khi đọc file TXT: {e}"))
             continue
         
         file_errors = []
         for xml_id, case_key in xml_case_keys.items():
-            html_content, error = txt_data.get(xml_id, (None, "Không tìm thấy ID trong file TXT"))
+            if should_cancel and should_cancel():
+                cancelled = True
+                break
+            html_content, error = txt_data.get(xml_id, (None, None))
+            if xml_id not in txt_data:
+                error = "Không tìm thấy ID trong file TXT"
+                file_errors.append(issue(xml_id, "ID_NOT_IN_TXT", f"ID: {xml_id} | CaseKey_XML: {case_key} | Lỗi: {error}",
+                                         xml=case_key))
+                continue
             if error:
-                file_errors.append(f"ID: {xml_id} | CaseKey_XML: {case_key} | Lỗi: {error}")
+                file_errors.append(issue(xml_id, "DECODE_ERROR", f"ID: {xml_id} | CaseKey_XML: {case_key} | Lỗi: {error}",
+                                         xml=case_key))
                 continue
             if not html_content:
-                file_errors.append(f"ID: {xml_id} | CaseKey_XML: {case_key} | Lỗi: Nội dung HTML rỗng sau khi giải mã.")
+                file_errors.append(issue(xml_id, "HTML_EMPTY",
+                                         f"ID: {xml_id} | CaseKey_XML: {case_key} | Lỗi: Nội dung HTML rỗng sau khi giải mã.",
+                                         xml=case_key))
                 continue
 
-            if "data not found" in html_content.lower():
-                match = re.search(r"<input[^>]*name=\"caseId\"[^>]*value=\"([^\"]*)\"[^>]*>", html_content, re.I)
-                html_val_raw = match.group(1).strip().upper() if match else None
-                html_val_normalized = html_val_raw.replace('-', '') if html_val_raw else None
-                if not match or case_key.upper() != html_val_normalized:
-                    file_errors.append(f"ID: {xml_id} | CaseKey_XML: {case_key} | CaseName_HTML: {html_val_raw or 'Không tìm thấy'}")
-            else:
-                match = re.search(r"Case Number:\s*</span>\s*</td>\s*<td>\s*<span[^>]*class=\"Value\"[^>]*>([A-Za-z0-9.-]+?)</span>", html_content, re.I | re.DOTALL)
-                html_val_raw = match.group(1).strip().upper() if match else None
-                html_val_normalized = html_val_raw.replace('-', '') if html_val_raw else None
-                if not match or case_key.upper() != html_val_normalized:
-                    file_errors.append(f"ID: {xml_id} | CaseKey_XML: {case_key} | CaseName_HTML: {html_val_raw or 'Không tìm thấy'}")
+            # trang lặp lại (vd. 'DATA NOT FOUND') chỉ quét regex 1 lần
+            html_val_raw = validation_memo.memoized("md.case_value", html_content, (),
+                                                    lambda: html_case_value(html_content))
+            html_val_normalized = html_val_raw.replace('-', '') if html_val_raw else None
+            if html_val_raw is None or case_key.upper() != html_val_normalized:
+                file_errors.append(issue(xml_id, "CASE_KEY_MISMATCH",
+                                         f"ID: {xml_id} | CaseKey_XML: {case_key} | CaseName_HTML: {html_val_raw or 'Không tìm thấy'}",
+                                         field="CaseKey", xml=case_key, html=html_val_raw))
 
         if not file_errors:
             log_output.append("  ✅ Không phát hiện lỗi.")
         else:
             for err in file_errors:
-                log_output.append(f"  ❌ {err}")
+                log_output.add(err)
+        if cancelled:
+            break
 
-    return "\n".join(log_output)
+    log_output.end_file()
+    if cancelled:
+        log_output.cancelled = True
+        log_output.append(CANCEL_NOTE)
+    return log_output.output(structured)
@@ -4,6 +4,24 @@ import base64
 import gzip
 import xml.etree.ElementTree as ET
 from datetime import datetime
+import bundle_manifest
+import gzip_head
+import page_store
+import validation_memo
+from result_model import CheckLog, issue, keep_files
+
+# ===== Khai báo checker (checker_registry đọc bằng ast: chỉ dùng literal) =====
+CHECKER = {
+    "label": "MD New",
+    "command": "md new",
+    "keyword": r"\bmd\s+new\b",
+    "entry": "run_md_moi_check",
+    "lane": "light",
+    "cost_weight": 0.3,
+    "needs": ("xml_fields", "inner_head"),
+    "head": "html_head_check",
+    "head_ascii_only": True,
+}
 
 # ==== Helper chọn thư mục dữ liệu “đúng” (dùng chung) ====
 def _has_data_here(d):
@@ -17,6 +35,9 @@ def _has_data_here(d):
     return False
 
 def resolve_data_dir(base_dir: str) -> str:
+    found = bundle_manifest.data_dir(base_dir)  # bundle đã giải nén có manifest -> khỏi quét đĩa
+    if found:
+        return found
     base_dir = os.path.abspath(base_dir)
     if os.path.isdir(base_dir) and _has_data_here(base_dir):
         return base_dir
@@ -61,17 +82,26 @@ def b64_gzip_decode_best_effort(s: str) -> str:
     except Exception:
         return ""
 
-def decode_nested_txt_line(line_content):
+def decode_nested_txt_line(line_content, store=None):
+    """store: page_store của data_dir (trang đã giải mã sạch thì lấy thẳng từ kho)."""
     uuid, html, error = None, None, None
     parts = line_content.split('|')
     if len(parts) >= 3:
         uuid = parts[0]
+        page = None
+        if store is not None:
+            # dừng sớm: chỉ đọc kho, không ghi (trang dở không dùng được cho tool khác)
+            page = store.lookup(uuid, parts[2]) if gzip_head.EARLY_EXIT else store.page(uuid, parts[2])
+        if page is not None:
+            return uuid, page["html"], None
         try:
             outer = b64_gzip_decode_best_effort(parts[2])
             root = ET.fromstring(outer)
             inner = root.find('Base64EncodedGZipCompressedContent')
             if inner is not None and inner.text:
-                html = b64_gzip_decode_best_effort(inner.text.strip())
+                html = gzip_head.inflate_head(''.join(inner.text.split()), html_head_check, ascii_only=CHECKER["head_ascii_only"])
+                if html is None:
+                    html = b64_gzip_decode_best_effort(inner.text.strip())
             else:
                 error = "Không tìm thấy nội dung lồng nhau."
         except Exception as e:
@@ -105,20 +135,102 @@ def infer_case_type_from_filename(filename: str) -> str:
             return tok
     return ""
 
+# ===== Regex biên dịch sẵn lúc import =====
+CASE_KEY_RE = re.compile(r"([\d\/\-]{10})-([\d\/\-]{10}) (.*?)%,(.*?)%")
+INPUT_FIRST_NAME_RE = re.compile(r'<input[^>]*name="firstName"[^>]*value="([^"]*)"[^>]*>', re.I)
+INPUT_LAST_NAME_RE = re.compile(r'<input[^>]*name="lastName"[^>]*value="([^"]*)"[^>]*>', re.I)
+INPUT_FILING_START_RE = re.compile(r'<input[^>]*name="filingStart"[^>]*value="([^"]*)"[^>]*>', re.I)
+INPUT_FILING_END_RE = re.compile(r'<input[^>]*name="filingEnd"[^>]*value="([^"]*)"[^>]*>', re.I)
+LABEL_FIRST_NAME_RE = re.compile(r"First Name:\s*<span[^>]*>([\w\s%]+?)</span>", re.I)
+LABEL_LAST_NAME_RE = re.compile(r"Last Name:\s*<span[^>]*>([\w\s%]+?)</span>", re.I)
+LABEL_FILING_RANGE_RE = re.compile(r"Filing Date Range:\s*<span[^>]*>([\w\s\/\- to]+?)</span>", re.I)
+
+def lead_field_errors(html_content, range_from_xml, range_to_xml, last_name_xml, first_name_xml):
+    """Các field sai của 1 lead (First/Last Name, khoảng Filing Date) so với HTML."""
+    lead_errors = []
+    if "DATA NOT FOUND" in html_content:
+        fn_html = INPUT_FIRST_NAME_RE.search(html_content)
+        ln_html = INPUT_LAST_NAME_RE.search(html_content)
+        start_html = INPUT_FILING_START_RE.search(html_content)
+        end_html = INPUT_FILING_END_RE.search(html_content)
+        if not fn_html or fn_html.group(1).strip() != first_name_xml:
+            lead_errors.append("First Name")
+        if not ln_html or ln_html.group(1).strip() != last_name_xml:
+            lead_errors.append("Last Name")
+        try:
+            if not start_html or datetime.strptime(start_html.group(1).strip(), '%m/%d/%Y') != datetime.strptime(range_from_xml, '%m/%d/%Y'):
+                lead_errors.append("Range From")
+            if not end_html or datetime.strptime(end_html.group(1).strip(), '%m/%d/%Y') != datetime.strptime(range_to_xml, '%m/%d/%Y'):
+                lead_errors.append("Range To")
+        except ValueError:
+            lead_errors.append("Filing Date Range (invalid format)")
+    else:
+        fn_html = LABEL_FIRST_NAME_RE.search(html_content)
+        ln_html = LABEL_LAST_NAME_RE.search(html_content)
+        range_html = LABEL_FILING_RANGE_RE.search(html_content)
+        if not fn_html or fn_html.group(1).strip() != first_name_xml:
+            lead_errors.append("First Name")
+        if not ln_html or ln_html.group(1).strip() != last_name_xml:
+            lead_errors.append("Last Name")
+        if not range_html:
+            lead_errors.append("Filing Date Range")
+        else:
+            try:
+                start_str_html, end_str_html = [d.strip() for d in range_html.group(1).strip().split("to")]
+                if datetime.strptime(start_str_html, '%m/%d/%Y') != datetime.strptime(range_from_xml, '%m/%d/%Y') or \
+                   datetime.strptime(end_str_html, '%m/%d/%Y') != datetime.strptime(range_to_xml, '%m/%d/%Y'):
+                    lead_errors.append("Filing Date Range")
+            except (ValueError, IndexError):
+                lead_errors.append("Filing Date Range (invalid format)")
+    return tuple(lead_errors)
+
+_INPUT_FIELD_RES = (INPUT_FIRST_NAME_RE, INPUT_LAST_NAME_RE, INPUT_FILING_START_RE, INPUT_FILING_END_RE)
+
+HEAD_TAIL = 4096  # ký tự đuôi giữ lại giữa 2 đoạn: thẻ input bị cắt ngang vẫn khớp
+
+def html_head_check():
+    """
+    Bộ kiểm cho gzip_head (nhận lần lượt từng đoạn HTML): True khi phần đã đọc chắc chắn cho cùng
+    lead_field_errors với cả trang, tức đã thấy 'DATA NOT FOUND' và đủ 4 ô input. Trang không có chữ
+    đó chỉ biết được ở cuối trang -> không dừng sớm (gzip_head trả nguyên trang).
+    """
+    tail, not_found, missing = "", False, list(_INPUT_FIELD_RES)
+
+    def check(piece):
+        nonlocal tail, not_found
+        window = tail + piece
+        not_found = not_found or "DATA NOT FOUND" in window
+        missing[:] = [r for r in missing if not r.search(window)]
+        tail = window[-HEAD_TAIL:]
+        return not_found and not missing
+    return check
+
+# Dòng ghi chú khi job bị hủy giữa chừng (kết quả phía trên vẫn giữ nguyên)
+CANCEL_NOTE = "\n⛔ Đã dừng giữa chừng (hủy hoặc quá hạn): kết quả trên chỉ gồm phần đã kiểm tra."
+
 # ===== Main checker =====
-def run_md_moi_check(directory_path):
+def run_md_moi_check(directory_path, should_cancel=None, structured=False, only_files=None):
+    """
+    should_cancel(): trả True thì dừng sau lead hiện tại, giữ kết quả đã có.
+    structured=True: trả dict kết quả có cấu trúc (result_model) thay cho text log.
+    only_files: chỉ kiểm tra các cặp file này (tên TXT/XML), dùng khi re-check sau khi xoá dòng lỗi.
+    """
     data_dir = resolve_data_dir(directory_path)  # <-- CHUẨN HOÁ
-    log = []
-    xml_files = [f for f in os.listdir(data_dir) if f.lower().endswith(".xml")]
+    log = CheckLog("md_new")
+    xml_files = keep_files([f for f in bundle_manifest.listdir(data_dir) if f.lower().endswith(".xml")], only_files)
     if not xml_files:
-        return "Không tìm thấy tệp .xml nào trong thư mục."
+        return log.only("Không tìm thấy tệp .xml nào trong thư mục.").output(structured)
+    cancelled = False
     for xml_file in xml_files:
+        if should_cancel and should_cancel():
+            cancelled = True
+            break
         base_name = os.path.splitext(xml_file)[0]
         txt_path = os.path.join(data_dir, f"{base_name}_content.txt")
         xml_path = os.path.join(data_dir, xml_file)
-        log.append(f"\n--- Đang xử lý (MD Mới): {base_name} ---")
+        log.begin_file(base_name, f"\n--- Đang xử lý (MD Mới): {base_name} ---")
         if not os.path.exists(txt_path):
-            log.append(f"  ❌ Lỗi: Thiếu tệp TXT '{os.path.basename(txt_path)}'.")
+            log.add(issue(None, "TXT_MISSING", f"Lỗi: Thiếu tệp TXT '{os.path.basename(txt_path)}'."))
             continue
         case_type_from_name = infer_case_type_from_filename(xml_file)
         if not case_type_from_name:
@@ -134,75 +246,58 @@ def run_md_moi_check(directory_path):
                 if lead_id and case_key:
                     case_keys_from_xml[lead_id] = case_key
         except Exception as e:
-            log.append(f"  ❌ Lỗi đọc XML: {e}")
+            log.add(issue(None, "XML_UNREADABLE", f"Lỗi đọc XML: {e}"))
             continue
         uuid_to_html = {}
         try:
-            with open(txt_path, 'r', encoding='utf-8') as f:
+            with open(txt_path, 'r', encoding='utf-8') as f, page_store.open_store(data_dir) as store:
                 for line in f:
                     if line.startswith("HEADER ROW") or not line.strip():
                         continue
-                    uuid, html, error = decode_nested_txt_line(line)
+                    uuid, html, error = decode_nested_txt_line(line, store)
                     if uuid:
                         uuid_to_html[uuid] = (html, error)
         except Exception as e:
-            log.append(f"  ❌ Lỗi đọc file TXT: {e}")
+            log.add(issue(None, "TXT_UNREADABLE", f"Lỗi đọc file TXT: {e}"))
             continue
         file_errors = []
         for lead_id, case_key_raw in case_keys_from_xml.items():
-            html_content, decode_error = uuid_to_html.get(lead_id, (None, "Không tìm thấy ID trong TXT"))
+            if should_cancel and should_cancel():
+                cancelled = True
+                break
+            if lead_id not in uuid_to_html:
+                file_errors.append(issue(lead_id, "ID_NOT_IN_TXT", f"ID: {lead_id} | Lỗi: Không tìm thấy ID trong TXT",
+                                         xml=case_key_raw))
+                continue
+            html_content, decode_error = uuid_to_html[lead_id]
             if decode_error:
-                file_errors.append(f"ID: {lead_id} | Lỗi: {decode_error}")
+                file_errors.append(issue(lead_id, "DECODE_ERROR", f"ID: {lead_id} | Lỗi: {decode_error}", xml=case_key_raw))
                 continue
             if not html_content:
-                file_errors.append(f"ID: {lead_id} | Lỗi: Nội dung HTML rỗng")
+                file_errors.append(issue(lead_id, "HTML_EMPTY", f"ID: {lead_id} | Lỗi: Nội dung HTML rỗng", xml=case_key_raw))
                 continue
-            case_key_match = re.search(r"([\d\/\-]{10})-([\d\/\-]{10}) (.*?)%,(.*?)%", case_key_raw)
+            case_key_match = CASE_KEY_RE.search(case_key_raw)
             if not case_key_match:
                 continue
             range_from_xml, range_to_xml, last_name_xml, first_name_xml = [s.strip() for s in case_key_match.groups()]
             last_name_xml += "%"
             first_name_xml += "%"
-            lead_errors = []
-            if "DATA NOT FOUND" in html_content:
-                fn_html = re.search(r'<input[^>]*name="firstName"[^>]*value="([^"]*)"[^>]*>', html_content, re.I)
-                ln_html = re.search(r'<input[^>]*name="lastName"[^>]*value="([^"]*)"[^>]*>', html_content, re.I)
-                start_html = re.search(r'<input[^>]*name="filingStart"[^>]*value="([^"]*)"[^>]*>', html_content, re.I)
-                end_html = re.search(r'<input[^>]*name="filingEnd"[^>]*value="([^"]*)"[^>]*>', html_content, re.I)
-                if not fn_html or fn_html.group(1).strip() != first_name_xml:
-                    lead_errors.append("First Name")
-                if not ln_html or ln_html.group(1).strip() != last_name_xml:
-                    lead_errors.append("Last Name")
-                try:
-                    if not start_html or datetime.strptime(start_html.group(1).strip(), '%m/%d/%Y') != datetime.strptime(range_from_xml, '%m/%d/%Y'):
-                        lead_errors.append("Range From")
-                    if not end_html or datetime.strptime(end_html.group(1).strip(), '%m/%d/%Y') != datetime.strptime(range_to_xml, '%m/%d/%Y'):
-                        lead_errors.append("Range To")
-                except ValueError:
-                    lead_errors.append("Filing Date Range (invalid format)")
-            else:
-                fn_html = re.search(r"First Name:\s*<span[^>]*>([\w\s%]+?)</span>", html_content, re.I)
-                ln_html = re.search(r"Last Name:\s*<span[^>]*>([\w\s%]+?)</span>", html_content, re.I)
-                range_html = re.search(r"Filing Date Range:\s*<span[^>]*>([\w\s\/\- to]+?)</span>", html_content, re.I)
-                if not fn_html or fn_html.group(1).strip() != first_name_xml:
-                    lead_errors.append("First Name")
-                if not ln_html or ln_html.group(1).strip() != last_name_xml:
-                    lead_errors.append("Last Name")
-                if not range_html:
-                    lead_errors.append("Filing Date Range")
-                else:
-                    try:
-                        start_str_html, end_str_html = [d.strip() for d in range_html.group(1).strip().split("to")]
-                        if datetime.strptime(start_str_html, '%m/%d/%Y') != datetime.strptime(range_from_xml, '%m/%d/%Y') or \
-                           datetime.strptime(end_str_html, '%m/%d/%Y') != datetime.strptime(range_to_xml, '%m/%d/%Y'):
-                            lead_errors.append("Filing Date Range")
-                    except (ValueError, IndexError):
-                        lead_errors.append("Filing Date Range (invalid format)")
+            # trang giống hệt nhau với cùng CaseKey chỉ so khớp regex 1 lần
+            lead_errors = validation_memo.memoized(
+                "md_new.fields", html_content, (range_from_xml, range_to_xml, last_name_xml, first_name_xml),
+                lambda: lead_field_errors(html_content, range_from_xml, range_to_xml, last_name_xml, first_name_xml))
             if lead_errors:
-                file_errors.append(f"ID: {lead_id} | Lỗi sai do: {', '.join(lead_errors)}")
+                file_errors.append(issue(lead_id, "FIELD_MISMATCH", f"ID: {lead_id} | Lỗi sai do: {', '.join(lead_errors)}",
+                                         field=", ".join(lead_errors), xml=case_key_raw))
         if not file_errors:
             log.append("  ✅ Không có lỗi.")
         else:
             for err in file_errors:
-                log.append(f"  ❌ {err}")
-    return "\n".join(log)
+                log.add(err)
+        if cancelled:
+            break
+    log.end_file()
+    if cancelled:
+        log.cancelled = True
+        log.append(CANCEL_NOTE)
+    return log.output(structured)
@@ -8,6 +8,12 @@ import base64
 from datetime import datetime
 from collections import defaultdict
 import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+import html.entities as html_entities
+import bundle_manifest
+import page_store
+import validation_memo
+from result_model import CheckLog, issue, keep_files
 
 try:
     from bs4 import BeautifulSoup
@@ -15,6 +21,22 @@ except ImportError:
     def BeautifulSoup(markup, features):
         return None
 
+try:
+    import pandas as pd  # có pandas: kiểm tra bảng compare theo cột / group-by
+except ImportError:
+    pd = None
+
+# ===== Khai báo checker (checker_registry đọc bằng ast: chỉ dùng literal) =====
+CHECKER = {
+    "label": "MI",
+    "command": "mi",
+    "keyword": r"\bmi\b",
+    "entry": "run_mi_check",
+    "lane": "heavy",
+    "cost_weight": 0.6,
+    "needs": ("xml_fields", "uris", "inner_html", "compare_table"),
+}
+
 # ==== Helper chọn thư mục dữ liệu “đúng” (dùng chung) ====
 def _has_data_here(d):
     try:
@@ -27,6 +49,9 @@ def _has_data_here(d):
     return False
 
 def resolve_data_dir(base_dir: str) -> str:
+    found = bundle_manifest.data_dir(base_dir)  # bundle đã giải nén có manifest -> khỏi quét đĩa
+    if found:
+        return found
     base_dir = os.path.abspath(base_dir)
     if os.path.isdir(base_dir) and _has_data_here(base_dir):
         return base_dir
@@ -140,9 +165,12 @@ def check_case_status_and_category(csv_file_path, xml_filename):
                 case_type_subcategory_matches = re.findall(r"caseTypeSubCategory=([^&]+)", url)
                 if (required_case_status != set(case_status_matches) or 
                     required_case_type_subcategory != set(case_type_subcategory_matches)):
-                    errors.append(f"ID: {id_value} | Tích thiếu hoặc sai caseStatus và caseTypeSubCategory")
+                    errors.append(issue(id_value, "CASE_STATUS_FILTER",
+                                        f"ID: {id_value} | Tích thiếu hoặc sai caseStatus và caseTypeSubCategory",
+                                        field="caseStatus/caseTypeSubCategory",
+                                        html=", ".join(case_status_matches + case_type_subcategory_matches)))
     except Exception as e:
-        errors.append(f"ID: N/A | Lỗi khi kiểm tra caseStatus: {str(e)}")
+        errors.append(issue(None, "CSV_UNREADABLE", f"ID: N/A | Lỗi khi kiểm tra caseStatus: {str(e)}"))
     return errors
 
 def check_name_in_csv(csv_file_path, xml_filename):
@@ -152,9 +180,11 @@ def check_name_in_csv(csv_file_path, xml_filename):
             reader = csv.DictReader(file, delimiter=";")
             for row in reader:
                 if row.get("CHECK_NAME", "").strip().lower() == 'false':
-                    errors.append(f"ID: {row.get('ID', '')} | Sai name (XML: '{row.get('LAST_NAME_XML', '')}' vs TXT: '{row.get('LAST_NAME_TXT', '')}')")
+                    errors.append(issue(row.get('ID', ''), "NAME_MISMATCH",
+                                        f"ID: {row.get('ID', '')} | Sai name (XML: '{row.get('LAST_NAME_XML', '')}' vs TXT: '{row.get('LAST_NAME_TXT', '')}')",
+                                        field="Last Name", xml=row.get('LAST_NAME_XML', ''), html=row.get('LAST_NAME_TXT', '')))
     except Exception as e:
-        errors.append(f"ID: N/A | Lỗi khi kiểm tra name: {str(e)}")
+        errors.append(issue(None, "CSV_UNREADABLE", f"ID: N/A | Lỗi khi kiểm tra name: {str(e)}"))
     return errors
 
 def check_date_in_csv(csv_file_path, xml_filename):
@@ -164,9 +194,11 @@ def check_date_in_csv(csv_file_path, xml_filename):
             reader = csv.DictReader(file, delimiter=";")
             for row in reader:
                 if row.get("CHECK_DATE", "").strip().lower() == 'false':
-                    errors.append(f"ID: {row.get('ID', '')} | Sai DATE (XML: '{row.get('DATE_XML', '')}' vs TXT: '{row.get('DATE_TXT', '')}')")
+                    errors.append(issue(row.get('ID', ''), "DATE_MISMATCH",
+                                        f"ID: {row.get('ID', '')} | Sai DATE (XML: '{row.get('DATE_XML', '')}' vs TXT: '{row.get('DATE_TXT', '')}')",
+                                        field="Date", xml=row.get('DATE_XML', ''), html=row.get('DATE_TXT', '')))
     except Exception as e:
-        errors.append(f"ID: N/A | Lỗi khi kiểm tra DATE: {str(e)}")
+        errors.append(issue(None, "CSV_UNREADABLE", f"ID: N/A | Lỗi khi kiểm tra DATE: {str(e)}"))
     return errors
 
 def check_duplicate_id_page(csv_file_path, xml_filename):
@@ -181,18 +213,18 @@ def check_duplicate_id_page(csv_file_path, xml_filename):
                 key = (guid, page)
                 if key in id_page_map:
                     if guid not in seen_ids:
-                        errors.append(f"ID: {guid} | Trùng ID+PAGE")
+                        errors.append(issue(guid, "DUPLICATE_PAGE", f"ID: {guid} | Trùng ID+PAGE", field="PAGE", html=page))
                         seen_ids.add(guid)
                 else:
                     id_page_map.add(key)
     except Exception as e:
-        errors.append(f"ID: N/A | Lỗi khi kiểm tra trùng ID+PAGE: {str(e)}")
+        errors.append(issue(None, "CSV_UNREADABLE", f"ID: N/A | Lỗi khi kiểm tra trùng ID+PAGE: {str(e)}"))
     return errors
 
 def check_missing_collection(csv_file_path, content_txt_path, xml_filename):
     errors = []
     if not os.path.exists(content_txt_path):
-        return [f"ID: N/A | Không tìm thấy file _content.txt để kiểm tra collection."]
+        return [issue(None, "TXT_MISSING", f"ID: N/A | Không tìm thấy file _content.txt để kiểm tra collection.")]
     id_to_html = {}
     try:
         with open(content_txt_path, 'r', encoding='utf-8') as f:
@@ -201,7 +233,7 @@ def check_missing_collection(csv_file_path, content_txt_path, xml_filename):
                 if guid and html_content:
                     id_to_html[guid] = html_content
     except Exception as e:
-        return [f"ID: N/A | Lỗi khi đọc file content.txt: {e}"]
+        return [issue(None, "TXT_UNREADABLE", f"ID: N/A | Lỗi khi đọc file content.txt: {e}")]
     id_pages_from_csv = defaultdict(set)
     try:
         with open(csv_file_path, mode="r", encoding="utf-8-sig") as file:
@@ -212,7 +244,7 @@ def check_missing_collection(csv_file_path, content_txt_path, xml_filename):
                     try: id_pages_from_csv[guid].add(int(page_match.group(1)))
                     except (ValueError, TypeError): pass
     except Exception as e:
-        return [f"ID: N/A | Lỗi đọc file CSV: {str(e)}"]
+        return [issue(None, "CSV_UNREADABLE", f"ID: N/A | Lỗi đọc file CSV: {str(e)}")]
     for guid, found_pages_set in id_pages_from_csv.items():
         html_content = id_to_html.get(guid)
         if not html_content or BeautifulSoup is None: continue
@@ -229,38 +261,208 @@ def check_missing_collection(csv_file_path, content_txt_path, xml_filename):
         if expected_pages > 0:
             expected_page_set = set(range(1, int(expected_pages) + 1))
             if found_pages_set != expected_page_set:
-                errors.append(f"ID: {guid} | Collection thiếu (Page chuẩn = {int(expected_pages)}, Page hiện có = {len(found_pages_set)})")
+                errors.append(issue(guid, "COLLECTION_MISSING_PAGES",
+                                    f"ID: {guid} | Collection thiếu (Page chuẩn = {int(expected_pages)}, Page hiện có = {len(found_pages_set)})",
+                                    field="PAGE", xml=int(expected_pages), html=len(found_pages_set)))
     return errors
 
+# --- Bảng compare dạng DataFrame (khi có pandas) ---
+COMPARE_COLUMNS = ["FILE_XML", "ID", "LAST_NAME_XML", "LAST_NAME_TXT", "CHECK_NAME", "DATE_XML", "DATE_TXT", "CHECK_DATE", "PAGE", "URL"]
+REQUIRED_CASE_STATUS = {"adjudicated", "disposed", "closed"}
+REQUIRED_CASE_TYPE_SUBCATEGORY = {"1"}
+_TOTAL_RECORD_RE = re.compile(r"Total Record Count:\s*\d+")
+_INNER_CONTENT_RE = re.compile(r'<Base64EncodedGZipCompressedContent>(.*?)</Base64EncodedGZipCompressedContent>', re.DOTALL)
+
+class _TotalRecordScan(HTMLParser):
+    """
+    Duyệt từng node chuỗi như bs4 (text, comment, doctype, CDATA, PI), dừng ở node đầu tiên khớp.
+    Như bs4: tự giải &...; trong text (convert_charrefs=False) nên phần thẻ/comment dở ở cuối giữ nguyên.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.found = None
+        self._text = []
+
+    def _node(self, data):
+        if self.found is None and _TOTAL_RECORD_RE.search(data):
+            self.found = data
+
+    def _flush(self):
+        if self._text:
+            self._node("".join(self._text))
+            self._text = []
+
+    def handle_data(self, data):
+        self._text.append(data)  # text liền nhau (vd. bị tách ở dấu '<' lẻ) là 1 node như bs4
+
+    def handle_charref(self, name):
+        self._text.append(html.unescape(f"&#{name};"))
+
+    def handle_entityref(self, name):
+        self._text.append(html_entities.html5.get(f"{name};", f"&{name}"))
+
+    def handle_starttag(self, tag, attrs): self._flush()
+    def handle_endtag(self, tag): self._flush()
+    def handle_comment(self, data): self._flush(); self._node(data)
+    def handle_decl(self, decl): self._flush(); self._node(decl)
+    def handle_pi(self, data): self._flush(); self._node(data)
+    def unknown_decl(self, data): self._flush(); self._node(data)
+
+def expected_pages_from_html(html_content):
+    """
+    Số page chuẩn = ceil(Total Record Count / 10), 0 nếu không có. Lấy node chuỗi đầu tiên khớp regex
+    (như soup.find(string=...) cũ: cả text, comment...; chữ trong thuộc tính thẻ không tính) bằng
+    html.parser duyệt tuần tự, không dựng cây HTML.
+    """
+    if not html_content:
+        return 0
+    if "Total Record Count" not in html_content and (
+            "&" not in html_content or "Total Record Count" not in html.unescape(html_content)):
+        return 0
+    scan = _TotalRecordScan()
+    pos, step = 0, 64 * 1024
+    while scan.found is None and pos < len(html_content):
+        scan.feed(html_content[pos:pos + step])
+        pos += step
+    if scan.found is None:
+        scan.close()
+        scan._flush()
+    if scan.found is None:
+        return 0
+    total = int(re.search(r'(\d+)', scan.found.strip()).group(1))
+    return math.ceil(total / 10) if total > 0 else 0
+
+def _inner_html_from_outer(outer_xml):
+    match = _INNER_CONTENT_RE.search(outer_xml or "")
+    if not match:
+        return None
+    inner_b64 = match.group(1).strip()
+    try:
+        if len(inner_b64) % 4: inner_b64 += '=' * (4 - len(inner_b64) % 4)
+        return gzip.decompress(base64.b64decode(inner_b64)).decode('utf-8', errors='replace')
+    except Exception:
+        return None
+
+def _case_status_ok(urls):
+    """Series bool: bộ caseStatus / caseTypeSubCategory trong URL đúng bằng bộ bắt buộc (group-by theo dòng)."""
+    def _exact(matches, required):
+        values = matches.explode().dropna()
+        inside = values.isin(required)
+        bad = (~inside).groupby(level=0).any().reindex(matches.index, fill_value=False)
+        distinct = values[inside].groupby(level=0).nunique().reindex(matches.index, fill_value=0)
+        return ~bad & (distinct == len(required))
+    return (_exact(urls.str.findall(r"caseStatus=([^&]+)"), REQUIRED_CASE_STATUS)
+            & _exact(urls.str.findall(r"caseTypeSubCategory=([^&]+)"), REQUIRED_CASE_TYPE_SUBCATEGORY))
+
+def check_compare_table(rows, expected_pages):
+    """
+    5 bước kiểm tra của MI (name, DATE, trùng ID+PAGE, caseStatus, Collection thiếu) chạy trên bảng
+    compare trong RAM (DataFrame) thay vì đọc lại CSV 5 lần; thứ tự lỗi giống hệt các hàm check_* theo CSV.
+    expected_pages: {ID: số page chuẩn} lấy từ 'Total Record Count' lúc giải mã.
+    """
+    df = pd.DataFrame(rows, columns=COMPARE_COLUMNS, dtype=object)
+    errors = []
+    for r in df[df["CHECK_NAME"].str.strip().str.lower() == "false"].itertuples(index=False):
+        errors.append(issue(r.ID, "NAME_MISMATCH",
+                            f"ID: {r.ID} | Sai name (XML: '{r.LAST_NAME_XML}' vs TXT: '{r.LAST_NAME_TXT}')",
+                            field="Last Name", xml=r.LAST_NAME_XML, html=r.LAST_NAME_TXT))
+    for r in df[df["CHECK_DATE"].str.strip().str.lower() == "false"].itertuples(index=False):
+        errors.append(issue(r.ID, "DATE_MISMATCH",
+                            f"ID: {r.ID} | Sai DATE (XML: '{r.DATE_XML}' vs TXT: '{r.DATE_TXT}')",
+                            field="Date", xml=r.DATE_XML, html=r.DATE_TXT))
+    # trùng ID+PAGE: báo 1 lần / ID, tại dòng trùng đầu tiên
+    dup = df[df.duplicated(["ID", "PAGE"], keep="first")].drop_duplicates("ID", keep="first")
+    for r in dup.itertuples(index=False):
+        errors.append(issue(r.ID, "DUPLICATE_PAGE", f"ID: {r.ID} | Trùng ID+PAGE", field="PAGE", html=r.PAGE))
+    # caseStatus / caseTypeSubCategory (chỉ URL có lastName=)
+    has_name = df[df["URL"].str.contains("lastName=", regex=False)]
+    if len(has_name):
+        for idx in has_name.index[~_case_status_ok(has_name["URL"])]:
+            url, id_value = df.at[idx, "URL"], df.at[idx, "ID"]
+            errors.append(issue(id_value, "CASE_STATUS_FILTER",
+                                f"ID: {id_value} | Tích thiếu hoặc sai caseStatus và caseTypeSubCategory",
+                                field="caseStatus/caseTypeSubCategory",
+                                html=", ".join(re.findall(r"caseStatus=([^&]+)", url) + re.findall(r"caseTypeSubCategory=([^&]+)", url))))
+    # Collection thiếu: tập page của mỗi ID phải đúng bằng 1..page chuẩn
+    pages = pd.DataFrame({"ID": df["ID"].str.strip(), "PAGE": df["URL"].str.extract(r"[?&]page=(\d+)", expand=False)})
+    pages = pages[(pages["ID"] != "") & (df["URL"] != "") & pages["PAGE"].notna()]
+    if len(pages):
+        pages["PAGE"] = pages["PAGE"].map(int)
+        found = pages.groupby("ID", sort=False)["PAGE"].agg(["nunique", "min", "max"])
+        found["expected"] = found.index.map(lambda g: expected_pages.get(g, 0))
+        found = found[found["expected"] > 0]
+        missing = found[(found["nunique"] != found["expected"]) | (found["min"] != 1) | (found["max"] != found["expected"])]
+        for guid, r in missing.iterrows():
+            errors.append(issue(guid, "COLLECTION_MISSING_PAGES",
+                                f"ID: {guid} | Collection thiếu (Page chuẩn = {int(r['expected'])}, Page hiện có = {int(r['nunique'])})",
+                                field="PAGE", xml=int(r["expected"]), html=int(r["nunique"])))
+    return errors
+
+def warmup():
+    """Gọi 1 lần khi worker khởi động: nạp sẵn html.parser và regex dùng khi kiểm tra."""
+    extract_date_from_url("?filedDateFrom=2020-01-01&filedDateTo=2020-12-31")
+    if pd is not None:
+        check_compare_table([["x.xml", "x", "A", "A", "True", "", "", "True", "1", "?lastName=A&page=1"]], {"x": 1})
+    if BeautifulSoup is not None:
+        soup = BeautifulSoup("<span>Total Record Count: 1</span>", 'html.parser')
+        soup.find(string=re.compile(r"Total Record Count:\s*\d+"))
+
+# Dòng ghi chú khi job bị hủy giữa chừng (kết quả phía trên vẫn giữ nguyên)
+CANCEL_NOTE = "\n⛔ Đã dừng giữa chừng (hủy hoặc quá hạn): kết quả trên chỉ gồm phần đã kiểm tra."
+
 # --- Main Logic Function ---
-def run_mi_check(directory_path):
+def run_mi_check(directory_path, should_cancel=None, structured=False, only_files=None):
+    """
+    should_cancel(): trả True thì dừng sau lead hiện tại (không ghi CSV dở dang), giữ kết quả đã có.
+    structured=True: trả dict kết quả có cấu trúc (result_model) thay cho text log.
+    only_files: chỉ kiểm tra (và tạo lại _compare_output.csv) cho các cặp file này, dùng khi re-check.
+    """
     data_dir = resolve_data_dir(directory_path)  # <-- CHUẨN HOÁ
-    results_log = []
-    xml_files = [f for f in os.listdir(data_dir) if f.endswith(".xml")]
+    results_log = CheckLog("mi")
+    xml_files = keep_files([f for f in bundle_manifest.listdir(data_dir) if f.endswith(".xml")], only_files)
     if not xml_files:
-        return "Không tìm thấy tệp .xml trong thư mục."
+        return results_log.only("Không tìm thấy tệp .xml trong thư mục.").output(structured)
+    cancelled = False
     for xml_file in xml_files:
+        if should_cancel and should_cancel():
+            cancelled = True
+            break
         base_name = os.path.splitext(xml_file)[0]
         txt_path = os.path.join(data_dir, f"{base_name}_content.txt")
         xml_path = os.path.join(data_dir, xml_file)
-        results_log.append(f"\n--- Đang xử lý: {base_name} ---")
+        results_log.begin_file(base_name, f"\n--- Đang xử lý: {base_name} ---")
         if not os.path.exists(txt_path):
-            results_log.append(f"  ❌ Lỗi: Không tìm thấy tệp {os.path.basename(txt_path)}.")
+            results_log.add(issue(None, "TXT_MISSING", f"Lỗi: Không tìm thấy tệp {os.path.basename(txt_path)}."))
             continue
         # 1. Create Compare CSV
         all_rows = []
+        expected_pages = {}  # ID -> số page chuẩn (chỉ dùng khi có pandas)
         try:
             xml_data = parse_xml(xml_path)
-            with open(txt_path, "r", encoding="utf-8") as f:
+            with open(txt_path, "r", encoding="utf-8") as f, page_store.open_store(data_dir) as store:
                 for line in f:
+                    if should_cancel and should_cancel():
+                        cancelled = True
+                        break
                     parts = line.strip().split("|", 2)
                     if len(parts) < 3: continue
                     guid, _, encoded = parts
-                    decoded = decode_txt(encoded)
-                    if not decoded: continue
+                    page = store.page(guid, encoded)  # trang đã giải mã sạch (từ kho hoặc vừa giải mã)
+                    decoded = None if page else decode_txt(encoded)
+                    if pd is not None and guid:
+                        if page:
+                            inner_html = page["html"]
+                        else:
+                            outer_b64 = line.strip().split("|")[2]
+                            outer = decoded if outer_b64 == encoded else decode_txt(outer_b64)
+                            inner_html = _inner_html_from_outer(outer)
+                        if inner_html:  # như bản cũ: dòng sau (có HTML) của cùng ID ghi đè dòng trước
+                            expected_pages[guid] = validation_memo.memoized(
+                                "mi.expected_pages", inner_html, (), lambda: expected_pages_from_html(inner_html))
+                    if not (page or decoded): continue
                     last_xml = (xml_data.get(guid, {}).get("LAST_NAME_XML", "")).strip().upper()
                     date_xml = normalize_date_range(xml_data.get(guid, {}).get("DATE_XML", ""))
-                    uri_blocks = re.findall(r"<Uri>(.*?)</Uri>", decoded, re.DOTALL)
+                    uri_blocks = page["uris"] if page else re.findall(r"<Uri>(.*?)</Uri>", decoded, re.DOTALL)
                     urls = [html.unescape(uri.strip()).replace("&amp;", "&") for uri in uri_blocks]
                     last_txt = ""
                     date_txt = ""
@@ -274,6 +476,8 @@ def run_mi_check(directory_path):
                         check_name = "True" if last_xml == last_txt else "False"
                         check_date = "True" if date_xml == date_txt else "False"
                         all_rows.append([xml_file, guid, last_xml or last_txt, last_txt, check_name, date_xml, date_txt, check_date, str(page), url])
+            if cancelled:
+                break
             output_file = os.path.join(data_dir, f"{base_name}_compare_output.csv")
             with open(output_file, "w", encoding="utf-8-sig", newline="") as f:
                 writer = csv.writer(f, delimiter=";", lineterminator="\r\n", quoting=csv.QUOTE_ALL)
@@ -281,9 +485,17 @@ def run_mi_check(directory_path):
                 writer.writerows(all_rows)
             results_log.append(f"  ✅ Đã tạo file {os.path.basename(output_file)}")
         except Exception as e:
-            results_log.append(f"  ❌ Lỗi khi tạo CSV: {e}")
+            results_log.add(issue(None, "CSV_WRITE_FAILED", f"Lỗi khi tạo CSV: {e}"))
+            continue
+        # 2. Run checks (có pandas: trên bảng trong RAM; không có: đọc lại CSV như cũ)
+        if pd is not None:
+            file_errors = check_compare_table(all_rows, expected_pages)
+            if not file_errors:
+                results_log.append("  ✅ Không phát hiện lỗi.")
+            else:
+                for error in file_errors:
+                    results_log.add(error)
             continue
-        # 2. Run checks on the created CSV
         file_errors = []
         file_errors.extend(check_name_in_csv(output_file, xml_file))
         file_errors.extend(check_date_in_csv(output_file, xml_file))
@@ -294,5 +506,9 @@ def run_mi_check(directory_path):
             results_log.append("  ✅ Không phát hiện lỗi.")
         else:
             for error in file_errors:
-                results_log.append(f"  ❌ {error}")
-    return "\n".join(results_log)
+                results_log.add(error)
+    results_log.end_file()
+    if cancelled:
+        results_log.cancelled = True
+        results_log.append(CANCEL_NOTE)
+    return results_log.output(structured)
@@ -0,0 +1,165 @@
+# page_store.py — kho trang đã giải mã của 1 data_dir (SQLite, tra theo UUID)
+# Dòng TXT = uuid|meta|base64(gzip(envelope XML có <Uri> + <Base64EncodedGZipCompressedContent>)).
+# Tool đầu tiên chạy trên bundle giải mã dòng và ghi lại (khối <Uri> thô, HTML bên trong);
+# tool sau (civitek rồi civitek new, md rồi md new, chạy lại...) đọc thẳng từ kho, khỏi giải mã.
+# Kho nằm trong data_dir (.page_store.sqlite) -> bị xoá cùng data_dir.
+#
+# Mỗi checker có cách giải mã riêng (thêm '=', errors='replace', latin-1, regex hay ET...).
+# Kho chỉ lưu trang khi giải mã "sạch" — base64 đúng chuẩn, gzip + UTF-8 hợp lệ, đúng 1 lớp lồng,
+# regex và ET lấy ra cùng 1 nội dung — vì khi đó mọi cách giải mã đều cho cùng kết quả.
+# Dòng không sạch được đánh dấu và checker tự giải mã như cũ (giữ nguyên thông báo lỗi riêng).
+import os
+import re
+import json
+import zlib
+import gzip
+import base64
+import sqlite3
+import xml.etree.ElementTree as ET
+
+STORE_NAME = ".page_store.sqlite"
+PAGE_STORE = os.environ.get("PAGE_STORE", "1") != "0"   # PAGE_STORE=0: tắt kho, checker tự giải mã mọi dòng
+FLUSH_ROWS = 500
+
+_INNER_TAG = "Base64EncodedGZipCompressedContent"
+_INNER_OPEN, _INNER_CLOSE = f"<{_INNER_TAG}>", f"</{_INNER_TAG}>"
+_URI_RE = re.compile(r"<Uri>(.*?)</Uri>", re.DOTALL)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    uuid  TEXT    NOT NULL,   -- trường đầu của dòng (strip + lower)
+    size  INTEGER NOT NULL,   -- độ dài payload base64 (đã strip)
+    crc   INTEGER NOT NULL,   -- crc32 payload: dòng cùng UUID nhưng nội dung khác là trang khác
+    clean INTEGER NOT NULL,   -- 0: không giải mã sạch -> checker tự giải mã
+    uris  TEXT,               -- JSON: nội dung thô các khối <Uri> của envelope ngoài
+    html  TEXT                -- HTML bên trong
+);
+CREATE UNIQUE INDEX IF NOT EXISTS pages_uuid ON pages (uuid, size, crc);
+"""
+
+def _gunzip_b64(raw: bytes) -> str:
+    return gzip.decompress(base64.b64decode(raw, validate=True)).decode("utf-8")
+
+def _first_inner(text: str):
+    """Như re.search(r'<Tag>(.*?)</Tag>', DOTALL).group(1) (civitek/mi) nhưng bằng find: nhanh hơn trên base64 dài."""
+    start = text.find(_INNER_OPEN)
+    if start < 0:
+        return None
+    start += len(_INNER_OPEN)
+    end = text.find(_INNER_CLOSE, start)
+    return text[start:end] if end >= 0 else None
+
+def decode_page(raw: bytes):
+    """{"uris", "html"} nếu payload giải mã sạch (xem đầu file), None nếu không."""
+    try:
+        outer = _gunzip_b64(raw)
+        elem = ET.fromstring(outer).find(_INNER_TAG)
+    except Exception:
+        return None
+    if elem is None or not elem.text or _first_inner(outer) != elem.text:
+        return None
+    inner = elem.text.strip()
+    if not inner.isascii():
+        return None
+    try:
+        html = _gunzip_b64(inner.encode("ascii"))
+    except Exception:
+        return None
+    if _first_inner(html) is not None:
+        return None  # còn lớp lồng nữa: civitek giải tiếp, tool khác thì không
+    return {"uris": _URI_RE.findall(outer), "html": html}
+
+class PageStore:
+    """
+    Dùng theo từng file TXT:  with open_store(data_dir) as store: ... store.page(uuid, payload)
+    Lỗi SQLite (thư mục chỉ đọc, khoá quá lâu...) -> tắt kho, checker tự giải mã như cũ.
+    """
+    def __init__(self, data_dir: str):
+        self.db = None
+        self._pending = []
+        if not PAGE_STORE:
+            return
+        try:
+            self.db = sqlite3.connect(os.path.join(data_dir, STORE_NAME), timeout=30)
+            self.db.execute("PRAGMA journal_mode=WAL")   # nhiều worker cùng đọc/ghi 1 bundle
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(_SCHEMA)
+        except sqlite3.Error:
+            self._disable()
+
+    def _disable(self):
+        if self.db is not None:
+            try:
+                self.db.close()
+            except sqlite3.Error:
+                pass
+        self.db = None
+        self._pending = []
+
+    def _row_key(self, uuid, payload: str):
+        if self.db is None or uuid is None:
+            return None, None
+        key = payload.strip()
+        if not key.isascii():
+            return None, None
+        raw = key.encode("ascii")
+        return (uuid.strip().lower(), len(raw), zlib.crc32(raw)), raw
+
+    def _select(self, row_key):
+        try:
+            return self.db.execute("SELECT clean, uris, html FROM pages WHERE uuid=? AND size=? AND crc=?",
+                                   row_key).fetchone()
+        except sqlite3.Error:
+            self._disable()
+            return None
+
+    def lookup(self, uuid, payload: str):
+        """Như page() nhưng chỉ đọc kho: chưa có thì trả None, không tự giải mã (vd. MD đọc trang dở)."""
+        row_key, _ = self._row_key(uuid, payload)
+        row = self._select(row_key) if row_key is not None else None
+        return {"uris": json.loads(row[1]), "html": row[2]} if row and row[0] else None
+
+    def page(self, uuid, payload: str):
+        """
+        Trang của dòng (uuid, payload base64 ngoài): {"uris": [khối <Uri> thô], "html": HTML bên trong};
+        None = kho tắt hoặc dòng không giải mã sạch -> checker tự giải mã.
+        """
+        row_key, raw = self._row_key(uuid, payload)
+        if row_key is None:
+            return None
+        row = self._select(row_key)
+        if self.db is None:
+            return None
+        if row is not None:
+            return {"uris": json.loads(row[1]), "html": row[2]} if row[0] else None
+        page = decode_page(raw)
+        if page is None:
+            self._pending.append(row_key + (0, None, None))
+        else:
+            self._pending.append(row_key + (1, json.dumps(page["uris"]), page["html"]))
+        if len(self._pending) >= FLUSH_ROWS:
+            self.flush()
+        return page
+
+    def flush(self):
+        if self.db is None or not self._pending:
+            return
+        try:
+            with self.db:
+                self.db.executemany("INSERT OR IGNORE INTO pages VALUES (?, ?, ?, ?, ?, ?)", self._pending)
+            self._pending = []
+        except sqlite3.Error:
+            self._disable()
+
+    def close(self):
+        self.flush()
+        self._disable()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_store(data_dir: str) -> PageStore:
+    return PageStore(data_dir)
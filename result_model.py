@@ -0,0 +1,171 @@
+# result_model.py — kết quả có cấu trúc dùng chung cho mọi checker
+# Mỗi lỗi là 1 dict (lead ID, mã lỗi, field, giá trị XML/HTML, mức độ); log tiếng Việt được
+# render từ đó -> app.py / UI lấy ID lỗi thẳng từ model, không phải quét lại log bằng regex.
+
+import os
+
+SEVERITY_ERROR = "error"
+SEVERITY_WARNING = "warning"
+
+def issue(lead_id, code: str, text: str, field=None, xml=None, html=None, severity: str = SEVERITY_ERROR) -> dict:
+    """
+    1 lỗi. lead_id=None: lỗi cấp file (thiếu file, đọc hỏng...).
+    code: mã máy đọc được (vd. "CASE_KEY_MISMATCH"); text: nội dung dòng log tiếng Việt.
+    """
+    return {"id": lead_id, "code": code, "field": field, "xml": xml, "html": html,
+            "severity": severity, "text": text}
+
+def pair_key(name) -> str:
+    """Khoá của cặp XML/TXT từ tên bất kỳ trong cặp: 'A_content.txt', 'A.xml', 'A' -> 'a'."""
+    low = os.path.basename(str(name)).lower()
+    for suffix in ("_content.txt", "_compare_output.csv", ".xml"):
+        if low.endswith(suffix):
+            return low[:-len(suffix)]
+    return low
+
+def keep_files(names, only_files=None) -> list:
+    """Lọc danh sách file theo only_files (tên file TXT/XML/base của cặp); None = giữ tất cả."""
+    if only_files is None:
+        return list(names)
+    wanted = {pair_key(n) for n in only_files}
+    return [n for n in names if pair_key(n) in wanted]
+
+def _summarize(files) -> dict:
+    ids, counts = {}, {}
+    for f in files:
+        for iss in f["issues"]:
+            if iss["id"]:
+                ids.setdefault(iss["id"], None)
+            counts[iss["code"]] = counts.get(iss["code"], 0) + 1
+    return {"error_ids": list(ids), "issues_total": sum(counts.values()), "counts": counts}
+
+class CheckLog(list):
+    """
+    Các dòng log (dùng y như list cũ: append/extend/"\\n".join) + model theo file:
+      begin_file(tên) -> add(issue) ghi lỗi vào file hiện tại và thêm dòng prefix + issue["text"].
+      end_file() trước phần tổng kết cuối log (để phần đó không bị tính vào file cuối).
+    output(structured): text log, hoặc dict {tool, files, error_ids, counts, cancelled, log};
+    mỗi file có log_span = [đầu, cuối) của đoạn log của file đó trong "log" (dùng khi gộp re-check).
+    """
+    def __init__(self, tool: str):
+        super().__init__()
+        self.tool = tool
+        self.files = []
+        self.cancelled = False
+        self._file = None
+        self._spans = []      # [dòng đầu, dòng cuối) của từng file trong list log
+        self._only = False
+
+    def begin_file(self, name: str, header: str = None):
+        self.end_file()
+        self._file = {"name": name, "issues": []}
+        self.files.append(self._file)
+        self._spans.append([len(self), None])
+        if header is not None:
+            self.append(header)
+
+    def end_file(self):
+        if self._spans and self._spans[-1][1] is None:
+            self._spans[-1][1] = len(self)
+
+    def record(self, iss: dict):
+        """Chỉ ghi vào model (dùng khi nhiều lỗi được gộp chung 1 dòng log)."""
+        if self._file is None:
+            self.begin_file(None)
+        self._file["issues"].append(iss)
+
+    def add(self, iss: dict, prefix: str = "  ❌ "):
+        self.record(iss)
+        self.append(prefix + iss["text"])
+
+    def only(self, text: str):
+        """Lỗi dừng cả lần chạy: log chỉ còn đúng 1 dòng (model giữ nguyên phần đã có)."""
+        self[:] = [text]
+        self._only = True
+        return self
+
+    def issues(self):
+        for f in self.files:
+            for iss in f["issues"]:
+                yield f["name"], iss
+
+    def error_ids(self):
+        """ID lead xuất hiện trong log lỗi (gồm cả cảnh báo), theo thứ tự gặp."""
+        return _summarize(self.files)["error_ids"]
+
+    def render(self) -> str:
+        return "\n".join(self)
+
+    def _char_spans(self):
+        """log_span của từng file theo vị trí ký tự trong render() (None nếu file không có dòng nào)."""
+        self.end_file()
+        offsets = [0]
+        for line in self:
+            offsets.append(offsets[-1] + len(line) + 1)
+        return [[offsets[a], offsets[b] - 1] if b > a else None for a, b in self._spans]
+
+    def result(self) -> dict:
+        files = self.files
+        if not self._only:
+            files = [{**f, "log_span": span} for f, span in zip(self.files, self._char_spans())]
+        return {
+            "tool": self.tool,
+            "files": files,
+            **_summarize(files),
+            "cancelled": self.cancelled,
+            "log": self.render(),
+        }
+
+    def output(self, structured: bool = False):
+        return self.result() if structured else self.render()
+
+# ===== Gộp kết quả re-check =====
+def _file_chunks(res: dict):
+    """(head, [(file, đoạn log)], tail) — None nếu log không chia được theo file (vd. lỗi dừng cả lần chạy)."""
+    log, files = res.get("log") or "", res.get("files") or []
+    if not files or any("log_span" not in f for f in files):
+        return None
+    real = [f["log_span"] for f in files if f["log_span"]]
+    if not real:
+        return None
+    chunks = [(f, log[f["log_span"][0]:f["log_span"][1]] if f["log_span"] else None) for f in files]
+    head = log[:real[0][0] - 1] if real[0][0] > 0 else None
+    tail = log[real[-1][1] + 1:] if real[-1][1] < len(log) else None
+    return head, chunks, tail
+
+def merge_results(base: dict, fresh: dict) -> dict:
+    """
+    Gộp kết quả re-check (chỉ chạy lại vài file) vào kết quả cũ: file có trong `fresh` thay cho
+    bản cũ (cả issues lẫn đoạn log), file khác giữ nguyên. Phần tổng kết cuối log cũ không còn
+    đúng nên được thay bằng tổng kết sau khi gộp. Không chia được log cũ thì trả `fresh`.
+    """
+    old, new = _file_chunks(base), _file_chunks(fresh)
+    if old is None or new is None:
+        return {**fresh, "rechecked": [f["name"] for f in fresh.get("files") or []]}
+    head, old_chunks, _ = old
+    new_by_name = {f["name"]: (f, chunk) for f, chunk in new[1]}
+    merged = [new_by_name.pop(f["name"], (f, chunk)) for f, chunk in old_chunks] + list(new_by_name.values())
+
+    rechecked = [f["name"] for f, _ in new[1]]
+    parts, files, pos = [], [], 0
+    if head is not None:
+        parts.append(head)
+        pos = len(head) + 1
+    for f, chunk in merged:
+        span = None
+        if chunk is not None:
+            parts.append(chunk)
+            span = [pos, pos + len(chunk)]
+            pos += len(chunk) + 1
+        files.append({**f, "log_span": span})
+    summary = _summarize(files)
+    parts.append(f"\n--- KIỂM TRA LẠI {len(rechecked)} file: {', '.join(str(n) for n in rechecked)} ---")
+    parts.append(f"Sau khi gộp: {summary['issues_total']} lỗi, {len(summary['error_ids'])} ID lỗi.")
+    return {
+        "tool": fresh.get("tool") or base.get("tool"),
+        "files": files,
+        **summary,
+        "cancelled": bool(base.get("cancelled") or fresh.get("cancelled")),
+        "rechecked": rechecked,
+        "log": "\n".join(parts),
+    }
@@ -0,0 +1,268 @@
+# scheduler.py — chia slot worker theo "lane" + nhận job theo chi phí ước lượng
+# Job nhỏ (MD) không phải xếp hàng sau bundle Civitek lớn:
+#   - Mỗi lane có trần slot riêng; lane "heavy" không bao giờ chiếm hết slot dành cho lane "light".
+#   - Trong hàng đợi: job có thời gian ước lượng ngắn hơn được nhận trước, có aging để không bị đói.
+# Nhiều người dùng chung 1 instance:
+#   - Ưu tiên: "interactive" (kiểm tra tay) luôn trước "bulk" (chạy lại hàng loạt); bulk chờ quá
+#     priority_aging_s giây thì được nâng lên ngang interactive.
+#   - Chia đều giữa các client (start-time fair queuing theo thời gian ước lượng) + trần số job
+#     chạy đồng thời của mỗi client.
+import os
+import time
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+PRIORITY_RANK = {"interactive": 0, "bulk": 1}
+
+def available_memory_bytes() -> int:
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return 0
+
+def auto_worker_count(worker_mem_bytes: int, min_workers: int = 1, max_workers: int = 16) -> int:
+    """
+    Số worker = min(số CPU, RAM khả dụng / RAM ước lượng mỗi worker), kẹp trong [min_workers, max_workers].
+    min_workers > số CPU vẫn hợp lý: slot thừa dành cho job nhỏ, chạy xen kẽ với job nặng.
+    """
+    cpus = os.cpu_count() or 1
+    mem = available_memory_bytes()
+    by_mem = mem // worker_mem_bytes if (mem and worker_mem_bytes) else cpus
+    return max(min_workers, min(cpus, by_mem, max_workers))
+
+def _percentile(values, q):
+    if not values:
+        return None
+    vals = sorted(values)
+    idx = min(len(vals) - 1, int(round(q * (len(vals) - 1))))
+    return round(vals[idx], 3)
+
+class Cancelled(Exception):
+    """Job bị hủy khi còn đang chờ slot."""
+
+class _Ticket:
+    __slots__ = ("lane", "cost", "est_sec", "enqueued", "admitted", "cancelled", "job_id",
+                 "client", "priority", "started")
+
+    def __init__(self, lane, cost, est_sec, job_id, client, priority):
+        self.lane, self.cost, self.est_sec, self.job_id = lane, cost, est_sec, job_id
+        self.client, self.priority = client, priority
+        self.enqueued = time.time()
+        self.started = None
+        self.admitted = False
+        self.cancelled = False
+
+class _Lane:
+    def __init__(self, name, max_slots, bytes_per_sec):
+        self.name = name
+        self.max_slots = max_slots
+        self.queue = []
+        self.running = 0
+        self.admitted_total = 0
+        self.completed_total = 0
+        self.waits = deque(maxlen=200)
+        self.runs = deque(maxlen=200)
+        self.bytes_per_sec = float(bytes_per_sec)  # EWMA thông lượng, dùng để ước lượng thời gian
+
+class LaneScheduler:
+    """
+    total_slots: tổng số job chạy đồng thời (= số worker của pool).
+    lanes: {tên_lane: max_slots}; aging_factor: mỗi giây chờ trừ bấy nhiêu giây ước lượng.
+    client_max_running: số job tối đa 1 client chạy cùng lúc (0 = không giới hạn).
+    priority_aging_s: job "bulk" chờ quá ngần này giây thì được xếp ngang "interactive".
+    """
+    def __init__(self, total_slots: int, lanes: dict, default_bytes_per_sec: float = 2 * 1024 * 1024,
+                 aging_factor: float = 1.0, client_max_running: int = 0, priority_aging_s: float = 300):
+        self.total_slots = total_slots
+        self.aging_factor = aging_factor
+        self.client_max_running = client_max_running
+        self.priority_aging_s = priority_aging_s
+        self.running = 0
+        self._cond = threading.Condition()
+        self._lanes = {name: _Lane(name, max(1, min(cap, total_slots)), default_bytes_per_sec)
+                       for name, cap in lanes.items()}
+        self._active = set()                   # ticket đang chạy
+        self._client_running = defaultdict(int)
+        self._client_finish = {}               # fair queuing: "thời điểm ảo" client dùng hết phần đã nhận
+        self._vclock = 0.0
+
+    def estimate_seconds(self, lane: str, cost: float) -> float:
+        return cost / max(self._lanes[lane].bytes_per_sec, 1.0)
+
+    def _priority(self, t: _Ticket, now: float) -> float:
+        return t.est_sec - (now - t.enqueued) * self.aging_factor
+
+    def _start_tag(self, t: _Ticket) -> float:
+        return max(self._vclock, self._client_finish.get(t.client, 0.0))
+
+    def _order_key(self, t: _Ticket, now: float):
+        """Thứ tự nhận job: lớp ưu tiên -> lượt của client (fair share) -> job ngắn trước (có aging)."""
+        rank = PRIORITY_RANK.get(t.priority, 0)
+        if rank and now - t.enqueued >= self.priority_aging_s:
+            rank = 0
+        return (rank, self._start_tag(t), self._priority(t, now))
+
+    def _eligible(self, t: _Ticket) -> bool:
+        lane = self._lanes[t.lane]
+        if lane.running >= lane.max_slots:
+            return False
+        return not (self.client_max_running and self._client_running[t.client] >= self.client_max_running)
+
+    def _queued(self):
+        return [t for lane in self._lanes.values() for t in lane.queue]
+
+    def _dispatch(self):
+        """Gọi khi đang giữ lock: nhận job đứng đầu (theo _order_key) khi còn slot."""
+        now = time.time()
+        if not self.running and not any(ln.queue for ln in self._lanes.values()):
+            # hết busy period (không job chạy, không job chờ): như SFQ, đồng hồ ảo nhảy tới finish lớn nhất
+            # -> không client nào còn "nợ", bỏ hết (client_id do client gửi, mỗi trình duyệt 1 id)
+            self._vclock = max(self._vclock, *self._client_finish.values(), 0.0)
+            self._client_finish.clear()
+            return
+        while self.running < self.total_slots:
+            cands = [t for t in self._queued() if self._eligible(t)]
+            if not cands:
+                return
+            best = min(cands, key=lambda t: self._order_key(t, now))
+            lane = self._lanes[best.lane]
+            lane.queue.remove(best)
+            lane.running += 1
+            lane.admitted_total += 1
+            lane.waits.append(now - best.enqueued)
+            start = self._start_tag(best)
+            self._client_finish[best.client] = start + max(best.est_sec, 0.001)
+            self._vclock = start
+            # client đã dùng hết phần trước _vclock thì start tag = _vclock như client mới -> bỏ khỏi dict
+            for c in [c for c, fin in self._client_finish.items() if fin <= start]:
+                del self._client_finish[c]
+            self._client_running[best.client] += 1
+            self.running += 1
+            best.started = now
+            best.admitted = True
+            self._active.add(best)
+            self._cond.notify_all()
+
+    def cancel(self, job_id: str) -> bool:
+        """Bỏ job khỏi hàng đợi (nếu còn đang chờ); thread đang chờ nhận Cancelled ngay."""
+        with self._cond:
+            for lane in self._lanes.values():
+                for t in lane.queue:
+                    if t.job_id == job_id:
+                        lane.queue.remove(t)
+                        t.cancelled = True
+                        self._cond.notify_all()
+                        return True
+        return False
+
+    def queue_position(self, job_id: str):
+        """
+        Vị trí trong hàng đợi (1 = nhận tiếp theo) + số giây ước lượng tới lúc bắt đầu chạy.
+        ETA: mô phỏng xếp các job cùng lane phía trước vào slot trống sớm nhất của lane
+        (lane dùng chung toàn bộ slot thì tính cả job đang chạy ở lane khác; bỏ qua trần client).
+        Trả None nếu job không còn trong hàng đợi.
+        """
+        with self._cond:
+            now = time.time()
+            order = sorted(self._queued(), key=lambda t: self._order_key(t, now))
+            for i, t in enumerate(order):
+                if t.job_id == job_id:
+                    break
+            else:
+                return None
+            lane = self._lanes[t.lane]
+            shared = lane.max_slots >= self.total_slots
+            free = sorted(max(0.0, a.est_sec - (now - a.started))
+                          for a in self._active if shared or a.lane == t.lane)
+            free += [0.0] * max(0, lane.max_slots - len(free))
+            free = sorted(free)[:lane.max_slots]
+            for ahead in order[:i]:
+                if shared or ahead.lane == t.lane:
+                    free.sort()
+                    free[0] += ahead.est_sec
+            return {"position": i + 1, "queued": len(order),
+                    "eta_sec": round(min(free), 1) if free else 0.0}
+
+    @contextmanager
+    def slot(self, lane: str, cost: float, job_id: str = None, on_admit=None, cancelled=None,
+             client: str = None, priority: str = "interactive"):
+        """
+        Chờ tới lượt trong lane rồi giữ 1 slot trong suốt khối `with`.
+        cancelled(): kiểm tra định kỳ khi đang chờ; True -> rời hàng đợi, raise Cancelled.
+        """
+        if lane not in self._lanes:
+            raise KeyError(f"Lane không tồn tại: {lane}")
+        if priority not in PRIORITY_RANK:
+            raise KeyError(f"Mức ưu tiên không hợp lệ: {priority}")
+        ticket = _Ticket(lane, cost, self.estimate_seconds(lane, cost), job_id, client or "-", priority)
+        with self._cond:
+            self._lanes[lane].queue.append(ticket)
+            self._dispatch()
+            while not ticket.admitted:
+                if not ticket.cancelled and cancelled is not None and cancelled():
+                    self._lanes[lane].queue.remove(ticket)
+                    ticket.cancelled = True
+                if ticket.cancelled:
+                    raise Cancelled(job_id)
+                # định kỳ tính lại aging kể cả khi không có job nào kết thúc
+                self._cond.wait(timeout=5)
+                if not ticket.admitted and not ticket.cancelled:
+                    self._dispatch()
+        if on_admit:
+            on_admit()
+        t0 = time.time()
+        try:
+            yield ticket
+        finally:
+            elapsed = time.time() - t0
+            with self._cond:
+                ln = self._lanes[lane]
+                ln.running -= 1
+                ln.completed_total += 1
+                ln.runs.append(elapsed)
+                if cost > 0 and elapsed > 0.05:
+                    ln.bytes_per_sec = 0.8 * ln.bytes_per_sec + 0.2 * (cost / elapsed)
+                self.running -= 1
+                self._active.discard(ticket)
+                self._client_running[ticket.client] -= 1
+                if not self._client_running[ticket.client]:
+                    del self._client_running[ticket.client]
+                self._dispatch()
+
+    def metrics(self) -> dict:
+        with self._cond:
+            now = time.time()
+            lanes = {}
+            for ln in self._lanes.values():
+                lanes[ln.name] = {
+                    "max_slots": ln.max_slots,
+                    "running": ln.running,
+                    "queued": len(ln.queue),
+                    "queued_cost": sum(t.cost for t in ln.queue),
+                    "oldest_wait_sec": round(max((now - t.enqueued for t in ln.queue), default=0), 3),
+                    "admitted_total": ln.admitted_total,
+                    "completed_total": ln.completed_total,
+                    "wait_p50_sec": _percentile(ln.waits, 0.5),
+                    "wait_p95_sec": _percentile(ln.waits, 0.95),
+                    "run_p50_sec": _percentile(ln.runs, 0.5),
+                    "run_p95_sec": _percentile(ln.runs, 0.95),
+                    "bytes_per_sec": int(ln.bytes_per_sec),
+                }
+            clients = defaultdict(lambda: {"running": 0, "queued": 0, "queued_bulk": 0})
+            for c, n in self._client_running.items():
+                clients[c]["running"] = n
+            for t in self._queued():
+                clients[t.client]["queued"] += 1
+                if t.priority == "bulk":
+                    clients[t.client]["queued_bulk"] += 1
+            return {"total_slots": self.total_slots, "running": self.running,
+                    "client_max_running": self.client_max_running or None,
+                    "lanes": lanes, "clients": dict(clients)}
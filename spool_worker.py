@@ -0,0 +1,99 @@
+# spool_worker.py — worker nhận job từ spool dùng chung (job_spool.py), chạy trên 1 hay nhiều máy
+#     SPOOL_DIR=/mnt/shared/spool gunicorn -w 4 app:app          # máy API: chỉ nhận/trả job
+#     SPOOL_DIR=/mnt/shared/spool python -m spool_worker --slots 4  # mỗi máy worker
+# Mỗi slot là 1 thread: nhận job -> chạy như app.py chạy job nền (_run_command_background: tải/giải
+# nén, SCHED, pool worker, timeout/hủy) -> ghi kết quả vào spool. Pool là của máy worker (hoặc
+# executor service nếu có EXECUTOR_SOCKET). data_dir nằm trên đĩa máy worker: delete-error-lines /
+# recheck / download-cleaned chỉ dùng được khi UPLOAD_DIR cũng nằm trên ổ dùng chung.
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+import job_spool
+
+def _watch(spool, job_id: str, token: str, app, run_id: str, done: threading.Event):
+    """Trong lúc job chạy: gia hạn lease, chuyển cờ hủy của spool thành cờ hủy local, báo trạng thái."""
+    last, beat = None, time.monotonic()
+    while not done.wait(1.0):
+        if time.monotonic() - beat >= job_spool.SPOOL_HEARTBEAT_S:
+            beat = time.monotonic()
+            if not spool.heartbeat(job_id, token):
+                app._request_cancel(run_id)  # lease đã bị lấy lại: worker khác sẽ chạy job này
+                return
+        if spool.cancelled(job_id):
+            app._request_cancel(run_id)
+        job = app.JOBS.get(run_id) or {}
+        state = {k: v for k, v in job.items() if k != "result"}
+        if state and state.get("status") != (last or {}).get("status"):
+            spool.set_state(job_id, token, state)
+            last = state
+
+def _slot_loop(spool, app, worker_id: str, stopping: threading.Event, poll_s: float):
+    while not stopping.is_set():
+        job = spool.claim(worker_id)
+        if job is None:
+            stopping.wait(poll_s)
+            continue
+        job_id = job["job_id"]
+        # JOBS / cờ hủy (trong UPLOAD_DIR) / SCHED theo từng lượt nhận: lượt cũ mất lease tự hủy
+        # mà không hủy nhầm lượt mới của cùng job (cùng máy, hoặc UPLOAD_DIR dùng chung)
+        run_id = f"{job_id}.{job['lease']}"
+        done = threading.Event()
+        watcher = threading.Thread(target=_watch, args=(spool, job_id, job["lease"], app, run_id, done), daemon=True)
+        watcher.start()
+        try:
+            if spool.cancelled(job_id):
+                app._request_cancel(run_id)
+            app._run_command_background(run_id, job.get("command") or "", job.get("client"),
+                                        job.get("priority") or "interactive", job.get("recheck"))
+        finally:
+            done.set()
+            watcher.join()
+            result = app.JOBS.pop(run_id, None) or {"status": "error", "error": "Worker không ghi kết quả"}
+            spool.finish(job_id, job["lease"], result)  # lease đã bị lấy lại -> bỏ kết quả
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m spool_worker", description="Worker nhận job từ spool dùng chung.")
+    ap.add_argument("--spool", default=os.environ.get("SPOOL_DIR"), help="thư mục spool (mặc định: SPOOL_DIR)")
+    ap.add_argument("--slots", type=int, help="số job chạy cùng lúc (mặc định: WORKERS của máy này)")
+    ap.add_argument("--worker-id", help="tên worker (mặc định: host:pid)")
+    ap.add_argument("--poll", type=float, default=1.0, help="giây chờ giữa 2 lần tìm job khi spool rỗng")
+    args = ap.parse_args(argv)
+    if not args.spool:
+        ap.error("cần --spool hoặc SPOOL_DIR")
+
+    # app.py thấy EXECUTOR_ROLE=spool_worker thì vẫn tạo pool (máy API có SPOOL_DIR thì không)
+    os.environ["EXECUTOR_ROLE"] = "spool_worker"
+    import app
+    spool = job_spool.Spool(args.spool)
+    worker_id = args.worker_id or job_spool.default_worker_id()
+    slots = max(1, args.slots or app.WORKERS)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+
+    threads = [threading.Thread(target=_slot_loop, args=(spool, app, worker_id, stopping, args.poll), daemon=True)
+               for _ in range(slots)]
+    for t in threads:
+        t.start()
+    print(f"Spool worker {worker_id}: {slots} slot, spool {args.spool}", flush=True)
+    try:
+        while not stopping.is_set():
+            spool.worker_heartbeat(worker_id, {"slots": slots, "pid": os.getpid(),
+                                               "running": sum(1 for j in app.JOBS.values()
+                                                              if j.get("status") in ("preparing", "queued", "running"))})
+            spool.reclaim_expired()
+            stopping.wait(job_spool.SPOOL_HEARTBEAT_S)
+    except KeyboardInterrupt:
+        stopping.set()
+    # dừng nhận job mới, chờ job đang chạy xong (lease vẫn được gia hạn trong lúc chờ)
+    for t in threads:
+        t.join()
+    spool.worker_gone(worker_id)
+    if app.EXEC is not None:
+        app.EXEC.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
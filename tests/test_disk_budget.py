@@ -0,0 +1,145 @@
+# Giữ chỗ đĩa theo phiên upload (hold/resize/touch/release) + member có data descriptor của zip_stream
+import io
+import os
+import sys
+import time
+import shutil
+import zipfile
+from collections import namedtuple
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import disk_budget
+import zip_stream
+
+@pytest.fixture(autouse=True)
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_budget, "DISK_LEDGER", str(tmp_path / "ledger.json"))
+    monkeypatch.setattr(disk_budget, "POLL_S", 0.01)
+    monkeypatch.setattr(disk_budget, "_janitor", None)
+
+def _held(key):
+    with disk_budget._ledger() as entries:
+        return entries[key]["bytes"] if key in entries else None
+
+def test_session_hold_counts_against_others(tmp_path):
+    free = shutil.disk_usage(tmp_path).free
+    disk_budget.hold("upload:a", free // 2, str(tmp_path), headroom=0, wait=0)
+    with pytest.raises(disk_budget.DiskFull):
+        disk_budget.ensure(free // 2 + free // 4, str(tmp_path), headroom=0, wait=0)
+    disk_budget.hold("upload:a", 1, str(tmp_path), headroom=0, wait=0)  # đã có: chỉ touch
+    assert _held("upload:a") == free // 2
+    disk_budget.release("upload:a")
+    disk_budget.ensure(free // 2 + free // 4, str(tmp_path), headroom=0, wait=0)
+
+def test_touch_shrinks_and_resize_waits_for_room(tmp_path):
+    free = shutil.disk_usage(tmp_path).free
+    disk_budget.hold("upload:a", 1000, str(tmp_path), headroom=0, wait=0)
+    disk_budget.touch("upload:a", 400)
+    assert _held("upload:a") == 400
+    disk_budget.touch("upload:a", 900)  # touch không tăng
+    assert _held("upload:a") == 400
+    disk_budget.resize("upload:a", 5000, str(tmp_path), headroom=0, wait=0)
+    assert _held("upload:a") == 5000
+    with pytest.raises(disk_budget.DiskFull):
+        disk_budget.resize("upload:a", free * 2, str(tmp_path), headroom=0, wait=0)
+    assert _held("upload:a") == 5000
+    disk_budget.resize("upload:a", 10, str(tmp_path), headroom=0, wait=0)
+    assert _held("upload:a") == 10
+    with pytest.raises(KeyError):
+        disk_budget.resize("upload:gone", 10, str(tmp_path), headroom=0, wait=0)
+
+def test_ttl_session_expires_without_touch(tmp_path):
+    disk_budget.hold("upload:a", 10, str(tmp_path), headroom=0, wait=0, ttl=0.05)
+    assert _held("upload:a") == 10
+    time.sleep(0.1)
+    assert _held("upload:a") is None
+
+_Usage = namedtuple("_Usage", "total used free")
+
+def _small_disk(monkeypatch, tmp_path, capacity):
+    """Ổ đĩa giả `capacity` byte: dung lượng trống = capacity - byte đã ghi dưới tmp_path/out."""
+    out = tmp_path / "out"
+    out.mkdir()
+    real = shutil.disk_usage
+
+    def usage(path):
+        if not str(path).startswith(str(tmp_path)):
+            return real(path)
+        used = sum(f.stat().st_size for f in out.rglob("*") if f.is_file())
+        return _Usage(capacity, used, capacity - used)
+
+    monkeypatch.setattr(disk_budget.shutil, "disk_usage", usage)
+    return out
+
+def test_session_resized_while_writing_uses_whole_disk(tmp_path, monkeypatch):
+    out = _small_disk(monkeypatch, tmp_path, 100)
+    disk_budget.hold("upload:a", 0, str(tmp_path), headroom=0, wait=0)
+    with open(out / "f", "wb") as f:
+        for _ in range(10):
+            disk_budget.resize("upload:a", 10, str(tmp_path), headroom=0, wait=0)
+            f.write(b"x" * 10)
+            f.flush()
+            disk_budget.touch("upload:a", 0)
+    with pytest.raises(disk_budget.DiskFull) as e:
+        disk_budget.resize("upload:a", 10, str(tmp_path), headroom=0, wait=0)
+    assert "0.0B đang được job khác giữ chỗ" in str(e.value)
+    # job khác giữ chỗ thật thì vẫn bị tính
+    disk_budget.release("upload:a")
+    (out / "f").unlink()
+    disk_budget.hold("upload:a", 0, str(tmp_path), headroom=0, wait=0)
+    with disk_budget.reserve(70, str(tmp_path), headroom=0, wait=0):
+        disk_budget.resize("upload:a", 30, str(tmp_path), headroom=0, wait=0)
+        with pytest.raises(disk_budget.DiskFull):
+            disk_budget.resize("upload:a", 31, str(tmp_path), headroom=0, wait=0)
+
+class _Unseekable(io.RawIOBase):
+    """zipfile ghi vào luồng không seek được thì dùng data descriptor (như ZIP tạo theo luồng)."""
+    def __init__(self):
+        self.buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buf += b
+        return len(b)
+
+def test_stream_descriptor_member_reserves_as_written(tmp_path):
+    out = _Unseekable()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("a_content.txt", b"Total Record Count: 15\n" * 400000)
+    assert out.buf[6] & 0x8  # member có data descriptor
+    calls = []
+    x = zip_stream.StreamExtractor(str(tmp_path / "out"), reserve=calls.append)
+    x.feed(bytes(out.buf))
+    x.finish()
+    assert len(calls) > 1 and sum(calls) == os.path.getsize(tmp_path / "out" / "a_content.txt")
+
+def test_stream_extract_with_session_hold_fits_tight_disk(tmp_path, monkeypatch):
+    """Như upload mode stream của app: reserve(n) -> resize(n), sau mỗi feed touch(phần hứa chưa ghi)."""
+    body = b"Total Record Count: 15\n" * 200000
+    src = _Unseekable()
+    with zipfile.ZipFile(src, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("a_content.txt", body)
+        zf.writestr("b_content.txt", body)
+    zf_known = io.BytesIO()
+    with zipfile.ZipFile(zf_known, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("c_content.txt", body)
+    out = _small_disk(monkeypatch, tmp_path, int(len(body) * 3.3))  # < 2 lần tổng byte giải nén
+    disk_budget.hold("upload:s", 0, str(tmp_path), headroom=0, wait=0)
+    promised = {"n": 0}
+
+    def _reserve(n):
+        promised["n"] = x.bytes_written + n
+        disk_budget.resize("upload:s", n, str(tmp_path), headroom=0, wait=0)
+
+    for data in (bytes(src.buf), zf_known.getvalue()):
+        x = zip_stream.StreamExtractor(str(out), reserve=_reserve)
+        for i in range(0, len(data), 4096):
+            x.feed(data[i:i + 4096])
+            disk_budget.touch("upload:s", max(0, promised["n"] - x.bytes_written))
+        x.finish()
+    assert sum(f.stat().st_size for f in out.iterdir()) == 3 * len(body)
+    assert _held("upload:s") == 0
@@ -0,0 +1,81 @@
+# Executor service: SCHED nằm ở service -> job vượt trần chờ trong hàng đợi chung, thấy được vị trí
+# và hủy được ngay khi còn chờ (pool 1 worker thật + socket thật trong thư mục tạm)
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scheduler
+import worker_pool
+import executor_service
+
+@pytest.fixture
+def service(tmp_path):
+    path = str(tmp_path / "exec.sock")
+    pool = worker_pool.WorkerPool(1, mp_context=multiprocessing.get_context("forkserver"), kill_grace=1)
+    sched = scheduler.LaneScheduler(1, {"light": 1})
+    listener = Listener(path, family="AF_UNIX")
+
+    def _serve():
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=executor_service._handle, args=(conn, pool, sched, dict), daemon=True).start()
+
+    threading.Thread(target=_serve, daemon=True).start()
+    yield executor_service.ExecutorClient(path), sched
+    listener.close()
+    pool.shutdown()
+
+def _slot(job_id):
+    return {"lane": "light", "cost": 0, "job_id": job_id, "client": "c", "priority": "interactive"}
+
+def _wait(cond, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+def test_queued_job_visible_and_cancellable(service):
+    client, sched = service
+    admitted, results = threading.Event(), {}
+
+    def _first():
+        results["a"] = client.run(time.sleep, 2, slot=_slot("a"), on_admit=admitted.set)
+
+    ta = threading.Thread(target=_first)
+    ta.start()
+    assert admitted.wait(10)
+
+    flag = threading.Event()
+    b_admitted = threading.Event()
+
+    def _second():
+        try:
+            client.run(time.sleep, 0, slot=_slot("b"), on_admit=b_admitted.set, cancelled=flag.is_set)
+            results["b"] = "ran"
+        except scheduler.Cancelled:
+            results["b"] = ("cancelled", time.monotonic())
+
+    tb = threading.Thread(target=_second)
+    tb.start()
+    _wait(lambda: client.queue_position("b") is not None)
+    assert client.queue_position("b")["position"] == 1
+    assert client.scheduler_metrics()["lanes"]["light"]["queued"] == 1
+
+    t0 = time.monotonic()
+    flag.set()
+    tb.join(10)
+    assert results["b"][0] == "cancelled" and results["b"][1] - t0 < 1.5
+    assert not b_admitted.is_set()
+    assert ta.is_alive()  # job đang chạy không bị ảnh hưởng
+    ta.join(10)
+    assert results["a"] is None
+    assert sched.metrics()["lanes"]["light"]["queued"] == 0
@@ -0,0 +1,83 @@
+# gzip_head: kết quả MD / md new trên phần đầu trang phải giống hệt trên trang giải mã đủ
+import os
+import sys
+import gzip
+import base64
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gzip_head
+import md_logic
+import md_new_logic
+
+@pytest.fixture(autouse=True)
+def early_exit(monkeypatch):
+    monkeypatch.setattr(gzip_head, "EARLY_EXIT", True)
+
+def _b64(html, extra=b""):
+    return base64.b64encode(gzip.compress(html.encode()) + extra).decode()
+
+_PIECES = [
+    '<input type="hidden" name="caseId" value=" %s ">', '<span>Case Number:</span>\n</td><td> <span class="Value">%s</span>',
+    "data not found", "DATA NOT FOUND", '<input name="firstName" value="%s">', '<input name="lastName" value="SMITH">',
+    '<input name="filingStart" value="01/02/2020">', '<input name="filingEnd" value="01/03/2020">',
+    "First Name: <span class=v>ANN</span>", "Last Name:<span>SMITH</span>",
+    "Filing Date Range: <span>01/02/2020 to 01/03/2020</span>",
+]
+
+def _page(rnd):
+    bits = []
+    for _ in range(rnd.randint(0, 14)):
+        bits.append("".join(rnd.choice("abc <>/\"=\n xyzé") for _ in range(rnd.randint(0, 80))))
+        piece = rnd.choice(_PIECES)
+        bits.append(piece % rnd.choice(["12ab", "ANN", "C1.2"]) if "%s" in piece else piece)
+    bits.append("x" * rnd.randint(0, 3000))
+    return "".join(bits)
+
+def test_head_gives_same_result_as_full_page():
+    rnd = random.Random(44)
+    args = ("01/02/2020", "01/03/2020", "SMITH", "ANN")
+    early = 0
+    for _ in range(1500):
+        html = _page(rnd)
+        b64 = _b64(html)
+        chunk = rnd.choice([3, 17, 256, 32768])
+        head = gzip_head.inflate_head(b64, md_logic.html_head_check, chunk=chunk)
+        assert md_logic.html_case_value(head) == md_logic.html_case_value(html), html
+        early += len(head) < len(html)
+        head = gzip_head.inflate_head(b64, md_new_logic.html_head_check, ascii_only=True, chunk=chunk)
+        if head is not None:
+            assert md_new_logic.lead_field_errors(head, *args) == md_new_logic.lead_field_errors(html, *args), html
+    assert early > 150
+
+def test_whole_page_when_not_decided_and_each_piece_checked_once():
+    html = '<span>Case Number:</span></td><td><span class="Value">A1</span>' + "y" * 200000
+    fed = []
+
+    def new_check():
+        check = md_logic.html_head_check()
+        return lambda piece: fed.append(len(piece)) or check(piece)
+
+    assert gzip_head.inflate_head(_b64(html), new_check, chunk=1024) == html
+    assert sum(fed) == len(html)
+
+def test_bad_trailer_or_extra_member_falls_back():
+    html = "<p>DATA NOT FOUND</p>" + "z" * 5000
+    raw = bytearray(gzip.compress(html.encode()))
+    raw[-8] ^= 1   # hỏng CRC
+    assert gzip_head.inflate_head(base64.b64encode(bytes(raw)).decode(), md_logic.html_head_check) is None
+    assert gzip_head.inflate_head(_b64(html)[:-12], md_logic.html_head_check) is None
+    assert gzip_head.inflate_head(_b64(html, gzip.compress(b"x")), md_logic.html_head_check) is None
+
+def test_shared_heads_stop_when_all_checkers_done():
+    html = ('<input name="caseId" value="k1"> DATA NOT FOUND <input name="firstName" value="ANN">'
+            '<input name="lastName" value="SMITH"><input name="filingStart" value="01/02/2020">'
+            '<input name="filingEnd" value="01/03/2020">' + "q" * 200000)
+    b64 = _b64(html)
+    heads = [(md_logic.html_head_check, False), (md_new_logic.html_head_check, True)]
+    with gzip_head.shared_heads(heads):
+        head = gzip_head.inflate_head(b64, md_logic.html_head_check, chunk=1024)
+        assert len(head) < len(html)
+        assert gzip_head.inflate_head(b64, md_new_logic.html_head_check, ascii_only=True) is head
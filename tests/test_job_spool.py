@@ -0,0 +1,158 @@
+# Spool dùng chung: 2 worker trên 1 thư mục tạm, worker A treo -> lease bị lấy lại -> worker B chạy job
+import io
+import os
+import sys
+import glob
+import time
+import uuid
+import signal
+import zipfile
+import threading
+import subprocess
+import http.server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import job_spool
+
+def _expire(monkeypatch):
+    """Cho lease quá hạn ngay (thay vì chờ SPOOL_LEASE_S giây)."""
+    monkeypatch.setattr(job_spool, "SPOOL_LEASE_S", 0)
+    time.sleep(0.01)
+
+def _reclaimed_by_b(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_spool, "SPOOL_LEASE_S", 60)
+    spool = job_spool.Spool(str(tmp_path))
+    spool.submit("j1", "md path=/x")
+    a = spool.claim("A")
+    _expire(monkeypatch)
+    assert spool.reclaim_expired() == 1
+    monkeypatch.setattr(job_spool, "SPOOL_LEASE_S", 60)
+    b = spool.claim("B")
+    assert b["job_id"] == "j1" and b["attempts"] == 2 and b["lease"] != a["lease"]
+    return spool, a, b
+
+def test_stale_worker_cannot_renew_or_finish(tmp_path, monkeypatch):
+    spool, a, b = _reclaimed_by_b(tmp_path, monkeypatch)
+    assert not spool.heartbeat("j1", a["lease"])
+    assert spool.heartbeat("j1", b["lease"])
+    spool.set_state("j1", a["lease"], {"status": "running", "worker": "A"})
+    assert not os.path.exists(tmp_path / "state" / "j1.json")
+
+    assert not spool.finish("j1", a["lease"], {"status": "done", "result": "A"})
+    assert os.path.exists(tmp_path / "leases" / "j1.json")   # lease của B còn nguyên
+    assert spool.job("j1")["worker"] == "B"
+
+    assert spool.finish("j1", b["lease"], {"status": "done", "result": "B"})
+    assert spool.job("j1")["result"] == "B"
+    assert os.listdir(tmp_path / "leases") == []
+
+def test_stale_finish_after_owner_done(tmp_path, monkeypatch):
+    spool, a, b = _reclaimed_by_b(tmp_path, monkeypatch)
+    assert spool.finish("j1", b["lease"], {"status": "done", "result": "B"})
+    assert not spool.finish("j1", a["lease"], {"status": "done", "result": "A"})
+    assert spool.job("j1")["result"] == "B"
+
+def test_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_spool, "SPOOL_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(job_spool, "SPOOL_LEASE_S", 60)
+    spool = job_spool.Spool(str(tmp_path))
+    spool.submit("j1", "md path=/x")
+    assert spool.claim("A") is not None
+    _expire(monkeypatch)
+    spool.reclaim_expired()
+    monkeypatch.setattr(job_spool, "SPOOL_LEASE_S", 60)
+    assert spool.claim("B") is None
+    assert spool.job("j1")["status"] == "error"
+
+def test_cancel_pending(tmp_path):
+    spool = job_spool.Spool(str(tmp_path))
+    spool.submit("j1", "md path=/x")
+    assert spool.cancel("j1")["status"] == "queued"
+    assert spool.job("j1")["status"] == "cancelled"
+    assert spool.claim("A") is None
+    assert os.listdir(tmp_path / "leases") == []
+
+# ===== 2 process spool_worker thật =====
+def _md_zip() -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("Test/MD_A.xml", '<LeadList xmlns="http://risk.regn.net/LeadList">'
+                                     '<Lead ID="l1" CaseKey="K1"></Lead></LeadList>')
+        zf.writestr("Test/MD_A_content.txt", "l1|meta|khonghople\n")
+    return buf.getvalue()
+
+def _gated_server(body: bytes):
+    """Server ZIP chỉ trả dữ liệu sau gate.set() -> job nằm ở bước tải cho tới lúc test cho đi tiếp."""
+    gate = threading.Event()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            gate.wait(60)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, gate
+
+def _worker(spool_dir, worker_id, env):
+    return subprocess.Popen([sys.executable, "-m", "spool_worker", "--spool", str(spool_dir), "--slots", "1",
+                             "--worker-id", worker_id, "--poll", "0.1"],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def _wait(cond, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+def test_stopped_worker_job_finished_by_other(tmp_path):
+    """
+    A nhận job rồi bị SIGSTOP giữa lúc tải -> lease hết hạn, B lấy lại và chạy. A chạy tiếp thì thấy mất
+    lease, tự hủy lượt của mình (không hủy nhầm lượt của B), kết quả của A bị bỏ. SIGTERM: cả 2 thoát sạch.
+    """
+    srv, gate = _gated_server(_md_zip())
+    spool_dir = tmp_path / "spool"
+    spool = job_spool.Spool(str(spool_dir))
+    job_id = uuid.uuid4().hex
+    spool.submit(job_id, f"md url=http://127.0.0.1:{srv.server_port}/{job_id}.zip")
+    env = {k: v for k, v in os.environ.items() if k not in ("SPOOL_DIR", "EXECUTOR_SOCKET")}
+    env.update(SPOOL_LEASE_S="3", SPOOL_HEARTBEAT_S="0.5", WORKERS="1", DISK_LEDGER=str(tmp_path / "ledger.json"))
+    a = _worker(spool_dir, "A", env)
+    workers = [a]
+    try:
+        _wait(lambda: (spool.job(job_id) or {}).get("worker") == "A")
+        lease_a = job_spool._read_json(str(spool_dir / "leases" / f"{job_id}.json"))["lease"]
+        a.send_signal(signal.SIGSTOP)
+        workers.append(_worker(spool_dir, "B", env))
+        _wait(lambda: (spool.job(job_id) or {}).get("worker") == "B")
+
+        a.send_signal(signal.SIGCONT)
+        # cờ hủy local của lượt A (UPLOAD_DIR của app), đặt khi heartbeat thấy lease đã thuộc B
+        _wait(lambda: glob.glob(f"/tmp/uploads/cancel_{job_id}.{lease_a}.flag"), timeout=20)
+        gate.set()
+        _wait(lambda: spool.job(job_id)["status"] not in ("preparing", "queued", "running"))
+        job = spool.job(job_id)
+        assert job["status"] == "done", job
+        assert spool.job(job_id)["result"]["module"] == "md_logic"
+
+        for w in workers:
+            w.send_signal(signal.SIGTERM)
+        assert [w.wait(30) for w in workers] == [0, 0]
+        assert os.listdir(spool_dir / "workers") == []
+        assert os.listdir(spool_dir / "leases") == []
+    finally:
+        gate.set()
+        for w in workers:
+            if w.poll() is None:
+                w.send_signal(signal.SIGCONT)
+                w.kill()
+                w.wait()
+        srv.shutdown()
@@ -0,0 +1,48 @@
+# expected_pages_from_html phải cho cùng kết quả với cách cũ (BeautifulSoup + soup.find(string=...))
+import os
+import re
+import sys
+import math
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mi_logic
+
+bs4 = pytest.importorskip("bs4")
+
+def _old_pages(h):
+    soup = bs4.BeautifulSoup(h, "html.parser")
+    el = soup.find(string=re.compile(r"Total Record Count:\s*\d+"))
+    if el and (m := re.search(r"(\d+)", el.strip())):
+        t = int(m.group(1))
+        return math.ceil(t / 10) if t > 0 else 0
+    return 0
+
+@pytest.mark.parametrize("h, pages", [
+    ('<p title="Total Record Count: 9">Total Record Count: 15</p>', 2),
+    ("<!-- Total Record Count: 25 -->", 3),
+    ("<!-- Total Record Count: 25 --><p>Total Record Count: 5</p>", 3),
+    ("<p>Page 3 Total Record Count: 40</p>", 1),
+    ("<p>Total Record Count:&nbsp;31</p>", 4),
+    ("<script>var s = 'Total Record Count: 11';</script>", 2),
+    ("<![CDATA[Total Record Count: 21]]>", 3),
+    ('<a href="?Total Record Count: 50">x</a>', 0),
+    ("<p>Total Record Count: 0</p>", 0),
+    ("<p>Total Record Count</p>", 0),
+    ("", 0),
+])
+def test_known_cases(h, pages):
+    assert _old_pages(h) == pages
+    assert mi_logic.expected_pages_from_html(h) == pages
+
+def test_fuzz_against_bs4():
+    rnd = random.Random(40)
+    frags = ["<div>", "</div>", "<span class='x'>", "</span>", "Total Record Count: ", "Total Record Count:",
+             "Total Record Count:&nbsp;", "12", "0", "35", " ", "Page 3 ", "&amp;", "<b>", "</b>", "abc", "\n",
+             "Total Record Count", '<p title="Total Record Count: 9">', "<!-- ", " -->", "<!-- Total Record Count: 25 -->",
+             '<a href="?n=Total Record Count: 7">', "</a>", "<br/>", "<script>", "</script>", " < ", "&#84;otal"]
+    for _ in range(3000):
+        h = "<html><body>" + "".join(rnd.choice(frags) for _ in range(rnd.randint(0, 14))) + "</body></html>"
+        assert mi_logic.expected_pages_from_html(h) == _old_pages(h), h
@@ -0,0 +1,42 @@
+# Fair queuing giữa các client: thứ tự nhận job giữ nguyên, dict thời điểm ảo không lớn theo số client
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scheduler
+
+def test_client_finish_pruned_for_many_one_off_clients():
+    sched = scheduler.LaneScheduler(1, {"light": 1}, default_bytes_per_sec=1)
+    for i in range(1000):
+        with sched.slot("light", 1, job_id=f"j{i}", client=f"browser-{i}"):
+            pass
+    assert sched._client_finish == {}
+
+def _enqueue(sched, jobs):
+    for job_id, client in jobs:
+        sched._lanes["light"].queue.append(scheduler._Ticket("light", 1, 1.0, job_id, client, "interactive"))
+
+def _admit_in_turn(sched, n):
+    """Nhận lần lượt n job (1 slot, job trước xong ngay thì nhận job sau) -> job_id theo thứ tự nhận."""
+    admitted = []
+    with sched._cond:
+        for _ in range(n):
+            sched._dispatch()
+            (t,) = sched._active
+            admitted.append(t.job_id)
+            sched._active.clear()
+            sched._lanes["light"].running = sched.running = 0
+            sched._client_running.clear()
+    return admitted
+
+def test_client_finish_pruned_while_busy():
+    sched = scheduler.LaneScheduler(1, {"light": 1}, default_bytes_per_sec=1)
+    _enqueue(sched, [(f"a{i}", "a") for i in range(20)] + [(f"j{i}", f"browser-{i}") for i in range(200)])
+    admitted = _admit_in_turn(sched, 210)
+    assert admitted[:4] == ["a0", "j0", "j1", "j2"]
+    assert len(sched._client_finish) <= 2
+
+def test_fair_share_order_unchanged():
+    sched = scheduler.LaneScheduler(1, {"light": 1}, default_bytes_per_sec=1)
+    _enqueue(sched, [("a0", "a"), ("a1", "a"), ("a2", "a"), ("b0", "b"), ("c0", "c")])
+    assert _admit_in_turn(sched, 5) == ["a0", "b0", "c0", "a1", "a2"]
@@ -0,0 +1,62 @@
+# Xoá dòng theo ID: đúng nội dung, và lỗi giữa chừng không làm hỏng *_content.txt
+import os
+import sys
+import errno
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import txt_index
+
+def _content(tmp_path, n=2000, seed=36):
+    rnd = random.Random(seed)
+    lines = [f"ID{i % 700}|meta|{'x' * rnd.randint(0, 300)}\n".encode() for i in range(n)]
+    path = tmp_path / "A_content.txt"
+    path.write_bytes(b"".join(lines))
+    return str(path), lines
+
+@pytest.mark.parametrize("kernel_copy", [True, False])
+def test_delete_matches_line_filter(tmp_path, monkeypatch, kernel_copy):
+    if not kernel_copy:
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+        monkeypatch.setattr(os, "sendfile", _raise(errno.ENOSYS))
+    path, lines = _content(tmp_path)
+    os.chmod(path, 0o640)
+    txt_index.load_index(path)
+    ids = {"id0", "ID5", "id699", "nope"}
+    rep = txt_index.delete_ids(path, ids)
+    kept = [ln for ln in lines if ln.split(b"|")[0].decode().lower() not in {"id0", "id5", "id699"}]
+    assert rep["removed"] == len(lines) - len(kept) and rep["touched"]
+    assert open(path, "rb").read() == b"".join(kept)
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    idx = txt_index._load_sidecar(path, os.stat(path))  # sidecar khớp file mới, không phải quét lại
+    with open(path, "rb") as f:
+        assert {k: idx[k] for k in ("ids", "lines")} == txt_index._scan(f)
+    assert not os.path.exists(path + ".tmp")
+
+def _raise(code):
+    def fail(*args):
+        raise OSError(code, os.strerror(code))
+    return fail
+
+def test_failure_mid_copy_keeps_original(tmp_path, monkeypatch):
+    path, lines = _content(tmp_path)
+    before = open(path, "rb").read()
+    txt_index.load_index(path)
+    calls = {"n": 0}
+    real = txt_index._copy_span
+
+    def flaky(*args):
+        calls["n"] += 1
+        if calls["n"] == 3:
+            raise OSError(errno.EIO, "I/O error")
+        real(*args)
+
+    monkeypatch.setattr(txt_index, "_copy_span", flaky)
+    rep = txt_index.delete_ids(path, {"ID1", "ID2", "ID3"})
+    assert "error" in rep
+    assert open(path, "rb").read() == before
+    assert not os.path.exists(path + ".tmp")
+    monkeypatch.setattr(txt_index, "_copy_span", real)
+    assert txt_index.count_hits(path, {"ID1"}) == 3  # chỉ mục cũ vẫn dùng được
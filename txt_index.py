@@ -0,0 +1,207 @@
+# txt_index.py — chỉ mục UUID -> vị trí byte của từng dòng trong *_content.txt (file sidecar)
+# Xoá dòng lỗi theo ID: tra chỉ mục để biết file nào có dòng cần xoá và ở offset nào,
+# chỉ ghi lại file có hit: chép các đoạn giữ lại sang file .tmp bằng copy_file_range/sendfile
+# (kernel chép thẳng, không qua bộ nhớ Python, không tách dòng), fsync rồi os.replace
+# -> bị kill / lỗi I/O giữa chừng thì file gốc còn nguyên; file không có hit thì không bị động tới.
+import os
+import json
+import errno
+import fcntl
+
+SIDECAR_SUFFIX = ".uuidx"   # X_content.txt -> X_content.txt.uuidx (checker chỉ lấy *_content.txt)
+COPY_BUF = 1 << 20          # 1MB mỗi lần copy khi không dùng được copy_file_range/sendfile
+INDEX_VERSION = 1
+
+def sidecar_path(path: str) -> str:
+    return path + SIDECAR_SUFFIX
+
+def _line_uuid(line: bytes) -> str:
+    """UUID = trường đầu của dòng `uuid|meta|payload` (so khớp không phân biệt hoa thường)."""
+    return line.split(b"|", 1)[0].strip().decode("utf-8", "ignore").lower()
+
+def _scan(f) -> dict:
+    """Đọc tuần tự 1 lần: {uuid: [[offset, length], ...]} + tổng số dòng."""
+    f.seek(0)
+    ids, off, lines = {}, 0, 0
+    for line in f:
+        uid = _line_uuid(line)
+        if uid:
+            ids.setdefault(uid, []).append([off, len(line)])
+        off += len(line)
+        lines += 1
+    return {"ids": ids, "lines": lines}
+
+def _stamp(st) -> dict:
+    return {"v": INDEX_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _load_sidecar(path: str, st):
+    try:
+        with open(sidecar_path(path), "r", encoding="utf-8") as f:
+            idx = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if any(idx.get(k) != v for k, v in _stamp(st).items()):
+        return None  # file đã đổi (giải nén lại, sửa tay...) -> chỉ mục cũ không còn đúng
+    return idx
+
+def _save_sidecar(path: str, st, idx: dict):
+    """Ghi chỉ mục (best-effort: hỏng/không ghi được thì lần sau quét lại)."""
+    data = {**_stamp(st), "ids": idx["ids"], "lines": idx["lines"]}
+    tmp = sidecar_path(path) + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, sidecar_path(path))
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+def _index_locked(f, path: str) -> dict:
+    st = os.fstat(f.fileno())
+    idx = _load_sidecar(path, st)
+    if idx is None:
+        idx = _scan(f)
+        _save_sidecar(path, st, idx)
+    return idx
+
+def _open_locked(path: str, lock: int):
+    """Mở + flock file hiện tại của path (bị os.replace thay trong lúc chờ khoá thì mở lại file mới)."""
+    while True:
+        f = open(path, "rb")
+        fcntl.flock(f, lock)
+        try:
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+def load_index(path: str) -> dict:
+    """Chỉ mục của file (đọc sidecar nếu còn khớp size/mtime, không thì quét và ghi lại)."""
+    with _open_locked(path, fcntl.LOCK_SH) as f:
+        try:
+            return _index_locked(f, path)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def count_hits(path: str, ids) -> int:
+    """Số dòng sẽ bị xoá nếu gọi delete_ids (dùng cho dry-run; tạo sẵn sidecar cho lần xoá thật)."""
+    wanted = {str(i).strip().lower() for i in ids if str(i).strip()}
+    idx = load_index(path)
+    return sum(len(idx["ids"][uid]) for uid in wanted & idx["ids"].keys())
+
+_KERNEL_COPY_ERRNOS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+def _copy_span(src, dst, off: int, n: int):
+    """Chép n byte của src từ offset off vào dst (tại vị trí hiện tại): copy_file_range -> sendfile -> buffer."""
+    sfd, dfd = src.fileno(), dst.fileno()
+    for copy in (getattr(os, "copy_file_range", None), os.sendfile):
+        if copy is None:
+            continue
+        try:
+            while n > 0:
+                if copy is os.sendfile:
+                    done = os.sendfile(dfd, sfd, off, n)
+                else:
+                    done = copy(sfd, dfd, n, off)
+                if not done:
+                    raise OSError(errno.EIO, "file nguồn ngắn hơn chỉ mục")
+                off += done
+                n -= done
+            return
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_ERRNOS:
+                raise  # chép được 1 phần rồi lỗi thật: bỏ cả file .tmp
+    buf = bytearray(COPY_BUF)
+    view = memoryview(buf)
+    while n > 0:
+        src.seek(off)
+        got = src.readinto(view[:min(COPY_BUF, n)])
+        if not got:
+            raise OSError(errno.EIO, "file nguồn ngắn hơn chỉ mục")
+        os.write(dfd, view[:got])  # dst mở không buffer
+        off += got
+        n -= got
+
+def _compact(f, path: str, spans: list):
+    """
+    Ghi bản không có các đoạn [offset, length] (đã sort, không chồng nhau) ra path + '.tmp', fsync rồi
+    os.replace lên path. Lỗi giữa chừng thì xoá .tmp, file gốc không đổi. Trả về stat của file mới.
+    """
+    st = os.fstat(f.fileno())
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb", buffering=0) as out:
+            os.fchmod(out.fileno(), st.st_mode & 0o7777)
+            r = 0
+            for off, n in spans + [[st.st_size, 0]]:
+                if off > r:
+                    _copy_span(f, out, r, off - r)
+                r = off + n
+            os.fsync(out.fileno())
+            new_st = os.fstat(out.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    try:
+        dfd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(dfd)
+        finally:
+            os.close(dfd)
+    except OSError:
+        pass
+    return new_st
+
+def _shift_index(idx: dict, spans: list, removed_ids: set) -> dict:
+    """Cập nhật offset sau khi xoá (không phải quét lại file)."""
+    starts = [s[0] for s in spans]
+    cum, acc = [], 0
+    for s in spans:
+        acc += s[1]
+        cum.append(acc)
+
+    def _new_off(off):
+        # số byte bị xoá nằm trước `off` = tổng length của các đoạn có start < off
+        lo, hi = 0, len(starts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if starts[mid] < off:
+                lo = mid + 1
+            else:
+                hi = mid
+        return off - (cum[lo - 1] if lo else 0)
+
+    ids = {uid: [[_new_off(o), n] for o, n in locs]
+           for uid, locs in idx["ids"].items() if uid not in removed_ids}
+    return {"ids": ids, "lines": idx["lines"] - len(spans)}
+
+def delete_ids(path: str, ids) -> dict:
+    """
+    Xoá mọi dòng có UUID thuộc `ids`. Trả {file, removed, kept, touched}; touched=False nghĩa là
+    file không có dòng nào cần xoá nên không bị ghi lại.
+    """
+    wanted = {str(i).strip().lower() for i in ids if str(i).strip()}
+    name = os.path.basename(path)
+    try:
+        with _open_locked(path, fcntl.LOCK_EX) as f:
+            try:
+                idx = _index_locked(f, path)
+                hit_ids = wanted & idx["ids"].keys()
+                spans = sorted(loc for uid in hit_ids for loc in idx["ids"][uid])
+                if not spans:
+                    return {"file": name, "removed": 0, "kept": idx["lines"], "touched": False}
+                new_st = _compact(f, path, spans)
+                idx = _shift_index(idx, spans, hit_ids)
+                _save_sidecar(path, new_st, idx)
+                return {"file": name, "removed": len(spans), "kept": idx["lines"], "touched": True}
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    except Exception as e:
+        return {"file": name, "error": f"{type(e).__name__}: {e}"}
@@ -0,0 +1,53 @@
+# validation_memo.py — nhớ kết quả validate theo nội dung trang (LRU trong process)
+# Bundle lớn có rất nhiều trang giống hệt nhau từng byte ("No matches found", "DATA NOT FOUND",
+# trang load lại...). Phần validate chỉ phụ thuộc HTML + vài field XML thì tính 1 lần cho mỗi
+# (validator, digest HTML, field XML) rồi dùng lại -> trang lặp lại không phải dựng DOM nữa.
+# Kết quả nhớ không chứa lead ID (ID gắn vào sau ở checker) và phải coi là chỉ đọc.
+# Worker sống lâu (WorkerPool) nên chạy lại / re-check trên cùng bundle cũng trúng cache.
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+MEMO_SIZE = int(os.environ.get("VALIDATION_MEMO_SIZE", "4096"))  # 0: tắt
+
+_memo = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+def digest(html_content):
+    """Digest nội dung trang (None giữ nguyên None: validator có nhánh riêng cho trang rỗng)."""
+    if html_content is None:
+        return None
+    return hashlib.blake2b(html_content.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+def memoized(validator: str, html_content, fields, compute):
+    """
+    Kết quả compute() cho (validator, HTML, fields); fields = tuple các giá trị XML mà validator đọc.
+    compute() phải chỉ phụ thuộc html_content + fields (không đọc lead ID, không có side effect).
+    """
+    if MEMO_SIZE <= 0:
+        return compute()
+    key = (validator, digest(html_content), fields)
+    with _lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            _stats["hits"] += 1
+            return _memo[key]
+        _stats["misses"] += 1
+    value = compute()
+    with _lock:
+        _memo[key] = value
+        _memo.move_to_end(key)
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return value
+
+def stats() -> dict:
+    with _lock:
+        return {**_stats, "size": len(_memo), "max": MEMO_SIZE}
+
+def clear():
+    with _lock:
+        _memo.clear()
+        _stats.update(hits=0, misses=0)
@@ -0,0 +1,203 @@
+# worker_pool.py — pool process tự quản: mỗi worker là 1 Process riêng nối bằng Pipe,
+# nên có thể kill đúng worker đang kẹt rồi tạo lại (ProcessPoolExecutor không làm được:
+# kill 1 worker là hỏng cả pool). Job quá hạn/bị hủy được báo dừng trước (cooperative),
+# quá thời gian ân hạn mới kill.
+import os
+import time
+import threading
+import multiprocessing
+
+class JobKilled(Exception):
+    """Worker không tự dừng trong thời gian ân hạn -> đã bị kill (không có kết quả)."""
+
+class WorkerCrashed(Exception):
+    """Worker chết giữa chừng (segfault, OOM killer...)."""
+
+class FileCancelToken:
+    """
+    Cờ hủy dùng được giữa các process: job bị hủy khi file `path` tồn tại.
+    Gọi token() trong vòng lặp kiểm tra; stat file tối đa 1 lần / `interval` giây.
+    """
+    def __init__(self, path: str, interval: float = 0.5):
+        self.path = path
+        self.interval = interval
+        self.fired = False
+        self._next = 0.0
+
+    def __call__(self) -> bool:
+        if self.fired:
+            return True
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.fired = os.path.exists(self.path)
+        return self.fired
+
+def _worker_main(conn, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        fn, args, kwargs = msg
+        try:
+            out = (True, fn(*args, **kwargs))
+        except BaseException as e:
+            out = (False, e)
+        try:
+            conn.send(out)
+        except Exception as e:  # kết quả / exception không pickle được
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+class _Worker:
+    def __init__(self, ctx, initializer, initargs):
+        parent, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child, initializer, initargs), daemon=True)
+        self.proc.start()
+        child.close()  # chỉ worker giữ đầu child -> worker chết thì bên này nhận EOF
+        self.conn = parent
+        self.tasks = 0
+        self.started = time.time()
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    def kill(self):
+        try:
+            self.proc.kill()
+        except Exception:
+            pass
+        self.proc.join(timeout=5)
+        self.conn.close()
+
+    def retire(self):
+        """Dừng nhẹ nhàng (recycle): báo thoát rồi join ở thread nền."""
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+
+        def _join():
+            self.proc.join(timeout=30)
+            if self.proc.is_alive():
+                self.proc.kill()
+                self.proc.join(timeout=5)
+            self.conn.close()
+        threading.Thread(target=_join, daemon=True).start()
+
+class WorkerPool:
+    """
+    size: số worker; initializer chạy 1 lần khi mỗi worker khởi động (kể cả worker tạo lại).
+    max_tasks_per_child > 0: worker chạy đủ N job thì được thay mới (chặn RAM phình).
+    kill_grace: số giây chờ worker tự dừng sau khi báo dừng, quá hạn thì kill.
+    """
+    def __init__(self, size: int, mp_context=None, initializer=None, initargs=(),
+                 max_tasks_per_child: int = 0, kill_grace: float = 10.0):
+        self.size = size
+        self.max_tasks_per_child = max_tasks_per_child
+        self.kill_grace = kill_grace
+        self._ctx = mp_context or multiprocessing.get_context()
+        self._init = (initializer, initargs)
+        self._cond = threading.Condition()
+        self._idle = [self._spawn() for _ in range(size)]
+        self._busy = {}
+        self.stats = {"completed": 0, "killed": 0, "crashed": 0, "recycled": 0}
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._ctx, *self._init)
+
+    def _acquire(self) -> _Worker:
+        with self._cond:
+            while not self._idle:
+                self._cond.wait()
+            w = self._idle.pop()
+            self._busy[w.pid] = w
+            return w
+
+    def _release(self, w: _Worker, replace: bool = False):
+        new = self._spawn() if replace else w
+        with self._cond:
+            self._busy.pop(w.pid, None)
+            self._idle.append(new)
+            self._cond.notify()
+
+    def run(self, fn, *args, timeout: float = None, cancelled=None, on_stop=None, **kwargs):
+        """
+        Chạy fn(*args, **kwargs) trong 1 worker, trả kết quả (exception của fn được raise lại).
+        Khi quá `timeout` hoặc cancelled() trả True: gọi on_stop(lý_do) ("timeout"/"cancel") để
+        job tự dừng và trả kết quả dở dang; sau kill_grace giây vẫn chưa xong -> kill worker,
+        tạo worker mới, raise JobKilled(lý_do).
+        """
+        w = self._acquire()
+        try:
+            w.conn.send((fn, args, kwargs))
+        except Exception:
+            w.kill()
+            self._release(w, replace=True)
+            raise
+        deadline = time.monotonic() + timeout if timeout else None
+        stop_at, reason = None, None
+        while True:
+            try:
+                if w.conn.poll(0.25):
+                    ok, value = w.conn.recv()
+                    break
+            except (EOFError, OSError):
+                w.kill()
+                self._release(w, replace=True)
+                self.stats["crashed"] += 1
+                raise WorkerCrashed(f"Worker {w.pid} đã dừng đột ngột")
+            if not w.proc.is_alive() and not w.conn.poll(0):
+                w.kill()
+                self._release(w, replace=True)
+                self.stats["crashed"] += 1
+                raise WorkerCrashed(f"Worker {w.pid} đã dừng đột ngột (exitcode={w.proc.exitcode})")
+            now = time.monotonic()
+            if stop_at is None:
+                if deadline is not None and now >= deadline:
+                    reason = "timeout"
+                elif cancelled is not None and cancelled():
+                    reason = "cancel"
+                if reason:
+                    stop_at = now
+                    if on_stop:
+                        on_stop(reason)
+            elif now - stop_at >= self.kill_grace:
+                w.kill()
+                self._release(w, replace=True)
+                self.stats["killed"] += 1
+                raise JobKilled(reason)
+
+        w.tasks += 1
+        self.stats["completed"] += 1
+        if self.max_tasks_per_child and w.tasks >= self.max_tasks_per_child:
+            w.retire()
+            self.stats["recycled"] += 1
+            self._release(w, replace=True)
+        else:
+            self._release(w)
+        if not ok:
+            raise value
+        return value
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "busy": len(self._busy),
+                "pids": [w.pid for w in self._idle] + list(self._busy),
+                **self.stats,
+            }
+
+    def shutdown(self):
+        with self._cond:
+            workers = self._idle + list(self._busy.values())
+            self._idle, self._busy = [], {}
+        for w in workers:
+            w.kill()
@@ -0,0 +1,288 @@
+# zip_inspect.py — phân tích ZIP chỉ bằng End-of-Central-Directory + Central Directory
+# (đọc theo khoảng byte: file local, HTTP Range, S3 Range) -> không tải/không nạp cả ZIP vào RAM.
+import os
+import re
+import struct
+import time
+from collections import defaultdict
+
+EOCD_SIG = b"PK\x05\x06"
+EOCD64_SIG = b"PK\x06\x06"
+EOCD64_LOC_SIG = b"PK\x06\x07"
+CDIR_SIG = b"PK\x01\x02"
+
+EOCD_SIZE = 22
+EOCD64_LOC_SIZE = 20
+EOCD64_SIZE = 56
+CDIR_SIZE = 46
+MAX_COMMENT = 0xFFFF
+FIRST_TAIL = 4096  # lần đọc đầu: đủ cho EOCD + thường là cả central directory của bundle nhỏ
+
+class RangeNotSupported(Exception):
+    """Nguồn không hỗ trợ đọc theo khoảng byte (server trả 200 thay vì 206...)."""
+
+# ================== Range readers ==================
+# Mỗi reader có: tail(n) -> (bytes, offset_bắt_đầu), read(offset, n) -> bytes, size, io_bytes
+class LocalRangeReader:
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.io_bytes = 0
+
+    def read(self, offset: int, n: int) -> bytes:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(n)
+        self.io_bytes += len(data)
+        return data
+
+    def tail(self, n: int):
+        start = max(0, self.size - n)
+        return self.read(start, self.size - start), start
+
+def _parse_content_range(value: str):
+    m = re.match(r"bytes\s+(\d+)-(\d+)/(\d+)", value or "")
+    if not m:
+        return None
+    return int(m.group(1)), int(m.group(3))
+
+class HttpRangeReader:
+    """
+    HTTP Range. `opener(session, url, headers)` dùng cho request đầu (vd. vượt trang confirm
+    của Google Drive); các request sau gọi thẳng URL cuối cùng sau redirect.
+    """
+    def __init__(self, session, url: str, opener=None, timeout=(30, 120)):
+        self.session = session
+        self.url = url
+        self.size = None
+        self.io_bytes = 0
+        self.timeout = timeout
+        self._opener = opener
+
+    def _get(self, range_value: str, limit: int):
+        headers = {"Range": range_value}
+        if self.size is None and self._opener:
+            r = self._opener(self.session, self.url, headers)
+        else:
+            r = self.session.get(self.url, headers=headers, stream=True,
+                                 allow_redirects=True, timeout=self.timeout)
+        try:
+            if r.status_code == 206:
+                cr = _parse_content_range(r.headers.get("Content-Range"))
+                if not cr:
+                    raise RangeNotSupported("Thiếu/không đọc được header Content-Range")
+                start, total = cr
+                data = r.content
+            elif r.status_code == 200:
+                # Server bỏ qua Range: chỉ chấp nhận nếu cả file nhỏ hơn phần cần đọc
+                data = r.raw.read(limit + 1, decode_content=True)
+                if len(data) > limit:
+                    raise RangeNotSupported("Server không hỗ trợ HTTP Range")
+                start, total = 0, len(data)
+            else:
+                r.raise_for_status()
+                raise RangeNotSupported(f"HTTP {r.status_code}")
+            if self.size is None:
+                self.url = r.url or self.url
+                self.size = total
+            self.io_bytes += len(data)
+            return data, start
+        finally:
+            r.close()
+
+    def read(self, offset: int, n: int) -> bytes:
+        return self._get(f"bytes={offset}-{offset + n - 1}", n)[0]
+
+    def tail(self, n: int):
+        return self._get(f"bytes=-{n}", n)
+
+class S3RangeReader:
+    def __init__(self, client, bucket: str, key: str):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = None
+        self.io_bytes = 0
+
+    def _get(self, range_value: str):
+        obj = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=range_value)
+        data = obj["Body"].read()
+        cr = _parse_content_range(obj.get("ContentRange"))
+        start, total = cr if cr else (0, len(data))
+        if self.size is None:
+            self.size = total
+        self.io_bytes += len(data)
+        return data, start
+
+    def read(self, offset: int, n: int) -> bytes:
+        return self._get(f"bytes={offset}-{offset + n - 1}")[0]
+
+    def tail(self, n: int):
+        return self._get(f"bytes=-{n}")
+
+# ================== Central directory ==================
+class _Window:
+    """Giữ đoạn byte đã đọc ở cuối file, chỉ đọc thêm khi cần phần trước đó."""
+    def __init__(self, reader, data: bytes, start: int):
+        self.reader, self.data, self.start = reader, data, start
+
+    def get(self, offset: int, n: int) -> bytes:
+        if offset >= self.start and offset + n <= self.start + len(self.data):
+            i = offset - self.start
+            return self.data[i:i + n]
+        if offset < self.start and offset + n >= self.start:
+            # nối thêm phần thiếu phía trước vào cửa sổ
+            self.data = self.reader.read(offset, self.start - offset) + self.data
+            self.start = offset
+            return self.data[:n]
+        return self.reader.read(offset, n)
+
+def _find_eocd(reader):
+    data, start = reader.tail(FIRST_TAIL)
+    pos = data.rfind(EOCD_SIG)
+    if pos < 0 or len(data) - pos < EOCD_SIZE:
+        size = reader.size or (start + len(data))
+        want = min(size, EOCD_SIZE + MAX_COMMENT)
+        if want > len(data):
+            extra_start = size - want
+            data = reader.read(extra_start, start - extra_start) + data
+            start = extra_start
+        pos = data.rfind(EOCD_SIG)
+        if pos < 0:
+            raise ValueError("Không tìm thấy End-of-Central-Directory (không phải ZIP?)")
+    return _Window(reader, data, start), start + pos
+
+def read_central_directory(reader) -> dict:
+    """Trả {entries: [...], zip64: bool}; mỗi entry: name, compressed_size, file_size, crc, method, is_dir."""
+    win, eocd_pos = _find_eocd(reader)
+    (_, _, _, _, total_entries, cd_size, cd_offset, _) = struct.unpack(
+        "<4sHHHHIIH", win.get(eocd_pos, EOCD_SIZE))
+    zip64 = False
+    cd_end = eocd_pos
+    if total_entries == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        loc_pos = eocd_pos - EOCD64_LOC_SIZE
+        loc = win.get(loc_pos, EOCD64_LOC_SIZE) if loc_pos >= 0 else b""
+        if loc[:4] == EOCD64_LOC_SIG:
+            # EOCD64 nằm ngay trước locator (giống zipfile._EndRecData64)
+            eocd64_pos = loc_pos - EOCD64_SIZE
+            rec = win.get(eocd64_pos, EOCD64_SIZE)
+            if rec[:4] != EOCD64_SIG:
+                raise ValueError("ZIP64 EOCD hỏng")
+            (_, _, _, _, _, _, _, total_entries, cd_size, cd_offset) = struct.unpack("<4sQHHIIQQQQ", rec)
+            zip64 = True
+            cd_end = eocd64_pos
+    # Tính vị trí CD từ cuối (chịu được dữ liệu thừa ở đầu file, vd. SFX)
+    cd_start = cd_end - cd_size
+    if cd_start < 0:
+        cd_start = cd_offset
+    raw = win.get(cd_start, cd_size)
+
+    entries = []
+    p = 0
+    while p + CDIR_SIZE <= len(raw) and raw[p:p + 4] == CDIR_SIG:
+        (_, _, _, flags, method, _, _, crc, csize, usize, n_len, e_len, c_len,
+         _, _, _, _) = struct.unpack("<4sHHHHHHIIIHHHHHII", raw[p:p + CDIR_SIZE])
+        name_b = raw[p + CDIR_SIZE:p + CDIR_SIZE + n_len]
+        extra = raw[p + CDIR_SIZE + n_len:p + CDIR_SIZE + n_len + e_len]
+        name = name_b.decode("utf-8" if flags & 0x800 else "cp437", errors="replace")
+        if usize == 0xFFFFFFFF or csize == 0xFFFFFFFF:
+            usize, csize = _zip64_sizes(extra, usize, csize)
+        entries.append({
+            "name": name, "file_size": usize, "compressed_size": csize,
+            "crc": crc, "method": method, "is_dir": name.endswith("/"),
+        })
+        p += CDIR_SIZE + n_len + e_len + c_len
+    if len(entries) != total_entries:
+        raise ValueError(f"Central directory không khớp: đọc được {len(entries)}/{total_entries} entry")
+    return {"entries": entries, "zip64": zip64}
+
+def _zip64_sizes(extra: bytes, usize: int, csize: int):
+    i = 0
+    while i + 4 <= len(extra):
+        hid, hlen = struct.unpack("<HH", extra[i:i + 4])
+        body = extra[i + 4:i + 4 + hlen]
+        if hid == 0x0001:
+            j = 0
+            if usize == 0xFFFFFFFF and j + 8 <= len(body):
+                usize = struct.unpack("<Q", body[j:j + 8])[0]; j += 8
+            if csize == 0xFFFFFFFF and j + 8 <= len(body):
+                csize = struct.unpack("<Q", body[j:j + 8])[0]
+            break
+        i += 4 + hlen
+    return usize, csize
+
+# ================== Report ==================
+def _ratio(compressed: int, size: int):
+    return round(size / compressed, 2) if compressed else None
+
+def summarize_entries(entries: list) -> dict:
+    """Tổng hợp số entry, dung lượng, tỉ lệ nén và các cặp XML/_content.txt theo thư mục."""
+    files = [e for e in entries if not e["is_dir"]]
+    total_u = sum(e["file_size"] for e in files)
+    total_c = sum(e["compressed_size"] for e in files)
+
+    by_dir = defaultdict(lambda: {"xml": {}, "txt": {}})
+    for e in files:
+        d, base = os.path.split(e["name"])
+        low = base.lower()
+        if low.endswith("_content.txt"):
+            by_dir[d]["txt"][low[:-len("_content.txt")]] = e
+        elif low.endswith(".xml"):
+            by_dir[d]["xml"][low[:-len(".xml")]] = e
+
+    folders, unpaired_xml, unpaired_txt = [], [], []
+    xml_count = txt_count = 0
+    for d in sorted(by_dir):
+        xmls, txts = by_dir[d]["xml"], by_dir[d]["txt"]
+        xml_count += len(xmls)
+        txt_count += len(txts)
+        pairs = []
+        for key in sorted(set(xmls) & set(txts)):
+            x, t = xmls[key], txts[key]
+            pairs.append({
+                "base": os.path.basename(x["name"])[:-len(".xml")],
+                "xml_size": x["file_size"],
+                "txt_size": t["file_size"],
+                "txt_compressed": t["compressed_size"],
+                "txt_ratio": _ratio(t["compressed_size"], t["file_size"]),
+            })
+        unpaired_xml += [xmls[k]["name"] for k in sorted(set(xmls) - set(txts))]
+        unpaired_txt += [txts[k]["name"] for k in sorted(set(txts) - set(xmls))]
+        folders.append({
+            "dir": d or ".",
+            "pairs": pairs,
+            "pair_count": len(pairs),
+            "txt_bytes": sum(p["txt_size"] for p in pairs),
+        })
+
+    names = [e["name"] for e in entries]
+    return {
+        "num_entries_in_zip": len(entries),
+        "sample_first_10": names[:10],
+        "file_count": len(files),
+        "dir_count": len(entries) - len(files),
+        "total_uncompressed": total_u,
+        "total_compressed": total_c,
+        "compression_ratio": _ratio(total_c, total_u),
+        "xml_count": xml_count,
+        "txt_count": txt_count,
+        "pair_count": sum(f["pair_count"] for f in folders),
+        "folders": [f for f in folders if f["pair_count"]],
+        "unpaired_xml": unpaired_xml[:20],
+        "unpaired_txt": unpaired_txt[:20],
+    }
+
+def analyze_zip_ranges(reader) -> dict:
+    """Phân tích ZIP qua range reader; kết quả cùng dạng với app.analyze_zip_stream."""
+    t0 = time.time()
+    try:
+        cd = read_central_directory(reader)
+        summary = summarize_entries(cd["entries"])
+        summary["zip64"] = cd["zip64"]
+        summary["zip_size"] = reader.size
+        summary["io_bytes"] = reader.io_bytes
+        return {"ok": True, "elapsed_sec": round(time.time() - t0, 3), "summary": summary}
+    except RangeNotSupported:
+        raise
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
@@ -0,0 +1,250 @@
+# zip_stream.py — giải nén ZIP theo luồng (đọc local file header khi byte còn đang tới)
+# Chỉ ghi ra đĩa member cần (do `want` quyết định), bỏ qua phần còn lại; không lưu lại byte ZIP.
+import os
+import struct
+import zlib
+
+LOCAL_SIG = b"PK\x03\x04"
+DESCRIPTOR_SIG = b"PK\x07\x08"
+CENTRAL_SIGS = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06")
+EOCD_SIG = b"PK\x05\x06"
+EOCD64_LOC_SIG = b"PK\x06\x07"
+
+LOCAL_SIZE = 30
+EOCD_SIZE = 22
+TAIL_MAX = EOCD_SIZE + 0xFFFF + 20 + 56  # đủ chứa EOCD (+comment) và ZIP64 locator/record
+OUT_STEP = 4 * 1024 * 1024               # mỗi lần inflate tối đa 4MB output -> RAM có giới hạn
+
+class StreamUnsupported(Exception):
+    """ZIP không giải nén theo luồng được (mã hóa, method lạ, stored + data descriptor...)."""
+
+def _member_path(outdir: str, name: str) -> str:
+    """Giống zipfile.ZipFile.extract: bỏ ổ đĩa, '', '.', '..' -> không thoát ra ngoài outdir."""
+    arcname = os.path.splitdrive(name.replace("/", os.path.sep))[1]
+    parts = [x for x in arcname.split(os.path.sep) if x not in ("", os.path.curdir, os.path.pardir)]
+    return os.path.join(outdir, *parts)
+
+def _zip64_extra(extra: bytes, usize: int, csize: int):
+    i = 0
+    while i + 4 <= len(extra):
+        hid, hlen = struct.unpack("<HH", extra[i:i + 4])
+        body = extra[i + 4:i + 4 + hlen]
+        if hid == 0x0001:
+            j = 0
+            if usize == 0xFFFFFFFF and j + 8 <= len(body):
+                usize = struct.unpack("<Q", body[j:j + 8])[0]; j += 8
+            if csize == 0xFFFFFFFF and j + 8 <= len(body):
+                csize = struct.unpack("<Q", body[j:j + 8])[0]
+            return usize, csize, True
+        i += 4 + hlen
+    return usize, csize, False
+
+class _Member:
+    __slots__ = ("name", "flags", "method", "crc", "csize", "usize", "zip64", "want",
+                 "path", "fh", "dec", "remaining", "crc_calc", "out_bytes", "pay_as_written")
+
+class StreamExtractor:
+    """
+    feed(bytes) nhiều lần theo đúng thứ tự byte của file ZIP, rồi finish().
+    want(name) -> bool: có ghi member ra outdir không.
+    reserve(n): gọi trước khi ghi thêm n byte ra đĩa (vd. giữ chỗ): 1 lần với cả dung lượng member,
+      member có data descriptor (chưa biết dung lượng) thì trước mỗi đoạn giải nén.
+    """
+    def __init__(self, outdir: str, want=None, reserve=None):
+        self.outdir = outdir
+        self.want = want or (lambda name: True)
+        self.reserve = reserve
+        self.state = "header"
+        self.entries = 0
+        self.extracted = []
+        self.members = []   # [(tên, size, crc)] member đã ghi ra đĩa -> bundle_manifest
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_written = 0   # byte đã ghi ra đĩa, kể cả member đang ghi dở
+        self._buf = bytearray()
+        self._tail = b""
+        self._m = None
+
+    # ---------- public ----------
+    def feed(self, data: bytes):
+        self.bytes_in += len(data)
+        if self.state == "central":
+            self._tail = (self._tail + data)[-TAIL_MAX:]
+            return
+        self._buf += data
+        while self._step():
+            pass
+
+    def finish(self) -> dict:
+        """Kiểm tra đã tới central directory và số entry khớp EOCD; trả tóm tắt."""
+        if self.state != "central":
+            self._close_member()
+            raise ValueError("ZIP bị cắt cụt: chưa tới central directory")
+        pos = self._tail.rfind(EOCD_SIG)
+        if pos < 0 or len(self._tail) - pos < EOCD_SIZE:
+            raise ValueError("Không tìm thấy End-of-Central-Directory")
+        total = struct.unpack("<H", self._tail[pos + 10:pos + 12])[0]
+        if total == 0xFFFF and pos >= 20 and self._tail[pos - 20:pos - 16] == EOCD64_LOC_SIG:
+            # ZIP64: EOCD64 nằm ngay trước locator; số entry ở offset 32
+            rec = pos - 20 - 56
+            if rec >= 0:
+                total = struct.unpack("<Q", self._tail[rec + 32:rec + 40])[0]
+        if total != self.entries:
+            raise ValueError(f"Số entry không khớp: đọc được {self.entries}, EOCD ghi {total}")
+        return {"num_entries_in_zip": self.entries, "extracted": list(self.extracted),
+                "members": list(self.members),
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+    def abort(self):
+        self._close_member()
+
+    # ---------- parser ----------
+    def _step(self) -> bool:
+        """Xử lý được 1 bước thì trả True; thiếu byte thì trả False (chờ feed tiếp)."""
+        if self.state == "header":
+            return self._parse_header()
+        if self.state == "data":
+            return self._parse_data()
+        if self.state == "descriptor":
+            return self._parse_descriptor()
+        return False
+
+    def _parse_header(self) -> bool:
+        buf = self._buf
+        if len(buf) < 4:
+            return False
+        sig = bytes(buf[:4])
+        if sig in CENTRAL_SIGS:
+            self.state = "central"
+            self._tail = bytes(buf[-TAIL_MAX:])
+            self._buf = bytearray()
+            return False
+        if sig != LOCAL_SIG:
+            raise ValueError("Dữ liệu không phải ZIP hoặc bị hỏng (thiếu local file header)")
+        if len(buf) < LOCAL_SIZE:
+            return False
+        (_, _, flags, method, _, _, crc, csize, usize, n_len, e_len) = struct.unpack(
+            "<4sHHHHHIIIHH", bytes(buf[:LOCAL_SIZE]))
+        if len(buf) < LOCAL_SIZE + n_len + e_len:
+            return False
+        name_b = bytes(buf[LOCAL_SIZE:LOCAL_SIZE + n_len])
+        extra = bytes(buf[LOCAL_SIZE + n_len:LOCAL_SIZE + n_len + e_len])
+        del buf[:LOCAL_SIZE + n_len + e_len]
+
+        m = _Member()
+        m.name = name_b.decode("utf-8" if flags & 0x800 else "cp437", errors="replace")
+        m.flags, m.method, m.crc = flags, method, crc
+        m.usize, m.csize, m.zip64 = _zip64_extra(extra, usize, csize)
+        m.want = not m.name.endswith("/") and self.want(m.name)
+        m.fh, m.dec, m.crc_calc, m.out_bytes = None, None, 0, 0
+        m.pay_as_written = False
+        if flags & 0x1:
+            raise StreamUnsupported(f"Member mã hóa: {m.name}")
+        if method not in (0, 8):
+            raise StreamUnsupported(f"Method nén {method} chưa hỗ trợ: {m.name}")
+        has_descriptor = bool(flags & 0x8)
+        if has_descriptor and method == 0:
+            raise StreamUnsupported(f"Member stored + data descriptor không xác định được độ dài: {m.name}")
+        m.remaining = None if has_descriptor else m.csize
+        if method == 8:
+            m.dec = zlib.decompressobj(-15)
+        if m.want:
+            if self.reserve and not has_descriptor:
+                self.reserve(m.usize)
+            m.pay_as_written = bool(self.reserve) and has_descriptor
+            m.path = _member_path(self.outdir, m.name)
+            os.makedirs(os.path.dirname(m.path), exist_ok=True)
+            m.fh = open(m.path, "wb")
+        self._m = m
+        self.entries += 1
+        self.state = "data"
+        return True
+
+    def _emit(self, m: _Member, out: bytes):
+        if not out:
+            return
+        m.crc_calc = zlib.crc32(out, m.crc_calc)
+        m.out_bytes += len(out)
+        if m.fh is not None:
+            if m.pay_as_written:
+                self.reserve(len(out))
+            m.fh.write(out)
+            self.bytes_written += len(out)
+
+    def _inflate(self, m: _Member, data: bytes):
+        while data:
+            try:
+                out = m.dec.decompress(data, OUT_STEP)
+            except zlib.error as e:
+                raise ValueError(f"Dữ liệu nén hỏng ({m.name}): {e}")
+            self._emit(m, out)
+            data = m.dec.unconsumed_tail
+            if m.dec.eof:
+                return
+
+    def _parse_data(self) -> bool:
+        m, buf = self._m, self._buf
+        if m.remaining is not None:
+            if not buf and m.remaining:
+                return False
+            take = min(len(buf), m.remaining)
+            piece = bytes(buf[:take])
+            del buf[:take]
+            m.remaining -= take
+            if m.dec is not None:
+                self._inflate(m, piece)
+            else:
+                self._emit(m, piece)
+            if m.remaining:
+                return False
+            if m.dec is not None and not m.dec.eof:
+                try:
+                    self._emit(m, m.dec.flush())
+                except zlib.error as e:
+                    raise ValueError(f"Dữ liệu nén hỏng ({m.name}): {e}")
+            return self._end_member(m.crc, m.usize)
+        # Có data descriptor: inflate tới hết stream deflate mới biết member dài bao nhiêu
+        if not buf:
+            return False
+        data = bytes(buf)
+        self._buf = bytearray()
+        self._inflate(m, data)
+        if not m.dec.eof:
+            return False
+        self._buf = bytearray(m.dec.unused_data)
+        self.state = "descriptor"
+        return True
+
+    def _parse_descriptor(self) -> bool:
+        m, buf = self._m, self._buf
+        if len(buf) < 4:
+            return False
+        skip = 4 if bytes(buf[:4]) == DESCRIPTOR_SIG else 0
+        need = skip + (20 if m.zip64 else 12)
+        if len(buf) < need:
+            return False
+        if m.zip64:
+            crc, _, usize = struct.unpack("<IQQ", bytes(buf[skip:need]))
+        else:
+            crc, _, usize = struct.unpack("<III", bytes(buf[skip:need]))
+        del buf[:need]
+        return self._end_member(crc, usize)
+
+    def _end_member(self, crc: int, usize: int) -> bool:
+        m = self._m
+        self._close_member()
+        if (m.crc_calc & 0xFFFFFFFF) != crc or m.out_bytes != usize:
+            raise ValueError(f"Member hỏng (CRC/kích thước không khớp): {m.name}")
+        if m.want:
+            self.extracted.append(m.name)
+            self.members.append((m.name, m.out_bytes, crc))
+            self.bytes_out += m.out_bytes
+        self._m = None
+        self.state = "header"
+        return True
+
+    def _close_member(self):
+        m = self._m
+        if m is not None and m.fh is not None:
+            m.fh.close()
+            m.fh = None